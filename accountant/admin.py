@@ -2,7 +2,9 @@ from django.contrib import admin
 from treebeard.admin import TreeAdmin
 from treebeard.forms import movenodeform_factory
 
-from .models import Account, Sheaf, Transaction, Document, Invoice
+from .models import Account, Sheaf, Transaction, Document, Invoice, \
+    DailyBalance, TreeSheaf, ExchangeRate, PeriodClose, Checkpoint, \
+    ItemCategory, ImportJob
 
 
 class AccountAdmin(TreeAdmin):
@@ -30,9 +32,46 @@ class DocumentInline(admin.TabularInline):
 class InvoiceAdmin(admin.ModelAdmin):
     list_display = ('timestamp', 'user', 'comment', 'verify')
     inlines = (TransactionInline, DocumentInline)
+    search_fields = ('fiscal_drive_number',)
 
 admin.site.register(Invoice, InvoiceAdmin)
 
 
 admin.site.register(Sheaf)
+admin.site.register(DailyBalance)
+admin.site.register(TreeSheaf)
 admin.site.register(Document)
+
+
+class ExchangeRateAdmin(admin.ModelAdmin):
+    list_display = ('date', 'currency', 'rate')
+    list_filter = ('currency',)
+
+admin.site.register(ExchangeRate, ExchangeRateAdmin)
+
+
+class CheckpointInline(admin.TabularInline):
+    model = Checkpoint
+    extra = 0
+
+
+class PeriodCloseAdmin(admin.ModelAdmin):
+    list_display = ('date', 'user', 'created')
+    inlines = (CheckpointInline,)
+
+admin.site.register(PeriodClose, PeriodCloseAdmin)
+
+
+class ItemCategoryAdmin(admin.ModelAdmin):
+    list_display = ('name', 'account', 'unit', 'updated')
+    search_fields = ('name',)
+
+admin.site.register(ItemCategory, ItemCategoryAdmin)
+
+
+class ImportJobAdmin(admin.ModelAdmin):
+    list_display = ('created', 'user', 'status', 'imported', 'processed',
+                    'finished')
+    list_filter = ('status',)
+
+admin.site.register(ImportJob, ImportJobAdmin)
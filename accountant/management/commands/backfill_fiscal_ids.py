@@ -0,0 +1,101 @@
+from datetime import datetime
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from accountant.misc import fns_parser
+from accountant.misc.receipt_import import iter_archive
+from accountant.models import Document, Invoice
+
+# Files with receipts start with one of these bytes: JSON object or array
+# (maybe after byte order mark) or zip archive
+SIGNATURES = (b'{', b'[', b'\xef\xbb\xbf', b'PK')
+
+
+def receipts(document: Document):
+    """
+    Function decodes valid receipts from document with single receipt, JSON
+    array, NDJSON or zip archive of them. Other files give nothing.
+    """
+    file = document.file
+    try:
+        file.open('rb')
+    except (OSError, ValueError):
+        return
+    try:
+        if not file.read(3).lstrip().startswith(SIGNATURES):
+            return
+        for label, payload in iter_archive(file):
+            if isinstance(payload, Exception):
+                continue
+            try:
+                decoded = [payload] if isinstance(payload, dict) else \
+                    fns_parser.iter_receipts([payload])
+                for receipt in decoded:
+                    if fns_parser.is_valid_receipt(receipt):
+                        yield receipt
+            except ValueError:
+                continue
+    except ValueError:
+        return
+    finally:
+        file.close()
+
+
+class Command(BaseCommand):
+    help = ('Extracts fiscal identifiers of receipts from stored documents '
+            'and saves them to invoices created from the receipts, so the '
+            'receipts are not imported again. Invoice is found as the '
+            'invoice of document with one receipt or as the only invoice '
+            'without identifiers dated by date and time of receipt')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true',
+                            help='report invoices without saving them')
+
+    def handle(self, *args, **options):
+        found, assigned = dict(), set()
+        filled = duplicates = unmatched = 0
+        with transaction.atomic():
+            for document in Document.objects.order_by('pk').iterator():
+                items = list(receipts(document))
+                for receipt in items:
+                    key = fns_parser.fiscal_id(receipt)
+                    if len(items) == 1 and document.invoice_id is not None:
+                        candidates = [document.invoice_id]
+                    else:
+                        candidates = list(Invoice.objects.filter(
+                            timestamp=datetime.fromtimestamp(
+                                receipt['dateTime'], fns_parser.tz),
+                            fiscal_sign=None
+                        ).exclude(pk__in=assigned)
+                            .values_list('pk', flat=True)[:2])
+                    if len(candidates) != 1 or candidates[0] in assigned:
+                        unmatched += 1
+                        continue
+
+                    invoice = candidates[0]
+                    if key not in found:
+                        found.update(Invoice.objects.receipts([key]))
+                    if found.get(key, invoice) != invoice:
+                        duplicates += 1
+                        self.stderr.write(
+                            'invoices {} and {} are created from the same '
+                            'receipt, one of them should be deleted'
+                            .format(found[key], invoice)
+                        )
+                        continue
+                    if key in found:
+                        continue
+                    found[key] = invoice
+                    assigned.add(invoice)
+                    filled += 1
+                    if not options['dry_run']:
+                        Invoice.objects.filter(pk=invoice).update(
+                            **dict(zip(Invoice.FISCAL_FIELDS, key)))
+
+        self.stdout.write(self.style.SUCCESS(
+            '{} invoices {}, {} duplicates, {} receipts without invoice'
+            .format(filled, 'found' if options['dry_run'] else 'filled',
+                    duplicates, unmatched)
+        ))
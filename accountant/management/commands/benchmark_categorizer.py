@@ -0,0 +1,76 @@
+from time import perf_counter
+
+from django.core.management.base import BaseCommand
+
+from accountant.misc.categorizer import Categorizer, threshold
+from accountant.models import Account, Transaction
+
+
+class Command(BaseCommand):
+    help = ('Replays history of expense transactions with comments: every '
+            'item is categorized with names seen before it and then added '
+            'to the index. Accuracy and time of guessing are compared with '
+            'exact matching of names')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int,
+                            help='number of the latest transactions replayed')
+        parser.add_argument('--threshold', type=float,
+                            help='confidence below which guesses are ignored')
+        parser.add_argument('--skip', type=int, nargs='*', default=[],
+                            help='accounts that are never guessed, like the '
+                                 'default expense one')
+
+    def handle(self, *args, **options):
+        minimum = options['threshold'] if options['threshold'] is not None \
+            else threshold()
+        skip = set(options['skip'])
+        history = Transaction.objects\
+            .filter(account__type=Account.EXPENSE)\
+            .exclude(comment='')\
+            .order_by('date', 'pk')\
+            .values_list('comment', 'account', 'unit')
+        if options['limit']:
+            count = history.count()
+            history = history[max(count - options['limit'], 0):]
+
+        categorizer = Categorizer()
+        exact = dict()
+        items = exact_hits = guessed = hits = 0
+        timings = list()
+        for comment, account_id, unit in history.iterator():
+            if account_id not in skip:
+                items += 1
+                exact_hits += exact.get(comment) == account_id
+                started = perf_counter()
+                guess = categorizer.categorize(comment, skip=skip)
+                timings.append(perf_counter() - started)
+                if guess is not None and guess.confidence >= minimum:
+                    guessed += 1
+                    hits += guess.account_id == account_id
+            exact[comment] = account_id
+            categorizer.add(comment, account_id, unit)
+
+        if not items:
+            self.stdout.write(self.style.WARNING('no categorized items'))
+            return
+
+        timings.sort()
+        self.stdout.write('items\t{}'.format(items))
+        self.stdout.write('names in index\t{}'.format(len(categorizer)))
+        self.stdout.write('exact matching accuracy\t{:.1%}'
+                          .format(exact_hits / items))
+        self.stdout.write('fuzzy matching accuracy\t{:.1%}'
+                          .format(hits / items))
+        self.stdout.write('fuzzy matching precision\t{:.1%}'
+                          .format(hits / guessed if guessed else 0))
+        self.stdout.write('guessed with confidence >= {}\t{:.1%}'
+                          .format(minimum, guessed / items))
+        self.stdout.write('mean time\t{:.0f} µs'.format(
+            sum(timings) / len(timings) * 10 ** 6))
+        self.stdout.write('99th percentile time\t{:.0f} µs'.format(
+            timings[int(len(timings) * 0.99)] * 10 ** 6))
+        self.stdout.write(self.style.SUCCESS(
+            '{} of {} items categorized right, {} with exact matching'
+            .format(hits, items, exact_hits)
+        ))
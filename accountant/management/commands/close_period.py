@@ -0,0 +1,36 @@
+from datetime import date, datetime, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+
+from accountant.models import PeriodClose
+
+
+class Command(BaseCommand):
+    help = ('Closes period of the ledger and freezes closing balances of all '
+            'accounts, by default till the end of previous month')
+
+    def add_arguments(self, parser):
+        parser.add_argument('date', nargs='?',
+                            help='last date of period like 2017-09-30')
+        parser.add_argument('--reopen', action='store_true',
+                            help='reopen all periods closed since the date')
+
+    def handle(self, *args, **options):
+        if options['date']:
+            day = datetime.strptime(options['date'], '%Y-%m-%d').date()
+        else:
+            day = date.today().replace(day=1) - timedelta(days=1)
+
+        if options['reopen']:
+            deleted, _ = PeriodClose.reopen(day)
+            self.stdout.write(self.style.SUCCESS(
+                '{} objects removed'.format(deleted)))
+            return
+
+        try:
+            period = PeriodClose.close(day)
+        except ValueError as e:
+            raise CommandError(str(e))
+        self.stdout.write(self.style.SUCCESS(
+            'Period till {} closed with {} checkpoints'.format(
+                period.date, period.checkpoints.count())))
@@ -0,0 +1,54 @@
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from accountant.misc import export
+from accountant.models import Account
+
+
+def _date(value: str):
+    return datetime.strptime(value, '%Y-%m-%d').date()
+
+
+class Command(BaseCommand):
+    help = ('Exports transactions of account subtree, date range and '
+            'currency to CSV, OFX or beancount file')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=export.FORMATS,
+                            default=export.CSV)
+        parser.add_argument('--account', type=int,
+                            help='primary key of account which subtree is '
+                                 'exported, all accounts by default')
+        parser.add_argument('--start', type=_date,
+                            help='first date like 2017-10-15')
+        parser.add_argument('--end', type=_date,
+                            help='last date like 2017-10-15')
+        parser.add_argument('--currency', help='code of currency like RUB')
+        parser.add_argument('--output', '-o',
+                            help='file to write, standard output by default')
+
+    def handle(self, *args, **options):
+        filters = {name: options[name]
+                   for name in ('start', 'end', 'currency')
+                   if options[name] is not None}
+        if options['account'] is not None:
+            try:
+                filters['account'] = Account.objects.get(pk=options['account'])
+            except Account.DoesNotExist:
+                raise CommandError('account {} does not exist'
+                                   .format(options['account']))
+
+        chunks = export.export(options['format'], **filters)
+        if options['output'] is None:
+            for chunk in chunks:
+                self.stdout.write(chunk, ending='')
+            return
+
+        with open(options['output'], 'w', encoding='utf-8',
+                  newline='') as output:
+            for chunk in chunks:
+                output.write(chunk)
+        self.stderr.write(self.style.SUCCESS(
+            'transactions exported to {}'.format(options['output'])
+        ))
@@ -0,0 +1,45 @@
+import os
+
+from django.contrib.auth.models import User
+from django.core.files import File
+from django.core.management.base import BaseCommand, CommandError
+
+from accountant.misc import receipt_import
+
+
+class Command(BaseCommand):
+    help = ('Imports receipts from zip archive, JSON array or NDJSON file '
+            'with a pool of workers, bad receipts are reported and skipped')
+
+    def add_arguments(self, parser):
+        parser.add_argument('file', help='zip, JSON or NDJSON file')
+        parser.add_argument('--user', required=True,
+                            help='username of owner of invoices')
+        parser.add_argument('--workers', type=int,
+                            help='number of workers, RECEIPT_IMPORT_WORKERS '
+                                 'setting by default')
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options['user'])
+        except User.DoesNotExist:
+            raise CommandError('user {} does not exist'
+                               .format(options['user']))
+        try:
+            with open(options['file'], 'rb') as file:
+                job = receipt_import.create(
+                    File(file, name=os.path.basename(file.name)), user
+                )
+        except OSError as e:
+            raise CommandError(e)
+
+        # the command isn't run by web server, so workers can be forked
+        job = receipt_import.run(job, options['workers'], processes=True)
+        for error in job.error_list:
+            self.stderr.write('{}: {}'.format(error['receipt'],
+                                              error['message']))
+        style = self.style.SUCCESS if job.status == job.DONE \
+            else self.style.ERROR
+        self.stdout.write(style('{} of {} receipts imported, job {} is {}'
+                                .format(job.imported, job.processed, job.pk,
+                                        job.status)))
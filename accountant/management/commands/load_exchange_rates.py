@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from accountant.misc import rates
+
+
+class Command(BaseCommand):
+    help = ('Loads exchange rates from XML dumps of Central Bank of Russia '
+            'or CSV files with currency, date and rate in every line')
+
+    def add_arguments(self, parser):
+        parser.add_argument('files', nargs='+',
+                            help='*.xml or *.csv files with rates')
+
+    def handle(self, *args, **options):
+        loaded = list()
+        for file_name in options['files']:
+            if file_name.lower().endswith('.xml'):
+                loaded.extend(rates.parse_cbr_xml(file_name))
+            elif file_name.lower().endswith('.csv'):
+                with open(file_name, newline='') as csv_file:
+                    loaded.extend(rates.parse_csv(csv_file))
+            else:
+                raise CommandError('unknown format of {}'.format(file_name))
+
+        self.stdout.write(self.style.SUCCESS(
+            '{} rates loaded'.format(rates.store(loaded))
+        ))
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from accountant.misc import ledger
+from accountant.models import Account
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds sheaves and daily balances from transactions'
+
+    def add_arguments(self, parser):
+        parser.add_argument('accounts', nargs='*', type=int,
+                            help='ids of accounts to rebuild (default: all)')
+        parser.add_argument('--dry-run', action='store_true', dest='dry_run',
+                            help='report differences without fixing them')
+
+    def handle(self, *args, **options):
+        accounts = None
+        if options['accounts']:
+            accounts = Account.objects.filter(pk__in=options['accounts'])
+
+        diffs = ledger.rebuild(accounts, dry_run=options['dry_run'])
+        for diff in diffs:
+            self.stdout.write('{account}\t{currency}\t{old}\t{new}'
+                              .format(**diff._asdict()))
+        self.stdout.write(self.style.SUCCESS(
+            '{} sheaves {}'.format(
+                len(diffs), 'differ' if options['dry_run'] else 'fixed')
+        ))
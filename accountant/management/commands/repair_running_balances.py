@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from accountant.models import Transaction
+
+
+class Command(BaseCommand):
+    help = 'Recalculates running balances of transactions'
+
+    def add_arguments(self, parser):
+        parser.add_argument('accounts', nargs='*', type=int,
+                            help='ids of accounts to repair (default: all)')
+
+    def handle(self, *args, **options):
+        transactions = Transaction.objects.all()
+        if options['accounts']:
+            transactions = transactions.filter(account__in=options['accounts'])
+
+        fixed = transactions.repair_balances()
+        self.stdout.write(self.style.SUCCESS(
+            '{} transactions fixed'.format(fixed)
+        ))
@@ -0,0 +1,37 @@
+import os
+
+from django.core.management.base import BaseCommand
+
+from accountant.misc import ledger
+
+
+class Command(BaseCommand):
+    help = ('Checks sheaves, daily balances, subtree totals and running '
+            'balances against transactions and reports unbalanced invoices')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                            help='number of trees checked concurrently')
+        parser.add_argument('--repair', action='store_true',
+                            help='rebuild trees with wrong balances')
+
+    def handle(self, *args, **options):
+        report = ledger.verify(workers=options['workers'],
+                               repair=options['repair'])
+
+        for mismatch in report.mismatches:
+            self.stdout.write('{kind}\t{key}\t{actual}\t{expected}'
+                              .format(**mismatch._asdict()))
+        for invoice in report.unbalanced_invoices:
+            self.stdout.write('invoice\t{invoice}\t{amount}\t{currency}'
+                              .format(**invoice))
+
+        message = '{} wrong balances, {} wrong running balances, ' \
+                  '{} unbalanced invoices'.format(
+                      len(report.mismatches), report.running_balances,
+                      len(report.unbalanced_invoices))
+        if report.mismatches or report.running_balances or \
+                report.unbalanced_invoices:
+            self.stdout.write(self.style.WARNING(message))
+        else:
+            self.stdout.write(self.style.SUCCESS(message))
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 08:43
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+import djmoney.models.fields
+from decimal import Decimal
+from django.db.models import Sum
+
+
+def fill_daily_balances(apps, schema_editor):
+    Transaction = apps.get_model('accountant', 'Transaction')
+    DailyBalance = apps.get_model('accountant', 'DailyBalance')
+
+    balances = dict()
+    daily_balances = list()
+    for item in Transaction.objects.filter(approved=True)\
+            .values('account', 'currency', 'date')\
+            .annotate(amount=Sum('amount'))\
+            .order_by('account', 'currency', 'date'):
+        key = (item['account'], item['currency'])
+        balances[key] = balances.get(key, Decimal(0)) + item['amount']
+        daily_balances.append(DailyBalance(account_id=item['account'],
+                                           currency=item['currency'],
+                                           date=item['date'],
+                                           amount=balances[key]))
+    DailyBalance.objects.bulk_create(daily_balances, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accountant', '0003_invoiceless_document'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyBalance',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(verbose_name='date')),
+                ('amount', models.DecimalField(decimal_places=5, max_digits=50, verbose_name='closing balance')),
+                ('currency', djmoney.models.fields.CurrencyField(default='RUB', max_length=3, verbose_name='currency')),
+                ('account', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_balances', to='accountant.Account', verbose_name='account')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='dailybalance',
+            unique_together=set([('account', 'currency', 'date')]),
+        ),
+        migrations.RunPython(fill_daily_balances, migrations.RunPython.noop),
+    ]
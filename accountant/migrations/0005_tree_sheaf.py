@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 08:47
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+import djmoney.models.fields
+from decimal import Decimal
+
+
+def fill_tree_sheaves(apps, schema_editor):
+    Account = apps.get_model('accountant', 'Account')
+    Sheaf = apps.get_model('accountant', 'Sheaf')
+    TreeSheaf = apps.get_model('accountant', 'TreeSheaf')
+
+    accounts = Account.objects.order_by('tree_id', 'lft')\
+        .values_list('pk', 'tree_id', 'lft', 'rgt')
+    ancestors = dict()
+    stack = list()
+    for pk, tree_id, lft, rgt in accounts:
+        while stack and (stack[-1][1] != tree_id or stack[-1][2] < lft):
+            stack.pop()
+        stack.append((pk, tree_id, rgt))
+        ancestors[pk] = [i[0] for i in stack]
+
+    totals = dict()
+    for account_id, currency, amount in Sheaf.objects\
+            .values_list('account', 'currency', 'amount'):
+        for pk in ancestors[account_id]:
+            key = (pk, currency)
+            totals[key] = totals.get(key, Decimal(0)) + amount
+    TreeSheaf.objects.bulk_create(
+        [TreeSheaf(account_id=account_id, currency=currency, amount=amount)
+         for (account_id, currency), amount in totals.items()],
+        batch_size=500
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accountant', '0004_daily_balance'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TreeSheaf',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('amount', models.DecimalField(decimal_places=5, max_digits=50, verbose_name='subtree total')),
+                ('currency', djmoney.models.fields.CurrencyField(default='RUB', max_length=3, verbose_name='currency')),
+                ('account', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='tree_sheaves', to='accountant.Account', verbose_name='account')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='treesheaf',
+            unique_together=set([('account', 'currency')]),
+        ),
+        migrations.RunPython(fill_tree_sheaves, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 08:49
+from __future__ import unicode_literals
+
+from decimal import Decimal
+from django.db import migrations, models
+
+from accountant.misc.db import bulk_set, BATCH_SIZE
+
+
+def fill_balances(apps, schema_editor):
+    Transaction = apps.get_model('accountant', 'Transaction')
+
+    # balances are written with one CASE update per batch, rows with zero
+    # balance keep the default
+    key, balance, values = None, Decimal(0), dict()
+    for pk, account_id, currency, amount, approved in Transaction.objects\
+            .order_by('account', 'currency', 'date', 'pk')\
+            .values_list('pk', 'account', 'currency', 'amount', 'approved')\
+            .iterator():
+        if key != (account_id, currency):
+            key, balance = (account_id, currency), Decimal(0)
+        if approved:
+            balance += amount
+        if balance:
+            values[pk] = balance
+        if len(values) >= BATCH_SIZE:
+            bulk_set(Transaction, 'balance', values)
+            values = dict()
+    bulk_set(Transaction, 'balance', values)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accountant', '0005_tree_sheaf'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='transaction',
+            name='balance',
+            field=models.DecimalField(decimal_places=5, default=Decimal('0'), editable=False, max_digits=50, verbose_name='balance after transaction'),
+        ),
+        migrations.AlterIndexTogether(
+            name='transaction',
+            index_together=set([('account', 'currency', 'date', 'id')]),
+        ),
+        migrations.RunPython(fill_balances, migrations.RunPython.noop),
+    ]
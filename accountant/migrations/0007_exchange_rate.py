@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 08:57
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import djmoney.models.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accountant', '0006_running_balance'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExchangeRate',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('currency', djmoney.models.fields.CurrencyField(default='XYZ', max_length=3, verbose_name='currency')),
+                ('date', models.DateField(verbose_name='date')),
+                ('rate', models.DecimalField(decimal_places=10, max_digits=50, verbose_name='rate')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='exchangerate',
+            unique_together=set([('currency', 'date')]),
+        ),
+    ]
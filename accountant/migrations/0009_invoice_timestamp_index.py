@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 09:01
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accountant', '0008_period_close'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='invoice',
+            name='timestamp',
+            field=models.DateTimeField(db_index=True, verbose_name='date and time'),
+        ),
+    ]
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+TABLES = ('accountant_transaction', 'accountant_invoice')
+
+SQLITE_CREATE = (
+    """CREATE VIRTUAL TABLE {table}_fts USING fts5(
+        comment, content='{table}', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    )""",
+    """CREATE TRIGGER {table}_fts_insert AFTER INSERT ON {table} BEGIN
+        INSERT INTO {table}_fts(rowid, comment) VALUES (new.id, new.comment);
+    END""",
+    """CREATE TRIGGER {table}_fts_delete AFTER DELETE ON {table} BEGIN
+        INSERT INTO {table}_fts({table}_fts, rowid, comment)
+        VALUES ('delete', old.id, old.comment);
+    END""",
+    """CREATE TRIGGER {table}_fts_update AFTER UPDATE OF comment ON {table}
+    BEGIN
+        INSERT INTO {table}_fts({table}_fts, rowid, comment)
+        VALUES ('delete', old.id, old.comment);
+        INSERT INTO {table}_fts(rowid, comment) VALUES (new.id, new.comment);
+    END""",
+    "INSERT INTO {table}_fts({table}_fts) VALUES ('rebuild')",
+)
+
+SQLITE_DROP = (
+    'DROP TRIGGER IF EXISTS {table}_fts_insert',
+    'DROP TRIGGER IF EXISTS {table}_fts_delete',
+    'DROP TRIGGER IF EXISTS {table}_fts_update',
+    'DROP TABLE IF EXISTS {table}_fts',
+)
+
+POSTGRES_CREATE = (
+    """CREATE INDEX {table}_comment_fts ON {table}
+    USING gin (to_tsvector('simple', comment))""",
+)
+
+POSTGRES_DROP = (
+    'DROP INDEX IF EXISTS {table}_comment_fts',
+)
+
+
+def run(scripts):
+    def operation(apps, schema_editor):
+        statements = scripts.get(schema_editor.connection.vendor, ())
+        for table in TABLES:
+            for statement in statements:
+                schema_editor.execute(statement.format(table=table))
+    return operation
+
+
+class Migration(migrations.Migration):
+    """
+    Full-text index over comments of transactions and invoices. SQLite keeps
+    external content FTS5 tables in sync by triggers, PostgreSQL uses GIN
+    indexes over tsvector of comment. Other databases have no index, search
+    falls back to plain substring lookups there.
+    """
+
+    dependencies = [
+        ('accountant', '0010_version_stamp'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            run({'sqlite': SQLITE_CREATE, 'postgresql': POSTGRES_CREATE}),
+            run({'sqlite': SQLITE_DROP, 'postgresql': POSTGRES_DROP})
+        ),
+    ]
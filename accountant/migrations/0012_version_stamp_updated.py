@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 09:17
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accountant', '0011_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='versionstamp',
+            name='updated',
+            field=models.DateTimeField(default=django.utils.timezone.now, verbose_name='updated'),
+        ),
+    ]
@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 09:26
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+EXPENSE = 2
+
+
+def fill_categories(apps, schema_editor):
+    Transaction = apps.get_model('accountant', 'Transaction')
+    ItemCategory = apps.get_model('accountant', 'ItemCategory')
+
+    # the latest transaction with some name of goods wins
+    categories = dict()
+    for comment, account_id, unit in Transaction.objects\
+            .filter(account__type=EXPENSE)\
+            .exclude(comment='')\
+            .order_by('date', 'pk')\
+            .values_list('comment', 'account', 'unit')\
+            .iterator():
+        name = ' '.join(comment.lower().split())[:255]
+        if name:
+            categories[name] = (account_id, unit)
+    ItemCategory.objects.bulk_create(
+        [ItemCategory(name=name, account_id=account_id, unit=unit)
+         for name, (account_id, unit) in categories.items()],
+        batch_size=500
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accountant', '0012_version_stamp_updated'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ItemCategory',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True, verbose_name='normalized name of goods')),
+                ('unit', models.CharField(blank=True, choices=[('pcs', 'pieces'), ('kg', 'kilos'), ('g', 'grams'), ('l', 'liters'), ('gal', 'gallons'), ('p', 'pounds')], default=None, max_length=255, null=True, verbose_name='unit of measurement')),
+                ('updated', models.DateTimeField(auto_now=True, verbose_name='updated')),
+                ('account', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='item_categories', to='accountant.Account', verbose_name='account')),
+            ],
+        ),
+        migrations.RunPython(fill_categories, migrations.RunPython.noop),
+    ]
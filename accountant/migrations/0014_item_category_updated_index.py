@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 09:29
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accountant', '0013_item_category'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='itemcategory',
+            name='updated',
+            field=models.DateTimeField(auto_now=True, db_index=True, verbose_name='updated'),
+        ),
+    ]
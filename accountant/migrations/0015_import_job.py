@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 09:36
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('accountant', '0014_item_category_updated_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('pending', 'pending'), ('running', 'running'), ('done', 'done'), ('failed', 'failed')], default='pending', max_length=16, verbose_name='status')),
+                ('processed', models.PositiveIntegerField(default=0, verbose_name='processed receipts')),
+                ('imported', models.PositiveIntegerField(default=0, verbose_name='imported receipts')),
+                ('errors', models.TextField(default='[]', editable=False, verbose_name='errors of receipts in JSON')),
+                ('created', models.DateTimeField(auto_now_add=True, verbose_name='created')),
+                ('finished', models.DateTimeField(blank=True, default=None, null=True, verbose_name='finished')),
+                ('document', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='import_jobs', to='accountant.Document', verbose_name='archive')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='import_jobs', to=settings.AUTH_USER_MODEL, verbose_name='user')),
+            ],
+            options={
+                'ordering': ['-created'],
+            },
+        ),
+    ]
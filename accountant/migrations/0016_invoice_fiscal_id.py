@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 09:41
+from __future__ import unicode_literals
+
+from importlib import import_module
+
+from django.db import migrations, models
+
+search_index = import_module('accountant.migrations.0011_search_index')
+
+
+def restore_search_triggers(apps, schema_editor):
+    # SQLite copies the table to add columns or constraints and triggers of
+    # full-text index are lost with the old table
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for statement in search_index.SQLITE_DROP[:3] + \
+            search_index.SQLITE_CREATE[1:]:
+        schema_editor.execute(statement.format(table='accountant_invoice'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accountant', '0015_import_job'),
+    ]
+
+    operations = [
+        migrations.RunPython(migrations.RunPython.noop,
+                             restore_search_triggers),
+        migrations.AddField(
+            model_name='invoice',
+            name='fiscal_document_number',
+            field=models.BigIntegerField(blank=True, null=True, verbose_name='fiscal document number'),
+        ),
+        migrations.AddField(
+            model_name='invoice',
+            name='fiscal_drive_number',
+            field=models.CharField(blank=True, max_length=32, null=True, verbose_name='fiscal drive number'),
+        ),
+        migrations.AddField(
+            model_name='invoice',
+            name='fiscal_sign',
+            field=models.BigIntegerField(blank=True, null=True, verbose_name='fiscal sign'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='invoice',
+            unique_together=set([('fiscal_drive_number', 'fiscal_document_number', 'fiscal_sign')]),
+        ),
+        migrations.RunPython(restore_search_triggers,
+                             migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 10:11
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accountant', '0017_import_job_updated'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='invoice',
+            index_together=set([('timestamp', 'id')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='transaction',
+            index_together=set([('date', 'id'), ('account', 'currency', 'date', 'id')]),
+        ),
+    ]
@@ -0,0 +1,78 @@
+from calendar import timegm
+from datetime import date
+from hashlib import md5
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+
+from accountant.models import Account, Transaction, ExchangeRate, VersionStamp
+
+# Pages built from the ledger depend on transactions and invoices, tree of
+# accounts and exchange rates
+LEDGER_STAMPS = (Transaction.VERSION, Account.VERSION, ExchangeRate.VERSION)
+
+
+def ledger_state():
+    """
+    Function returns version of the ledger and time of its last change with
+    one single query (see `VersionStamp.state`).
+    """
+    return VersionStamp.state(LEDGER_STAMPS)
+
+
+class LedgerCacheMixin:
+    """
+    Mixin for views that render pages from the ledger only. Rendered pages
+    are cached under the ledger version, so they are built again only after
+    some write to transactions, invoices, accounts or exchange rates. Pages
+    get ETag and Last-Modified headers, repeated requests of unchanged page
+    are answered with 304 after one check of version.
+
+    Pages depend on current date too, so it's a part of the version. Cache
+    timeout is set by LEDGER_CACHE_TIMEOUT setting, zero disables cache of
+    rendered pages, but not conditional responses.
+    """
+
+    def get_cache_key(self, version: str):
+        key = '{}:{}:{}:{}'.format(version, date.today().isoformat(),
+                                   self.request.user.pk,
+                                   self.request.get_full_path())
+        return 'ledger-page:{}'.format(md5(key.encode()).hexdigest())
+
+    def dispatch(self, request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return super(LedgerCacheMixin, self)\
+                .dispatch(request, *args, **kwargs)
+
+        version, updated = ledger_state()
+        key = self.get_cache_key(version)
+        etag = quote_etag(key.split(':')[-1])
+        last_modified = timegm(updated.utctimetuple()) if updated else None
+
+        response = get_conditional_response(request, etag=etag,
+                                            last_modified=last_modified)
+        if response is None:
+            cached = cache.get(key)
+            if cached is not None:
+                response = HttpResponse(cached[0], content_type=cached[1])
+            else:
+                response = super(LedgerCacheMixin, self)\
+                    .dispatch(request, *args, **kwargs)
+                if response.status_code != 200:
+                    return response
+                if hasattr(response, 'render'):
+                    response.render()
+                timeout = getattr(settings, 'LEDGER_CACHE_TIMEOUT', 3600)
+                if timeout:
+                    cache.set(key, (response.content,
+                                    response['Content-Type']), timeout)
+
+        response['ETag'] = etag
+        if last_modified is not None:
+            response['Last-Modified'] = http_date(last_modified)
+        patch_cache_control(response, private=True, max_age=0,
+                            must_revalidate=True)
+        return response
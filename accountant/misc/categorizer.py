@@ -0,0 +1,249 @@
+import heapq
+import re
+from collections import defaultdict, namedtuple
+from datetime import timedelta
+from math import log, sqrt
+
+from django.conf import settings
+
+from accountant.models import ItemCategory, VersionStamp
+
+# Numbers like 3.2 and 3,2 are kept as one token, letters and digits glued
+# together like 1л are split, so "Молоко 3.2% 1л" and "МОЛОКО 3,2% 1Л" give
+# the same tokens
+TOKEN = re.compile(r'\d+(?:[.,]\d+)?|[^\W\d_]+', re.UNICODE)
+NGRAM = 3
+
+# Features found in more than this share of names (but at least in
+# STOP_MIN names) are too common to find candidates with, their postings
+# are not scanned
+STOP_RATIO = 0.01
+STOP_MIN = 50
+
+# Number of the best candidates found by rare features that are compared
+# with the name by all features
+CANDIDATES = 20
+
+# Index is reweighted when number of names grows or shrinks by this share
+# since the last computation of idf
+REWEIGHT_RATIO = 0.1
+
+# Categories saved by other processes are looked for since the last loaded
+# change minus this margin, changes committed a bit later aren't lost
+SYNC_MARGIN = timedelta(minutes=1)
+
+Guess = namedtuple('Guess', ('account_id', 'unit', 'confidence', 'name'))
+
+# Number of previous version stamps of categories remembered to find out
+# that categories were rolled back or restored
+STAMPS = 16
+
+_cache = (None, (), None, None)
+
+
+def tokens(name: str):
+    return [token.replace(',', '.') for token in
+            TOKEN.findall((name or '').lower().replace('ё', 'е'))]
+
+
+def features(name: str):
+    """
+    Function returns set of features of name of goods: its tokens and
+    character trigrams of them padded with spaces, so short tokens and
+    beginnings of words get their own trigrams.
+    """
+    result = set()
+    for token in tokens(name):
+        result.add('#' + token)
+        padded = ' {} '.format(token)
+        result.update(padded[i:i + NGRAM]
+                      for i in range(max(len(padded) - NGRAM + 1, 1)))
+    return result
+
+
+class Categorizer:
+    """
+    Inverted index of features of names of categorized goods. Names are
+    compared by cosine similarity of their sets of features weighted with
+    idf, so rare tokens and trigrams weigh more than common ones. Weights
+    and norms of names are precomputed and updated when the index grows
+    noticeably, names are added one by one.
+
+    >>> categorizer = Categorizer()
+    >>> categorizer.add('молоко 3.2% 1л', 5, 'l')
+    >>> categorizer.categorize('МОЛОКО 3,2% 1Л')
+    Guess(account_id=5, unit='l', confidence=1.0, name='молоко 3.2% 1л')
+    """
+
+    def __init__(self):
+        self.names = dict()
+        self.postings = defaultdict(set)
+        self.idf = dict()
+        self.norms = dict()
+        self._weighted_size = 0
+
+    def __len__(self):
+        return len(self.names)
+
+    def add(self, name: str, account_id: int, unit: str = None):
+        """
+        method adds categorized name to the index or replaces its category
+        """
+        name_features = self._insert(name, account_id, unit)
+        if name_features is None:
+            return
+        if abs(len(self.names) - self._weighted_size) > \
+                self._weighted_size * REWEIGHT_RATIO:
+            self.reweight()
+        else:
+            # weights of other names stay a bit stale till the next reweight
+            for feature in name_features:
+                self.idf[feature] = self._weight(feature)
+            self.norms[ItemCategory.normalize(name)] = \
+                self._norm(name_features)
+
+    def update(self, categories):
+        """
+        method adds many categorized names, big batches are weighted once.
+        :param categories: iterable with (name, account id, unit) tuples
+        """
+        categories = list(categories)
+        if len(categories) <= len(self.names) * REWEIGHT_RATIO:
+            for category in categories:
+                self.add(*category)
+            return
+        for category in categories:
+            self._insert(*category)
+        self.reweight()
+
+    def _insert(self, name: str, account_id: int, unit: str = None):
+        # returns features of new name or None if the name is known already
+        name = ItemCategory.normalize(name)
+        if not name:
+            return None
+        if name in self.names:
+            self.names[name] = (account_id, unit) + self.names[name][2:]
+            return None
+        name_features = frozenset(features(name))
+        self.names[name] = (account_id, unit, name_features)
+        for feature in name_features:
+            self.postings[feature].add(name)
+        return name_features
+
+    def _weight(self, feature: str):
+        # smoothed idf, unknown features get the largest weight
+        size = len(self.names)
+        return log((1 + size) / (1 + len(self.postings.get(feature, ())))) + 1
+
+    def _norm(self, name_features):
+        return sqrt(sum(self.idf.get(feature, 0) ** 2
+                        for feature in name_features))
+
+    def reweight(self):
+        """
+        method computes idf of all features and norms of all names again
+        """
+        self.idf = {feature: self._weight(feature)
+                    for feature in self.postings}
+        self.norms = {name: self._norm(name_features)
+                      for name, (_, _, name_features) in self.names.items()}
+        self._weighted_size = len(self.names)
+
+    def categorize(self, name: str, skip=()):
+        """
+        method finds the most similar categorized name.
+        :param skip: accounts that shouldn't be guessed, like the default
+         expense account uncategorized goods are put into
+        :return: Guess with account, unit, confidence from 0 to 1 and found
+         name or None if nothing is similar at all
+        """
+        normalized = ItemCategory.normalize(name)
+        if normalized in self.names and \
+                self.names[normalized][0] not in skip:
+            account_id, unit, _ = self.names[normalized]
+            return Guess(account_id, unit, 1.0, normalized)
+
+        query = features(normalized)
+        if not query:
+            return None
+        limit = max(STOP_MIN, len(self.names) * STOP_RATIO)
+        unknown = self._weight(None)
+        weights = {feature: self.idf.get(feature, unknown) ** 2
+                   for feature in query}
+        scores = defaultdict(float)
+        common = None
+        for feature, weight in weights.items():
+            candidates = self.postings.get(feature)
+            if not candidates:
+                continue
+            if len(candidates) > limit:
+                if common is None or len(candidates) < len(common):
+                    common = candidates
+                continue
+            for candidate in candidates:
+                scores[candidate] += weight
+        if not scores and common is not None:
+            # all features are common, the rarest of them gives candidates
+            scores = dict.fromkeys(common, 0.0)
+
+        best, best_similarity = None, 0.0
+        if skip:
+            scores = {candidate: score for candidate, score in scores.items()
+                      if self.names[candidate][0] not in skip}
+        # candidates sharing most of rare features are compared by cosine
+        for candidate in heapq.nlargest(CANDIDATES, scores, key=scores.get):
+            name_features = self.names[candidate][2]
+            similarity = sum(weights[feature] for feature in
+                             name_features.intersection(weights)) / \
+                self.norms[candidate]
+            if similarity > best_similarity:
+                best, best_similarity = candidate, similarity
+        if best is None:
+            return None
+
+        account_id, unit, _ = self.names[best]
+        confidence = best_similarity / sqrt(sum(weights.values()))
+        return Guess(account_id, unit, min(round(confidence, 4), 1.0), best)
+
+
+def threshold():
+    """
+    Function returns confidence below which guesses are ignored (see
+    CATEGORIZER_THRESHOLD setting).
+    """
+    return getattr(settings, 'CATEGORIZER_THRESHOLD', 0.5)
+
+
+def get_categorizer():
+    """
+    Function returns `Categorizer` of this process. Its version stamps are
+    compared with the stamps in database (one query), categories saved
+    since the previous load by any process are added with one more query
+    (see `ItemCategory.VERSION`). The whole index is loaded by the first
+    call, after categories were deleted (see `ItemCategory.GENERATION`) and
+    after categories went back to one of previous states.
+    """
+    global _cache
+    generation, stamps, since, categorizer = _cache
+    stamp, current = VersionStamp.values((ItemCategory.VERSION,
+                                          ItemCategory.GENERATION))
+    if categorizer is not None and stamp == stamps[-1] and \
+            current == generation:
+        return categorizer
+    if categorizer is None or stamp in stamps or current != generation:
+        stamps, since, categorizer = (), None, Categorizer()
+
+    rows = ItemCategory.objects.order_by('updated')
+    if since is not None:
+        rows = rows.filter(updated__gte=since - SYNC_MARGIN)
+    rows = list(rows.values_list('name', 'account_id', 'unit', 'updated'))
+    categorizer.update(row[:3] for row in rows)
+    if rows:
+        since = rows[-1][3]
+    _cache = (current, stamps[-STAMPS:] + (stamp,), since, categorizer)
+    return categorizer
+
+
+def clear_cache():
+    global _cache
+    _cache = (None, (), None, None)
@@ -0,0 +1,38 @@
+from django.db.models import Case, When, Value
+
+BATCH_SIZE = 500
+
+
+def batches(items: list, size: int = BATCH_SIZE):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def bulk_set(model, field: str, values: dict, batch_size: int = BATCH_SIZE):
+    """
+    Function sets different values of one field for many rows with one
+    UPDATE query per batch.
+    :param model: model class
+    :param field: name of field to update
+    :param values: dictionary with primary keys as keys and new values of the
+     field as values
+    :param batch_size: maximal number of rows updated with one query
+    """
+    for batch in batches(list(values.items()), batch_size):
+        model.objects.filter(pk__in=[pk for pk, _ in batch]).update(**{
+            field: case_of_values(model, field, batch)
+        })
+
+
+def case_of_values(model, field: str, values):
+    """
+    Function returns CASE expression that gives every row of model its own
+    value of the field.
+    :param values: iterable with (primary key, value) tuples
+    """
+    output_field = model._meta.get_field(field)
+    return Case(
+        *[When(pk=pk, then=Value(value, output_field=output_field))
+          for pk, value in values],
+        output_field=output_field
+    )
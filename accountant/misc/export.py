@@ -0,0 +1,276 @@
+import csv
+import re
+from collections import defaultdict
+from datetime import date
+from decimal import Decimal
+from html import escape
+
+from django.conf import settings
+from django.db.models import Q
+
+from accountant.misc.registry import get_registry
+from accountant.models import Account, Transaction
+
+CSV = 'csv'
+OFX = 'ofx'
+BEANCOUNT = 'beancount'
+FORMATS = (CSV, OFX, BEANCOUNT)
+
+CONTENT_TYPES = {
+    CSV: 'text/csv; charset=utf-8',
+    OFX: 'application/x-ofx; charset=utf-8',
+    BEANCOUNT: 'text/plain; charset=utf-8',
+}
+
+FIELDS = ('pk', 'date', 'amount', 'currency', 'quantity', 'unit', 'comment',
+          'approved', 'account_id', 'account__title', 'invoice_id',
+          'invoice__timestamp', 'invoice__comment')
+
+# Root accounts of beancount by types of accounts
+BEANCOUNT_ROOTS = {
+    Account.ACCOUNT: 'Assets',
+    Account.INCOME: 'Income',
+    Account.EXPENSE: 'Expenses',
+}
+
+# Dates of open of accounts are set when they are added to the database,
+# usually after their first transactions, so all accounts are opened at once
+BEANCOUNT_OPEN_DATE = date(1970, 1, 1)
+
+# Beancount entries must balance, remainders of transactions without
+# invoice and of broken invoices are posted to this account
+BEANCOUNT_UNBALANCED = 'Equity:Unbalanced'
+
+
+def rows(account: Account = None, start: date = None, end: date = None,
+         currency: str = None, order=('date', 'invoice_id', 'pk'),
+         whole_invoices: bool = False):
+    """
+    Function returns iterator over transactions selected by filter. Rows are
+    read with chunked cursor (server-side one on PostgreSQL) as dictionaries
+    of `FIELDS`, so memory usage doesn't depend on number of rows.
+    :param account: account which subtree is exported, all accounts if None
+    :param order: ordering of rows, formats that group transactions need it
+    :param whole_invoices: if True filters select invoices and all
+     transactions of them are returned, formats with balanced entries need it
+    """
+    queryset = Transaction.objects.all()
+    if account is not None:
+        queryset = queryset.filter(account__in=Account.get_tree(account))
+    if start is not None:
+        queryset = queryset.filter(date__gte=start)
+    if end is not None:
+        queryset = queryset.filter(date__lte=end)
+    if currency is not None:
+        queryset = queryset.filter(currency=currency)
+    if whole_invoices and (account, start, end, currency) != (None,) * 4:
+        queryset = Transaction.objects.filter(
+            Q(invoice__in=queryset.exclude(invoice=None).values('invoice')) |
+            Q(pk__in=queryset.filter(invoice=None).values('pk'))
+        )
+    return queryset.order_by(*order).values(*FIELDS).iterator()
+
+
+class _Echo:
+    # csv.writer writes to file-like object, this one just returns the line
+    def write(self, value):
+        return value
+
+
+def to_csv(items):
+    """
+    Function yields CSV lines with header, one line per transaction.
+    """
+    writer = csv.writer(_Echo())
+    yield writer.writerow(FIELDS)
+    for item in items:
+        yield writer.writerow(
+            '' if item[field] is None else item[field] for field in FIELDS
+        )
+
+
+def _ofx_text(value, length: int = None):
+    return escape((value or '')[:length].replace('\n', ' '))
+
+
+def to_ofx(items):
+    """
+    Function yields OFX 2 document with one bank statement per account and
+    currency, so items should be ordered by account and currency.
+    """
+    yield ('<?xml version="1.0" encoding="UTF-8"?>\n'
+           '<?OFX OFXHEADER="200" VERSION="211" SECURITY="NONE" '
+           'OLDFILEUID="NONE" NEWFILEUID="NONE"?>\n'
+           '<OFX><BANKMSGSRSV1>\n')
+    key = None
+    for item in items:
+        if key != (item['account_id'], item['currency']):
+            if key is not None:
+                yield '</BANKTRANLIST></STMTRS></STMTTRNRS>\n'
+            key = (item['account_id'], item['currency'])
+            yield ('<STMTTRNRS><TRNUID>{account}-{currency}</TRNUID>'
+                   '<STATUS><CODE>0</CODE><SEVERITY>INFO</SEVERITY></STATUS>'
+                   '<STMTRS><CURDEF>{currency}</CURDEF>'
+                   '<BANKACCTFROM><BANKID>frekenbok</BANKID>'
+                   '<ACCTID>{account}</ACCTID><ACCTTYPE>CHECKING</ACCTTYPE>'
+                   '</BANKACCTFROM><BANKTRANLIST>\n').format(
+                       account=item['account_id'], currency=item['currency'])
+        yield ('<STMTTRN><TRNTYPE>{type}</TRNTYPE>'
+               '<DTPOSTED>{date:%Y%m%d}</DTPOSTED><TRNAMT>{amount}</TRNAMT>'
+               '<FITID>{pk}</FITID><NAME>{name}</NAME><MEMO>{memo}</MEMO>'
+               '</STMTTRN>\n').format(
+                   type='CREDIT' if item['amount'] > 0 else 'DEBIT',
+                   date=item['date'], amount=item['amount'], pk=item['pk'],
+                   name=_ofx_text(item['invoice__comment'] or
+                                  item['account__title'], 32),
+                   memo=_ofx_text(item['comment'], 255))
+    if key is not None:
+        yield '</BANKTRANLIST></STMTRS></STMTTRNRS>\n'
+    yield '</BANKMSGSRSV1></OFX>\n'
+
+
+def _beancount_name(title: str):
+    name = re.sub(r'[\W_]+', '-', title, flags=re.UNICODE).strip('-')
+    name = name or 'Unnamed'
+    return name[0].upper() + name[1:]
+
+
+def beancount_accounts():
+    """
+    Function returns dictionary with primary keys of accounts as keys and
+    names of beancount accounts like Expenses:Food:Milk as values.
+    """
+    registry = get_registry()
+    return {
+        account.pk: ':'.join(
+            [BEANCOUNT_ROOTS[account.type]] +
+            [_beancount_name(i.title)
+             for i in registry.ancestors(account, include_self=True)]
+        )
+        for account in registry.tree
+    }
+
+
+def _beancount_string(value):
+    return '"{}"'.format((value or '').replace('\\', '\\\\')
+                         .replace('"', '\\"').replace('\n', ' '))
+
+
+def _beancount_prices(postings: list):
+    """
+    Function prices postings of exchange, i.e. invoice with sums in two
+    currencies of opposite signs, with total prices in the other currency,
+    so the entry balances. Foreign currency is priced in base one, the last
+    priced posting takes remainder of rounding.
+    :param postings: list of rows of one invoice
+    :return: dictionary with indexes of postings as keys and total prices
+     as (amount, currency) tuples as values, empty if invoice isn't exchange
+    """
+    sums = defaultdict(Decimal)
+    for posting in postings:
+        sums[posting['currency']] += posting['amount']
+    currencies = sorted((i for i in sums if sums[i]),
+                        key=lambda i: (i == settings.BASE_CURRENCY, i))
+    if len(currencies) != 2 or \
+            (sums[currencies[0]] > 0) == (sums[currencies[1]] > 0):
+        return dict()
+
+    priced, price_currency = currencies
+    rate = abs(sums[price_currency] / sums[priced])
+    quantum = Decimal(1).scaleb(min(
+        i['amount'].as_tuple().exponent for i in postings
+        if i['currency'] == price_currency))
+    indexes = [number for number, i in enumerate(postings)
+               if i['currency'] == priced and i['amount']]
+    # weights of priced postings sum up to the opposite of the other sum
+    rest = -sums[price_currency]
+    totals = dict()
+    for number in indexes[:-1]:
+        amount = postings[number]['amount']
+        totals[number] = (abs(amount) * rate).quantize(quantum)
+        rest -= totals[number] if amount > 0 else -totals[number]
+    totals[indexes[-1]] = rest if postings[indexes[-1]]['amount'] > 0 \
+        else -rest
+    if totals[indexes[-1]] < 0:
+        return dict()
+    return {number: (total, price_currency)
+            for number, total in totals.items()}
+
+
+def to_beancount(items):
+    """
+    Function yields beancount text: open directives for all accounts and one
+    balanced transaction with postings per invoice, so items should be
+    ordered by invoice. Postings of exchanges are priced (see
+    `_beancount_prices`). Transactions without invoice become separate
+    entries, they and broken invoices are balanced with
+    `BEANCOUNT_UNBALANCED` account. Entries with not approved transactions
+    or with such remainders are flagged with `!`.
+    """
+    names = beancount_accounts()
+    for name in sorted(list(names.values()) + [BEANCOUNT_UNBALANCED]):
+        yield '{} open {}\n'.format(BEANCOUNT_OPEN_DATE.isoformat(), name)
+
+    def entry(postings):
+        head = postings[0]
+        prices = _beancount_prices(postings)
+        remainders = defaultdict(Decimal)
+        for number, posting in enumerate(postings):
+            if number in prices:
+                total, currency = prices[number]
+                remainders[currency] += \
+                    total if posting['amount'] > 0 else -total
+            else:
+                remainders[posting['currency']] += posting['amount']
+        remainders = [(currency, amount) for currency, amount
+                      in sorted(remainders.items()) if amount]
+
+        flag = '*' if all(i['approved'] for i in postings) and \
+            not remainders else '!'
+        lines = ['\n{} {} {}\n'.format(
+            head['date'].isoformat(), flag,
+            _beancount_string(head['invoice__comment'] or head['comment']))]
+        if head['invoice_id'] is not None:
+            lines.append('  invoice: "{}"\n'.format(head['invoice_id']))
+        for number, posting in enumerate(postings):
+            lines.append('  {:<50} {} {}{}{}\n'.format(
+                names[posting['account_id']], posting['amount'],
+                posting['currency'],
+                ' @@ {} {}'.format(*prices[number])
+                if number in prices else '',
+                '  ; {}'.format(posting['comment'].replace('\n', ' '))
+                if posting['comment'] else ''))
+        for currency, amount in remainders:
+            lines.append('  {:<50} {} {}\n'.format(
+                BEANCOUNT_UNBALANCED, -amount, currency))
+        return ''.join(lines)
+
+    postings = list()
+    for item in items:
+        if postings and (item['invoice_id'] is None or
+                         item['invoice_id'] != postings[0]['invoice_id']):
+            yield entry(postings)
+            postings = list()
+        postings.append(item)
+    if postings:
+        yield entry(postings)
+
+
+def export(format: str, **filters):
+    """
+    Function returns generator of text chunks with transactions selected by
+    filters (see `rows`) in one of `FORMATS`.
+
+    >>> for chunk in export(CSV, start=date(2017, 1, 1)):
+    ...     output.write(chunk)
+    """
+    if format == CSV:
+        return to_csv(rows(**filters))
+    if format == OFX:
+        return to_ofx(rows(order=('account_id', 'currency', 'date', 'pk'),
+                           **filters))
+    if format == BEANCOUNT:
+        return to_beancount(rows(order=('invoice__timestamp', 'invoice_id',
+                                        'date', 'pk'),
+                                 whole_invoices=True, **filters))
+    raise ValueError('unknown format {}'.format(format))
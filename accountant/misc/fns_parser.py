@@ -1,14 +1,19 @@
+import codecs
 import json
 import logging
+import re
 from datetime import datetime
 from decimal import Decimal
 
 import pytz
+from django.conf import settings
 from django.contrib.auth.models import User
 from django.db import transaction
 from moneyed import RUB, Money
 
-from accountant.models import Invoice, Transaction, Account
+from accountant.misc.categorizer import get_categorizer, threshold
+from accountant.misc.registry import get_registry
+from accountant.models import Invoice, Transaction, Account, Document
 
 logger = logging.getLogger(__name__)
 
@@ -17,69 +22,284 @@ currency = RUB
 tz = pytz.timezone('Europe/Moscow')
 
 
-def is_valid_invoice(raw_invoice: str):
-    invoice = json.loads(raw_invoice, parse_float=Decimal, parse_int=Decimal)
-    return isinstance(invoice.get('items'), list) and \
+# Receipts are decoded with Decimal numbers, sums are in kopecks
+decoder = json.JSONDecoder(parse_float=Decimal, parse_int=Decimal)
+whitespace = re.compile(r'\s*')
+
+CHUNK_SIZE = 64 * 2 ** 10
+# One receipt can't be larger, files are read by chunks and only one
+# receipt is kept in memory
+MAX_RECEIPT_SIZE = 2 ** 20
+
+
+def loads(raw_invoice: str):
+    return decoder.decode(raw_invoice)
+
+
+def iter_receipts(chunks, max_size: int = MAX_RECEIPT_SIZE):
+    """
+    Function decodes receipts from JSON file with one receipt or with array
+    of them without reading the whole file into memory.
+
+    >>> with open('receipts.json', 'rb') as f:
+    ...     for receipt in iter_receipts(iter(lambda: f.read(65536), b'')):
+    ...         print(receipt['totalSum'])
+
+    :param chunks: iterable with bytes of file in UTF-8, like `File.chunks()`
+    :param max_size: maximal length of one receipt in characters
+    :return: generator of dictionaries, numbers are Decimal
+    :raise ValueError: if file isn't JSON or receipt is too large
+    """
+    text = codecs.getincrementaldecoder('utf-8-sig')(errors='strict')
+    chunks = iter(chunks)
+    buffer, position, finished = '', 0, False
+
+    def read():
+        nonlocal buffer, position, finished
+        chunk = next(chunks, None)
+        finished = chunk is None
+        buffer = buffer[position:] + text.decode(chunk or b'', final=finished)
+        position = 0
+
+    def skip():
+        nonlocal position
+        while True:
+            position = whitespace.match(buffer, position).end()
+            if position < len(buffer) or finished:
+                return
+            read()
+
+    def value():
+        nonlocal position
+        while True:
+            try:
+                result, position = decoder.raw_decode(buffer, position)
+                return result
+            except ValueError:
+                if finished or len(buffer) - position > max_size:
+                    raise
+                read()
+
+    read()
+    skip()
+    if buffer[position:position + 1] != '[':
+        result = value()
+        skip()
+        if position < len(buffer):
+            raise ValueError('extra data after receipt')
+        yield result
+        return
+
+    position += 1
+    skip()
+    if buffer[position:position + 1] == ']':
+        return
+    while True:
+        yield value()
+        skip()
+        separator = buffer[position:position + 1]
+        if separator == ']':
+            return
+        if not separator:
+            raise ValueError('unterminated array of receipts')
+        if separator != ',':
+            raise ValueError('receipts should be separated by commas')
+        position += 1
+        skip()
+
+
+def is_valid_receipt(invoice: dict):
+    return isinstance(invoice, dict) and \
+        isinstance(invoice.get('items'), list) and \
         isinstance(invoice.get('totalSum'), Decimal) and \
-        invoice.get('fiscalDocumentNumber') and \
-        invoice.get('fiscalDriveNumber') and \
-        invoice.get('fiscalSign')
+        bool(invoice.get('fiscalDocumentNumber') and
+             invoice.get('fiscalDriveNumber') and
+             invoice.get('fiscalSign'))
+
+
+def fiscal_id(invoice: dict):
+    """
+    Function returns fiscal identifiers of valid receipt: fiscal drive
+    number, fiscal document number and fiscal sign (see `Invoice.fiscal_id`).
+    """
+    return (str(invoice['fiscalDriveNumber']).strip(),
+            int(invoice['fiscalDocumentNumber']),
+            int(invoice['fiscalSign']))
+
+
+def is_valid_invoice(raw_invoice: str):
+    return is_valid_receipt(loads(raw_invoice))
 
 
-@transaction.atomic
 def parse(raw_invoice: str, user: User,
           default_expense: Account, default_account: Account):
-    invoice = json.loads(raw_invoice, parse_float=Decimal, parse_int=Decimal)
+    return parse_receipt(loads(raw_invoice), user,
+                         default_expense, default_account)
+
+
+def build_invoice(invoice: dict, user: User,
+                  default_expense: Account, default_account: Account,
+                  categorizer=None, accounts: dict = None):
+    """
+    Function makes invoice with transactions from decoded receipt (see
+    `iter_receipts`) without saving them. Goods are categorized with
+    `Categorizer`, only guesses of expense accounts with enough confidence
+    are taken, other goods are put into default expense account.
+    :param categorizer: `Categorizer`, `get_categorizer` by default
+    :param accounts: dictionary with accounts by primary keys, accounts of
+     `AccountRegistry` by default
+    :return: tuple with Invoice and list of Transaction objects
+    """
+    if categorizer is None:
+        categorizer = get_categorizer()
+    if accounts is None:
+        accounts = get_registry().by_pk
 
     timestamp = datetime.fromtimestamp(invoice['dateTime'], tz)
     date = timestamp.date()
     total_sum = invoice['totalSum'] / divisor
 
-    result = Invoice.objects.create(
+    result = Invoice(
         timestamp=timestamp,
         comment='{} ({})'.format(invoice['user'], Money(total_sum, currency)),
-        user=user
+        user=user,
+        **dict(zip(Invoice.FISCAL_FIELDS, fiscal_id(invoice)))
     )
 
-    Transaction.objects.create(
+    transactions = [Transaction(
         date=date,
         account=default_account,
         amount=-total_sum,
-        currency=currency,
-        invoice=result
-    )
+        currency=currency
+    )]
 
-    sum_of_items = Decimal(0)
+    minimum = threshold()
     for item in invoice['items']:
         comment = item['name']
-        maybe_transaction = Transaction.objects.filter(
-            comment=comment,
-            account__in=Account.get_expenses()
-        ).first()
-        if maybe_transaction:
-            account = maybe_transaction.account
-            unit = maybe_transaction.unit
+        guess = categorizer.categorize(comment, skip={default_expense.pk})
+        account = accounts.get(guess.account_id) \
+            if guess and guess.confidence >= minimum else None
+        if account is not None and account.type == Account.EXPENSE:
+            unit = guess.unit
         else:
-            account = default_expense
-            unit = None
+            account, unit = default_expense, None
 
-        item_price = item['sum'] / divisor
-        Transaction.objects.create(
+        transactions.append(Transaction(
             date=date,
             account=account,
-            amount=item_price,
+            amount=item['sum'] / divisor,
             currency=currency,
             quantity=item['quantity'],
             unit=unit,
-            invoice=result,
             comment=comment
-        )
-        sum_of_items += item_price
+        ))
+    return result, transactions
+
 
+def check_sum(invoice: Invoice, transactions: list):
+    """
+    Function logs invoices made by `build_invoice` which items don't sum up
+    to total sum of receipt.
+    """
+    total_sum = -transactions[0].amount
+    sum_of_items = sum((i.amount for i in transactions[1:]), Decimal(0))
     if sum_of_items != total_sum:
         logger.warning(
             '{} (id {}) is broken, total sum {} is not equal to sum of items {}'
-            .format(result, result.id, total_sum, sum_of_items)
+            .format(invoice, invoice.id, total_sum, sum_of_items)
         )
 
+
+@transaction.atomic
+def parse_receipt(invoice: dict, user: User,
+                  default_expense: Account, default_account: Account):
+    """
+    Function creates invoice with transactions from decoded receipt (see
+    `build_invoice`).
+    """
+    result, transactions = build_invoice(invoice, user, default_expense,
+                                         default_account)
+    Invoice.objects.ingest([(result, transactions)])
+    check_sum(result, transactions)
     return result
+
+
+def default_accounts():
+    """
+    Function returns default expense account for uncategorized goods and
+    default account receipts are paid from (see DEFAULT_EXPENSE and
+    DEFAULT_ACCOUNT settings).
+    """
+    registry = get_registry()
+    return (registry.by_pk[getattr(settings, 'DEFAULT_EXPENSE', 10)],
+            registry.by_pk[getattr(settings, 'DEFAULT_ACCOUNT', 2)])
+
+
+def find_duplicate(invoice: dict):
+    """
+    Function finds invoice created from the same receipt before with one
+    query by unique index of fiscal identifiers.
+    :return: primary key of the invoice or None
+    """
+    return Invoice.objects.receipts([fiscal_id(invoice)]).get(
+        fiscal_id(invoice))
+
+
+@transaction.atomic
+def ingest(file, user: User, default_expense: Account = None,
+           default_account: Account = None):
+    """
+    Function creates invoices from receipts in uploaded file and saves the
+    file as document. File is decoded once by chunks, so the whole file
+    isn't kept in memory. Receipts imported before are found by their
+    fiscal identifiers and skipped before they're categorized, file with
+    such receipts only isn't saved at all. Broken receipts are skipped,
+    reading stops at broken JSON. Files that aren't JSON with receipts are
+    just saved.
+    :param file: django File like UploadedFile
+    :param default_expense: account for uncategorized goods, DEFAULT_EXPENSE
+     setting by default
+    :param default_account: account receipts are paid from, DEFAULT_ACCOUNT
+     setting by default
+    :return: tuple with saved Document or None, list of created invoices
+     and list of primary keys of invoices created from the same receipts
+     before, document is attached to the invoice if there is only one
+    """
+    if default_expense is None or default_account is None:
+        defaults = default_accounts()
+        default_expense = default_expense or defaults[0]
+        default_account = default_account or defaults[1]
+
+    invoices, duplicates = list(), list()
+    receipts = enumerate(iter_receipts(file.chunks(CHUNK_SIZE)), 1)
+    try:
+        for number, receipt in receipts:
+            if not is_valid_receipt(receipt):
+                logger.warning('{} contains invalid receipt #{}'
+                               .format(file.name, number))
+                continue
+            # every receipt is saved in its own savepoint (see
+            # `parse_receipt`), so broken one is skipped alone
+            try:
+                duplicate = find_duplicate(receipt)
+                if duplicate is not None:
+                    logger.info('Receipt from {} is imported already as '
+                                'invoice {}'.format(file.name, duplicate))
+                    duplicates.append(duplicate)
+                else:
+                    invoices.append(parse_receipt(
+                        receipt, user, default_expense, default_account))
+            except (KeyError, TypeError, ValueError, ArithmeticError) as e:
+                logger.warning('Receipt #{} of {} is broken: {!r}'
+                               .format(number, file.name, e))
+    except ValueError as e:
+        # position in broken JSON is lost, receipts before it are kept
+        logger.info('{} is not a file with receipts: {}'.format(file.name, e))
+
+    if duplicates and not invoices:
+        return None, invoices, duplicates
+    document = Document.objects.create(
+        file=file, description='',
+        invoice=invoices[0] if len(invoices) == 1 else None
+    )
+    return document, invoices, duplicates
@@ -0,0 +1,262 @@
+import logging
+from collections import defaultdict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+
+from django.db import transaction, connection
+from django.db.models import Sum
+
+from accountant.misc.db import batches, bulk_set, BATCH_SIZE
+from accountant.models import Account, Transaction, Sheaf, DailyBalance, \
+    TreeSheaf, Round
+
+logger = logging.getLogger(__name__)
+
+Diff = namedtuple('Diff', ('account', 'currency', 'old', 'new'))
+Mismatch = namedtuple('Mismatch', ('kind', 'tree', 'key', 'actual', 'expected'))
+Report = namedtuple('Report', ('mismatches', 'unbalanced_invoices',
+                               'running_balances'))
+
+
+def calculate(accounts=None):
+    """
+    Function calculates sheaves and daily balances from scratch with one
+    grouped query over approved transactions.
+    :param accounts: QuerySet with accounts to calculate, all accounts will be
+     calculated if it's None
+    :return: tuple with two dictionaries: non-zero amounts of sheaves by
+     (account id, currency) and closing balances by (account id, currency,
+     date) for days with approved transactions
+    """
+    transactions = Transaction.objects.filter(approved=True)
+    if accounts is not None:
+        transactions = transactions.filter(account__in=accounts)
+
+    sheaves = dict()
+    daily_balances = dict()
+    for item in transactions\
+            .values('account', 'currency', 'date')\
+            .annotate(amount=Sum('amount'))\
+            .order_by('account', 'currency', 'date')\
+            .iterator():
+        key = (item['account'], item['currency'])
+        sheaves[key] = sheaves.get(key, Decimal(0)) + item['amount']
+        daily_balances[key + (item['date'],)] = sheaves[key]
+    return {key: amount for key, amount in sheaves.items() if amount}, \
+        daily_balances
+
+
+def _sync(queryset, fields: tuple, expected: dict, dry_run: bool):
+    """
+    Function makes amounts of rows in the queryset equal to expected ones.
+    Only rows with wrong amounts are touched: stale rows are deleted, changed
+    rows are updated with one query per batch and missing rows are created.
+    :return: dictionary with (old amount, new amount) tuples for all changed
+     keys
+    """
+    model = queryset.model
+    seen, stale, changed, diffs = set(), list(), dict(), dict()
+    for row in queryset.values_list('pk', *fields, 'amount').iterator():
+        pk, key, amount = row[0], row[1:-1], row[-1]
+        seen.add(key)
+        if key not in expected:
+            stale.append(pk)
+            diffs[key] = (amount, Decimal(0))
+        elif expected[key] != amount:
+            changed[pk] = expected[key]
+            diffs[key] = (amount, expected[key])
+    missing = [key for key in expected if key not in seen]
+    for key in missing:
+        diffs[key] = (Decimal(0), expected[key])
+
+    if not dry_run:
+        for batch in batches(stale):
+            model.objects.filter(pk__in=batch).delete()
+        bulk_set(model, 'amount', changed)
+        model.objects.bulk_create(
+            [model(amount=expected[key], **dict(zip(fields, key)))
+             for key in missing],
+            batch_size=BATCH_SIZE
+        )
+    return diffs
+
+
+def rebuild(accounts=None, dry_run: bool = False):
+    """
+    Function rebuilds sheaves and daily balances of specified accounts from
+    transactions, subtree totals of their trees are rebuilt as well.
+    Balances are calculated with one grouped query and only wrong rows are
+    written. Calculation and writes run in one transaction, so it lasts as
+    long as the whole rebuild, but row locks are taken only by the writes
+    and are held from the first write till commit.
+    :param accounts: QuerySet with accounts to rebuild, all accounts will be
+     rebuilt if it's None
+    :param dry_run: if True nothing will be written
+    :return: list of `Diff` tuples with changed sheaves sorted by account and
+     currency
+    """
+    sheaves = Sheaf.objects.all()
+    daily_balances = DailyBalance.objects.all()
+    if accounts is not None:
+        sheaves = sheaves.filter(account__in=accounts)
+        daily_balances = daily_balances.filter(account__in=accounts)
+
+    # balances are calculated in the same transaction as writes, otherwise
+    # transactions saved in between would be overwritten by stale totals
+    with transaction.atomic():
+        expected_sheaves, expected_daily_balances = calculate(accounts)
+        diffs = _sync(sheaves, ('account_id', 'currency'),
+                      expected_sheaves, dry_run)
+        _sync(daily_balances, ('account_id', 'currency', 'date'),
+              expected_daily_balances, dry_run)
+        if not dry_run:
+            # ledger version is bumped here, so cached pages are rendered
+            # again with repaired balances
+            TreeSheaf.rebuild(
+                None if accounts is None else
+                set(accounts.values_list('tree_id', flat=True))
+            )
+
+    result = [Diff(account, currency, old, new)
+              for (account, currency), (old, new) in sorted(diffs.items())
+              if old != new]
+    for diff in result:
+        logger.info('Sheaf of account {} in {} {}: {} -> {}'.format(
+            diff.account, diff.currency,
+            'differs' if dry_run else 'fixed', diff.old, diff.new))
+    return result
+
+
+def _amounts(queryset, fields: tuple):
+    return {row[:-1]: row[-1] for row in
+            queryset.values_list(*fields, 'amount').iterator()}
+
+
+def _total_diffs(actual: dict, expected: dict):
+    """
+    Function compares sheaves or subtree totals, missing ones are zero.
+    :return: dictionary with (actual amount, expected amount) tuples by keys
+    """
+    result = dict()
+    for key in set(actual) | set(expected):
+        old, new = actual.get(key, Decimal(0)), expected.get(key, Decimal(0))
+        if old != new:
+            result[key] = (old, new)
+    return result
+
+
+def _daily_diffs(actual: dict, expected: dict):
+    """
+    Function compares daily balances, balance at day without row is the
+    closing balance of the previous day with row (zero before the first one).
+    :return: dictionary with (actual amount, expected amount) tuples by
+     (account id, currency, date)
+    """
+    series = defaultdict(lambda: (dict(), dict()))
+    for index, rows in enumerate((actual, expected)):
+        for (account_id, currency, date), amount in rows.items():
+            series[(account_id, currency)][index][date] = amount
+
+    result = dict()
+    for key, (actual_rows, expected_rows) in series.items():
+        old = new = Decimal(0)
+        for date in sorted(set(actual_rows) | set(expected_rows)):
+            old = actual_rows.get(date, old)
+            new = expected_rows.get(date, new)
+            if old != new:
+                result[key + (date,)] = (old, new)
+    return result
+
+
+def _verify_tree(tree_id: int):
+    """
+    Function compares all balances derived from transactions of one tree of
+    accounts with fresh aggregates. Effective balances are compared, so
+    rows that don't change any balance (like zero sheaves) aren't reported.
+    :return: tuple with list of `Mismatch` tuples and number of transactions
+     with wrong running balance
+    """
+    accounts = Account.objects.filter(tree_id=tree_id)
+    sheaves, daily_balances = calculate(accounts)
+    tree_sheaves = TreeSheaf.calculate(
+        accounts.values_list('pk', 'tree_id', 'lft', 'rgt'),
+        [key + (amount,) for key, amount in sheaves.items()]
+    )
+
+    mismatches = list()
+    for kind, diffs in (
+            ('sheaf', _total_diffs(
+                _amounts(Sheaf.objects.filter(account__in=accounts),
+                         ('account_id', 'currency')), sheaves)),
+            ('daily balance', _daily_diffs(
+                _amounts(DailyBalance.objects.filter(account__in=accounts),
+                         ('account_id', 'currency', 'date')),
+                daily_balances)),
+            ('tree sheaf', _total_diffs(
+                _amounts(TreeSheaf.objects.filter(account__in=accounts),
+                         ('account_id', 'currency')), tree_sheaves))):
+        for key, (actual, new) in sorted(diffs.items()):
+            mismatches.append(Mismatch(kind, tree_id, key, actual, new))
+    running_balances = Transaction.objects\
+        .filter(account__in=accounts)\
+        .repair_balances(dry_run=True)
+    return mismatches, running_balances
+
+
+def _verify_tree_in_thread(tree_id: int):
+    # Every worker thread has its own database connection, it should be
+    # closed when the work is done
+    try:
+        return _verify_tree(tree_id)
+    finally:
+        connection.close()
+
+
+def unbalanced_invoices():
+    """
+    Function returns sums of all invoices that aren't balanced (see
+    `Invoice.verify`) with one grouped query.
+    :return: QuerySet with dictionaries with invoice, currency and amount
+    """
+    return Transaction.objects\
+        .filter(invoice__isnull=False)\
+        .values('invoice', 'currency')\
+        .annotate(amount=Round(Sum('amount')))\
+        .exclude(amount=Decimal('0'))\
+        .order_by('invoice', 'currency')
+
+
+def verify(workers: int = 4, repair: bool = False):
+    """
+    Function checks sheaves, daily balances, subtree totals and running
+    balances of all accounts against fresh aggregates of transactions. Every
+    tree of accounts is checked independently on a pool of worker threads.
+    :param workers: number of worker threads, trees are checked in the
+     calling thread if it's 1
+    :param repair: if True trees with mismatches will be rebuilt
+    :return: `Report` tuple with list of `Mismatch` tuples, list of
+     unbalanced invoices and number of wrong running balances
+    """
+    tree_ids = sorted(set(Account.objects.values_list('tree_id', flat=True)))
+    if workers > 1:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(_verify_tree_in_thread, tree_ids))
+    else:
+        results = [_verify_tree(tree_id) for tree_id in tree_ids]
+
+    mismatches = [i for tree_mismatches, _ in results for i in tree_mismatches]
+    running_balances = sum(count for _, count in results)
+    broken_trees = {i.tree for i in mismatches} | \
+        {tree_id for tree_id, (_, count) in zip(tree_ids, results) if count}
+    for mismatch in mismatches:
+        logger.warning('Wrong {} {} in tree {}: {} instead of {}'.format(
+            mismatch.kind, mismatch.key, mismatch.tree, mismatch.actual,
+            mismatch.expected))
+
+    if repair and broken_trees:
+        accounts = Account.objects.filter(tree_id__in=broken_trees)
+        rebuild(accounts)
+        Transaction.objects.filter(account__in=accounts).repair_balances()
+        logger.info('Trees {} repaired'.format(sorted(broken_trees)))
+
+    return Report(mismatches, list(unbalanced_invoices()), running_balances)
@@ -0,0 +1,198 @@
+import json
+from base64 import urlsafe_b64encode, urlsafe_b64decode
+from binascii import Error as Base64Error
+from datetime import date
+from decimal import Decimal
+
+from django.core.exceptions import ValidationError
+from django.core.paginator import InvalidPage
+from django.db import connections
+from django.db.models import Q
+from django.http import Http404
+from django.utils.functional import cached_property
+from django.utils.translation import ugettext_lazy as _
+
+NEXT = 'n'
+PREVIOUS = 'p'
+
+
+class CursorPage:
+    """
+    Page of `CursorPaginator`. It knows only cursors of neighbouring pages,
+    there are no page numbers.
+    """
+
+    def __init__(self, object_list, paginator, next_cursor: str = None,
+                 previous_cursor: str = None):
+        self.object_list = object_list
+        self.paginator = paginator
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __repr__(self):
+        return '<Page of {} objects>'.format(len(self))
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+class CursorPaginator:
+    """
+    Keyset paginator. Page is addressed by opaque cursor with ordering values
+    of the edge object of the neighbouring page, so every page is fetched by
+    index seek with `WHERE (timestamp, id) < (...)` condition instead of
+    OFFSET scan, and whole QuerySet is never counted unless approximate count
+    is requested. Ordering must be unique, so it should end with primary key.
+
+    >>> paginator = CursorPaginator(Invoice.objects.all(), 20,
+    ...                             ordering=('-timestamp', '-pk'))
+    >>> page = paginator.page()
+    >>> paginator.page(page.next_cursor)
+    <Page of 20 objects>
+    """
+
+    def __init__(self, object_list, per_page: int,
+                 ordering=('-timestamp', '-pk'), approximate_count=False):
+        self.object_list = object_list
+        self.per_page = int(per_page)
+        self.ordering = tuple(ordering)
+        self.approximate_count = approximate_count
+        self.fields = [
+            (name.lstrip('-'), name.startswith('-')) for name in self.ordering
+        ]
+
+    def _field(self, name):
+        meta = self.object_list.model._meta
+        return meta.pk if name == 'pk' else meta.get_field(name)
+
+    def encode(self, direction: str, obj):
+        values = list()
+        for name, _ in self.fields:
+            value = getattr(obj, self._field(name).attname)
+            if isinstance(value, date):
+                value = value.isoformat()
+            elif isinstance(value, Decimal):
+                value = str(value)
+            values.append(value)
+        token = json.dumps([direction] + values, separators=(',', ':'))
+        return urlsafe_b64encode(token.encode()).decode().rstrip('=')
+
+    def decode(self, cursor: str):
+        """
+        method returns direction and ordering values stored in cursor
+        """
+        try:
+            token = json.loads(urlsafe_b64decode(
+                cursor + '=' * (-len(cursor) % 4)
+            ).decode())
+            direction, values = token[0], token[1:]
+            if direction not in (NEXT, PREVIOUS) or \
+                    len(values) != len(self.fields):
+                raise ValueError(cursor)
+            return direction, [
+                self._field(name).to_python(value)
+                for (name, _), value in zip(self.fields, values)
+            ]
+        except (Base64Error, UnicodeError, ValueError, TypeError, IndexError,
+                ValidationError):
+            raise InvalidPage(_('Wrong cursor'))
+
+    def seek(self, values, backward: bool = False):
+        """
+        method returns condition for objects placed after given ordering
+         values, or before them if `backward` is True
+        """
+        condition = Q()
+        for i, (name, descending) in enumerate(self.fields):
+            lookup = 'lt' if descending != backward else 'gt'
+            step = Q(**{'{}__{}'.format(name, lookup): values[i]})
+            for j in range(i):
+                step &= Q(**{self.fields[j][0]: values[j]})
+            condition |= step
+        # redundant range of the first field lets database read the index
+        # in order from the cursor instead of sorting branches of OR
+        name, descending = self.fields[0]
+        lookup = 'lte' if descending != backward else 'gte'
+        return Q(**{'{}__{}'.format(name, lookup): values[0]}) & condition
+
+    def page(self, cursor: str = None):
+        direction, values = self.decode(cursor) if cursor else (NEXT, None)
+        backward = direction == PREVIOUS
+        objects = self.object_list
+        if values is not None:
+            objects = objects.filter(self.seek(values, backward))
+        ordering = self.ordering if not backward else [
+            name[1:] if name.startswith('-') else '-' + name
+            for name in self.ordering
+        ]
+        items = list(objects.order_by(*ordering)[:self.per_page + 1])
+        has_more = len(items) > self.per_page
+        items = items[:self.per_page]
+        if backward:
+            items.reverse()
+            has_next, has_previous = True, has_more
+        else:
+            has_next, has_previous = has_more, values is not None
+        return CursorPage(
+            items, self,
+            self.encode(NEXT, items[-1]) if items and has_next else None,
+            self.encode(PREVIOUS, items[0]) if items and has_previous else None
+        )
+
+    @cached_property
+    def count(self):
+        """
+        Approximate number of objects or None if it isn't requested. Whole
+        table on PostgreSQL is estimated by planner statistics, filtered
+        QuerySets are counted.
+        """
+        if not self.approximate_count:
+            return None
+        objects = self.object_list
+        connection = connections[objects.db]
+        if connection.vendor == 'postgresql' and not objects.query.where:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT reltuples FROM pg_class '
+                               'WHERE relname = %s',
+                               [objects.model._meta.db_table])
+                row = cursor.fetchone()
+            if row and row[0] > 0:
+                return int(row[0])
+        return objects.count()
+
+
+class CursorPaginationMixin:
+    """
+    Mixin for `ListView` that paginates it with `CursorPaginator`. Pages are
+    ordered by `ordering` attribute of the view and addressed by `cursor` GET
+    parameter.
+    """
+    cursor_kwarg = 'cursor'
+    approximate_count = False
+
+    def get_paginator(self, queryset, per_page, **kwargs):
+        return CursorPaginator(queryset, per_page, ordering=self.get_ordering(),
+                               approximate_count=self.approximate_count)
+
+    def paginate_queryset(self, queryset, page_size):
+        paginator = self.get_paginator(queryset, page_size)
+        try:
+            page = paginator.page(self.request.GET.get(self.cursor_kwarg))
+        except InvalidPage as e:
+            raise Http404(str(e))
+        return paginator, page, page.object_list, page.has_other_pages()
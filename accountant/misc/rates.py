@@ -0,0 +1,170 @@
+import csv
+import logging
+import time
+from bisect import bisect_right
+from collections import defaultdict
+from datetime import datetime, date
+from decimal import Decimal
+from xml.etree import ElementTree
+
+from django.conf import settings
+from django.db import transaction
+
+from accountant.models import ExchangeRate, VersionStamp
+
+logger = logging.getLogger(__name__)
+
+_table = None
+_stamp = None
+_loaded_at = None
+
+
+def parse_cbr_xml(xml_file):
+    """
+    Function parses daily rates dump of Central Bank of Russia, like
+    http://www.cbr.ru/scripts/XML_daily.asp. Rates are divided by nominal,
+    so every one is price of one unit of currency.
+
+    >>> parse_cbr_xml(open('XML_daily.xml', 'rb'))
+    [('AUD', date(2017, 10, 14), Decimal('45.2815')), ...]
+
+    :param xml_file: file-like object or file name
+    :return: list of tuples with currency, date and rate
+    """
+    root = ElementTree.parse(xml_file).getroot()
+    day = datetime.strptime(root.attrib['Date'], '%d.%m.%Y').date()
+    result = list()
+    for item in root.iter('Valute'):
+        value = Decimal(item.findtext('Value').replace(',', '.'))
+        nominal = Decimal(item.findtext('Nominal'))
+        result.append((item.findtext('CharCode'), day, value / nominal))
+    return result
+
+
+def parse_csv(csv_file):
+    """
+    Function parses CSV file with currency, date in ISO format and price of
+    one unit of currency in base currency in every line.
+    :param csv_file: file-like object opened in text mode
+    :return: list of tuples with currency, date and rate
+    """
+    return [
+        (row[0], datetime.strptime(row[1], '%Y-%m-%d').date(), Decimal(row[2]))
+        for row in csv.reader(csv_file) if row
+    ]
+
+
+@transaction.atomic
+def store(rates):
+    """
+    Function saves rates to database, existing rates for the same currency
+    and date are replaced. Cached rates of this process are dropped and
+    version stamp of rates is bumped.
+    :param rates: iterable with tuples with currency, date and rate
+    :return: number of saved rates
+    """
+    rates = {(currency, day): rate for currency, day, rate in rates}
+    days = {day for _, day in rates}
+    existing = {
+        (str(i.currency), i.date): i
+        for i in ExchangeRate.objects.filter(date__in=days)
+    }
+    new = list()
+    for key, rate in rates.items():
+        if key in existing:
+            if existing[key].rate != rate:
+                existing[key].rate = rate
+                existing[key].save(update_fields=['rate'])
+        else:
+            new.append(ExchangeRate(currency=key[0], date=key[1], rate=rate))
+    ExchangeRate.objects.bulk_create(new)
+    VersionStamp.bump(ExchangeRate.VERSION)
+    clear_cache()
+    logger.info('{} exchange rates stored, {} of them are new'
+                .format(len(rates), len(new)))
+    return len(rates)
+
+
+class RateTable:
+    """
+    In-memory copy of all exchange rates sorted by date. Rate at any date is
+    found by binary search, rate of base currency always is 1.
+    """
+
+    def __init__(self, rates):
+        self.dates = defaultdict(list)
+        self.rates = defaultdict(list)
+        for currency, day, rate in rates:
+            self.dates[str(currency)].append(day)
+            self.rates[str(currency)].append(rate)
+
+    def rate(self, currency, day: date = None):
+        """
+        method returns rate of currency at the date or None if there is no
+         rate not later than that date
+        """
+        currency = str(currency)
+        if currency == settings.BASE_CURRENCY:
+            return Decimal(1)
+        dates = self.dates.get(currency)
+        if not dates:
+            return None
+        if day is None:
+            return self.rates[currency][-1]
+        index = bisect_right(dates, day)
+        return self.rates[currency][index - 1] if index else None
+
+    def convert(self, rows):
+        """
+        method converts amounts to base currency in one pass.
+        :param rows: iterable with tuples with currency, amount and date, date
+         can be None for the latest rate
+        :return: list with amounts in base currency, amount is None if there
+         is no rate for its currency and date
+        """
+        result = list()
+        for currency, amount, day in rows:
+            rate = self.rate(currency, day)
+            result.append(None if rate is None else amount * rate)
+        return result
+
+    def total(self, rows):
+        """
+        method returns sum of amounts in base currency and set of currencies
+         that couldn't be converted, these amounts aren't included to the sum
+        """
+        rows = list(rows)
+        total = Decimal(0)
+        missing = set()
+        for (currency, _, _), amount in zip(rows, self.convert(rows)):
+            if amount is None:
+                missing.add(str(currency))
+            else:
+                total += amount
+        return total, missing
+
+
+def get_table():
+    """
+    Function returns `RateTable` with all rates loaded by one query. Version
+    stamp of the table is compared with the stamp in database (one single
+    row query), so rates stored by any process are seen at once (see
+    `ExchangeRate.VERSION`). Table is reloaded after RATES_CACHE_TIMEOUT
+    seconds anyway, so rates changed without `store` are seen as well.
+    """
+    global _table, _stamp, _loaded_at
+    timeout = getattr(settings, 'RATES_CACHE_TIMEOUT', 3600)
+    stamp = VersionStamp.get(ExchangeRate.VERSION)
+    if _table is None or stamp != _stamp or \
+            time.monotonic() - _loaded_at > timeout:
+        _table = RateTable(ExchangeRate.objects
+                           .order_by('currency', 'date')
+                           .values_list('currency', 'date', 'rate'))
+        _stamp = stamp
+        _loaded_at = time.monotonic()
+    return _table
+
+
+def clear_cache():
+    global _table
+    _table = None
@@ -0,0 +1,308 @@
+import json
+import logging
+import os
+import threading
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import timedelta
+from itertools import islice
+from multiprocessing import get_context
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import connection, transaction, DatabaseError
+from django.db.models import Q
+from django.utils import timezone
+
+from accountant.misc import fns_parser
+from accountant.misc.categorizer import get_categorizer
+from accountant.misc.registry import get_registry
+from accountant.models import Document, ImportJob, Invoice
+
+logger = logging.getLogger(__name__)
+
+# Number of receipts prepared by workers and saved with bulk queries at
+# once, progress of job is saved after every batch
+BATCH_SIZE = 100
+
+# Invoices by fiscal identifiers of their receipts and arguments of
+# `build_invoice`: user, default accounts, categorizer and accounts by
+# primary keys, they're set once in every worker
+_context = None
+
+
+def workers():
+    """
+    Function returns size of pool of workers that decode and categorize
+    receipts (see RECEIPT_IMPORT_WORKERS setting).
+    """
+    return getattr(settings, 'RECEIPT_IMPORT_WORKERS', os.cpu_count() or 1)
+
+
+def iter_archive(file):
+    """
+    Function splits file with many receipts to units of work without
+    reading the whole file into memory. Zip archives are split by files,
+    JSON arrays by receipts and NDJSON files by lines.
+    :param file: django File
+    :return: generator of (label, payload) tuples, payload is bytes of
+     JSON with one receipt or array of them, decoded receipt or exception
+    """
+    if zipfile.is_zipfile(file):
+        file.seek(0)
+        with zipfile.ZipFile(file) as archive:
+            for info in archive.infolist():
+                if info.filename.endswith('/'):
+                    continue
+                if info.file_size > fns_parser.MAX_RECEIPT_SIZE:
+                    yield info.filename, ValueError('file is too large')
+                else:
+                    yield info.filename, archive.read(info)
+        return
+
+    file.seek(0)
+    start = file.read(fns_parser.CHUNK_SIZE).lstrip(b'\xef\xbb\xbf \t\r\n')
+    if start.startswith(b'['):
+        receipts = fns_parser.iter_receipts(file.chunks(fns_parser.CHUNK_SIZE))
+        number = 0
+        try:
+            for number, receipt in enumerate(receipts, 1):
+                yield 'receipt {}'.format(number), receipt
+        except ValueError as e:
+            # position in broken array is lost, the rest can't be read
+            yield 'receipt {}'.format(number + 1), e
+        return
+
+    file.seek(0)
+    for number, line in enumerate(file, 1):
+        if line.strip():
+            yield 'line {}'.format(number), line
+
+
+def _init(context):
+    global _context
+    _context = context
+
+
+def _prepare(unit):
+    # Runs in workers: decodes and categorizes receipts without database
+    # queries, returns list of (label, invoice or error message) tuples.
+    # Receipts imported before are skipped before they're categorized
+    known, arguments = _context
+    label, payload = unit
+    if isinstance(payload, Exception):
+        return [(label, str(payload))]
+    try:
+        receipts = [payload] if isinstance(payload, dict) else \
+            list(fns_parser.iter_receipts([payload]))
+    except ValueError as e:
+        return [(label, 'broken JSON: {}'.format(e))]
+
+    result = list()
+    for number, receipt in enumerate(receipts, 1):
+        name = label if len(receipts) == 1 else \
+            '{} #{}'.format(label, number)
+        if not fns_parser.is_valid_receipt(receipt):
+            result.append((name, 'not a receipt'))
+            continue
+        try:
+            duplicate = known.get(fns_parser.fiscal_id(receipt))
+            if duplicate is not None:
+                result.append((name, 'imported already as invoice {}'
+                               .format(duplicate)))
+                continue
+            result.append((name, fns_parser.build_invoice(receipt,
+                                                          *arguments)))
+        except (KeyError, TypeError, ValueError, ArithmeticError) as e:
+            result.append((name, 'broken receipt: {!r}'.format(e)))
+    return result
+
+
+@contextmanager
+def _pool(size: int, context, processes: bool = False):
+    # Receipts are prepared by forked processes that inherit loaded
+    # categorizer if it's allowed, threads are used otherwise: fork of web
+    # process with running threads isn't safe
+    if size > 1 and processes:
+        try:
+            processes = get_context('fork')
+        except ValueError:
+            processes = None
+        if processes is not None:
+            with processes.Pool(size, _init, (context,)) as pool:
+                yield pool.map
+            return
+    _init(context)
+    if size > 1:
+        with ThreadPoolExecutor(max_workers=size) as executor:
+            yield lambda function, items: list(executor.map(function, items))
+    else:
+        yield lambda function, items: list(map(function, items))
+
+
+def _save(prepared: list):
+    """
+    Function saves prepared invoices with bulk queries. If the batch is
+    rejected (e.g. some receipt is dated by closed period), invoices are
+    saved one by one, so only bad ones are lost.
+    :param prepared: list of (label, (invoice, transactions)) tuples
+    :return: list of (label, error message) tuples
+    """
+    try:
+        with transaction.atomic():
+            Invoice.objects.ingest([pair for _, pair in prepared])
+    except (ValidationError, DatabaseError, ValueError) as e:
+        logger.info('Batch of receipts rejected, saving them one by one: {}'
+                    .format(e))
+    else:
+        for _, (invoice, transactions) in prepared:
+            fns_parser.check_sum(invoice, transactions)
+        return list()
+
+    errors = list()
+    for label, (invoice, transactions) in prepared:
+        # objects could get primary keys from rolled back inserts
+        invoice.pk = None
+        for item in transactions:
+            item.pk = None
+        try:
+            with transaction.atomic():
+                Invoice.objects.ingest([(invoice, transactions)])
+        except (ValidationError, DatabaseError, ValueError) as e:
+            errors.append((label, '; '.join(getattr(e, 'messages', [str(e)]))))
+        else:
+            fns_parser.check_sum(invoice, transactions)
+    return errors
+
+
+def fail_stale():
+    """
+    Function marks jobs of stopped or restarted processes as failed: running
+    jobs without progress and pending jobs not started for
+    RECEIPT_IMPORT_TIMEOUT seconds. It's called whenever job is polled or
+    started, so such jobs don't stay running forever.
+    :return: number of failed jobs
+    """
+    now = timezone.now()
+    cutoff = now - timedelta(
+        seconds=getattr(settings, 'RECEIPT_IMPORT_TIMEOUT', 15 * 60))
+    count = ImportJob.objects.filter(
+        Q(status=ImportJob.RUNNING, updated__lt=cutoff) |
+        Q(status__in=(ImportJob.PENDING, ImportJob.RUNNING), updated=None,
+          created__lt=cutoff)
+    ).update(status=ImportJob.FAILED, finished=now)
+    if count:
+        logger.warning('{} stale import jobs failed'.format(count))
+    return count
+
+
+def run(job: ImportJob, size: int = None, processes: bool = False):
+    """
+    Function imports all receipts of the job. Receipts are decoded and
+    categorized by a pool of workers and saved by batches, bad receipts
+    are reported in errors of the job and don't stop the import.
+    :param size: number of workers, `workers()` by default
+    :param processes: if True workers are forked processes, otherwise they
+     are threads. Processes shouldn't be forked from web server, only from
+     management command or other standalone worker
+    :return: the job with final status
+    """
+    fail_stale()
+    size = size or workers()
+    default_expense, default_account = fns_parser.default_accounts()
+    # fiscal identifiers of all receipts are read once, so workers check
+    # receipts without queries
+    known = Invoice.objects.receipts()
+    context = (known, (job.user, default_expense, default_account,
+                       get_categorizer(), get_registry().by_pk))
+    ImportJob.objects.filter(pk=job.pk).update(status=ImportJob.RUNNING,
+                                               updated=timezone.now())
+
+    errors = list()
+    seen = dict()
+    processed = imported = 0
+    status = ImportJob.DONE
+    file = job.document.file
+    try:
+        file.open('rb')
+        units = iter_archive(file)
+        with _pool(size, context, processes) as map_units:
+            while True:
+                batch = list(islice(units, BATCH_SIZE))
+                if not batch:
+                    break
+                results = [result for unit in map_units(_prepare, batch)
+                           for result in unit]
+                prepared, failed = list(), list()
+                for label, result in results:
+                    if isinstance(result, str):
+                        failed.append((label, result))
+                    elif result[0].fiscal_id in seen:
+                        failed.append((label, 'duplicate of {}'.format(
+                            seen[result[0].fiscal_id])))
+                    else:
+                        seen[result[0].fiscal_id] = label
+                        prepared.append((label, result))
+                failed.extend(_save(prepared) if prepared else [])
+
+                processed += len(results)
+                imported += len(results) - len(failed)
+                errors.extend({'receipt': label, 'message': message}
+                              for label, message in failed)
+                ImportJob.objects.filter(pk=job.pk).update(
+                    processed=processed, imported=imported,
+                    errors=json.dumps(errors, ensure_ascii=False),
+                    updated=timezone.now()
+                )
+    except Exception as e:
+        logger.exception('Import of {} failed'.format(job.document.file.name))
+        errors.append({'receipt': None, 'message': str(e)})
+        status = ImportJob.FAILED
+    finally:
+        file.close()
+
+    now = timezone.now()
+    ImportJob.objects.filter(pk=job.pk).update(
+        status=status, processed=processed, imported=imported,
+        errors=json.dumps(errors, ensure_ascii=False),
+        updated=now, finished=now
+    )
+    logger.info('{} of {} receipts imported from {}'
+                .format(imported, processed, job.document.file.name))
+    job.refresh_from_db()
+    return job
+
+
+def create(file, user):
+    """
+    Function saves uploaded archive as `Document` and creates pending job
+    that imports it (see `start`).
+    """
+    document = Document.objects.create(file=file, invoice=None,
+                                       description='')
+    return ImportJob.objects.create(user=user, document=document)
+
+
+def _run_in_thread(pk: int):
+    # Background thread has its own database connection, it should be
+    # closed when the work is done
+    try:
+        run(ImportJob.objects.get(pk=pk))
+    finally:
+        connection.close()
+
+
+def start(job: ImportJob):
+    """
+    Function runs the job in background thread after commit of current
+    transaction, so the request that created it isn't blocked. The job is
+    run right away if RECEIPT_IMPORT_BACKGROUND setting is False. Workers
+    of the job are threads, processes aren't forked from web server.
+    """
+    if not getattr(settings, 'RECEIPT_IMPORT_BACKGROUND', True):
+        run(job)
+        return
+    transaction.on_commit(lambda: threading.Thread(
+        target=_run_in_thread, args=(job.pk,), daemon=True
+    ).start())
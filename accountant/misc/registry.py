@@ -0,0 +1,69 @@
+from collections import defaultdict
+
+from accountant.models import Account, VersionStamp
+
+_cache = (None, None)
+
+
+class AccountRegistry:
+    """
+    In-memory copy of the whole tree of accounts. It's loaded with one query
+    and shared by all requests of the process, so accounts returned by the
+    registry should be treated as read only.
+    """
+
+    def __init__(self, accounts):
+        self.tree = list(accounts)
+        self.by_pk = {account.pk: account for account in self.tree}
+        self.by_bank_title = dict()
+        self.by_type = defaultdict(list)
+        self.leaves = set()
+        for account in self.tree:
+            if account.bank_title:
+                self.by_bank_title.setdefault(account.bank_title, account)
+            self.by_type[account.type].append(account)
+            if account.is_leaf():
+                self.leaves.add(account.pk)
+
+    def get(self, pk):
+        """
+        method returns account by primary key or None
+        """
+        return self.by_pk.get(int(pk))
+
+    def of_type(self, type: int):
+        return self.by_type[type]
+
+    def descendants(self, account, include_self: bool = False):
+        """
+        method returns all accounts of subtree of the account in tree order
+        """
+        return [i for i in self.tree
+                if i.tree_id == account.tree_id and
+                account.lft <= i.lft <= account.rgt and
+                (include_self or i.pk != account.pk)]
+
+    def ancestors(self, account, include_self: bool = False):
+        """
+        method returns all ancestors of the account starting from the root
+        """
+        return [i for i in self.tree
+                if i.tree_id == account.tree_id and
+                i.lft <= account.lft and i.rgt >= account.rgt and
+                (include_self or i.pk != account.pk)]
+
+
+def get_registry():
+    """
+    Function returns `AccountRegistry` of this process. Its version stamp is
+    compared with the stamp in database (one single row query) and registry
+    is reloaded if accounts were changed by any process since then (see
+    `Account.VERSION`).
+    """
+    global _cache
+    stamp = VersionStamp.get(Account.VERSION)
+    cached_stamp, registry = _cache
+    if registry is None or cached_stamp != stamp:
+        registry = AccountRegistry(Account.objects.order_by('tree_id', 'lft'))
+        _cache = (stamp, registry)
+    return registry
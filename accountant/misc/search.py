@@ -0,0 +1,180 @@
+import re
+
+from django.db import connections
+from django.db.models import Q, Count, Sum, Min, Max, Case, When, Value, \
+    FloatField, IntegerField
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import ExtractYear
+
+from accountant.models import Transaction
+
+WORD = re.compile(r'\w+', re.UNICODE)
+
+# Buckets of absolute value of amount for the amount facet
+AMOUNTS = (
+    ('0-100', 0, 100),
+    ('100-1000', 100, 1000),
+    ('1000-10000', 1000, 10000),
+    ('10000-', 10000, None),
+)
+
+FACET_SIZE = 10
+
+
+def terms(query: str):
+    """
+    Function splits search query to words, any punctuation is dropped, so
+    words can be safely put into FTS5 or tsquery expression.
+    """
+    return [word.lower() for word in WORD.findall(query or '')]
+
+
+def _matches(subquery: str, terms: list):
+    # every word should be found in comment of transaction or in comment of
+    # its invoice; RawSQL can't be used with `__in` lookup, it's wrapped in
+    # extra parentheses and becomes scalar subquery
+    where = ['accountant_transaction.id IN ({}) OR '
+             'accountant_transaction.invoice_id IN ({})'.format(
+                 subquery.format('accountant_transaction'),
+                 subquery.format('accountant_invoice'))] * len(terms)
+    params = [term for term in terms for _ in range(2)]
+    return lambda queryset: queryset.extra(where=where, params=params)
+
+
+def _sqlite(words):
+    terms = ['"{}"*'.format(word) for word in words]
+    condition = _matches('SELECT rowid FROM {0}_fts WHERE {0}_fts MATCH %s',
+                         terms)
+    # bm25() is negative, better matches have lower values
+    score = 'COALESCE((SELECT -bm25({0}_fts) FROM {0}_fts ' \
+            'WHERE {0}_fts MATCH %s ' \
+            'AND rowid = accountant_transaction.{1}), 0)'
+    rank = RawSQL(
+        '{} + {}'.format(score.format('accountant_transaction', 'id'),
+                         score.format('accountant_invoice', 'invoice_id')),
+        [' OR '.join(terms)] * 2,
+        output_field=FloatField()
+    )
+    return condition, rank
+
+
+def _postgresql(words):
+    terms = ['{}:*'.format(word) for word in words]
+    condition = _matches("SELECT id FROM {} WHERE to_tsvector('simple', "
+                         "comment) @@ to_tsquery('simple', %s)", terms)
+    rank = RawSQL(
+        "ts_rank(to_tsvector('simple', accountant_transaction.comment), "
+        "to_tsquery('simple', %s)) + "
+        "COALESCE((SELECT ts_rank(to_tsvector('simple', comment), "
+        "to_tsquery('simple', %s)) FROM accountant_invoice "
+        "WHERE id = accountant_transaction.invoice_id), 0)",
+        [' | '.join(terms)] * 2,
+        output_field=FloatField()
+    )
+    return condition, rank
+
+
+def _fallback(words):
+    condition = Q()
+    for word in words:
+        condition &= Q(comment__icontains=word) | \
+            Q(invoice__comment__icontains=word)
+    return lambda queryset: queryset.filter(condition), \
+        Value(0.0, output_field=FloatField())
+
+
+def _build(query: str, queryset):
+    words = terms(query)
+    if not words:
+        return None, None
+    vendor = connections[queryset.db].vendor
+    return {'sqlite': _sqlite, 'postgresql': _postgresql}\
+        .get(vendor, _fallback)(words)
+
+
+def match(query: str, queryset=None):
+    """
+    Function finds transactions that have every word of the query in their
+    comments or in comments of their invoices, words may be prefixes.
+    Full-text index is used on SQLite (FTS5) and PostgreSQL (tsvector), other
+    databases fall back to unindexed substring search.
+    :param queryset: QuerySet with transactions to search in
+    :return: QuerySet with found transactions in no particular order
+    """
+    if queryset is None:
+        queryset = Transaction.objects.all()
+    condition, _ = _build(query, queryset)
+    return queryset.none() if condition is None else condition(queryset)
+
+
+def search(query: str, queryset=None):
+    """
+    Function does the same as `match`, but found transactions are ranked by
+    relevance (there is no ranking without full-text index).
+
+    >>> search('молоко пятёрочка').first().rank
+    4.56
+
+    :return: QuerySet with transactions annotated with `rank`, best first
+    """
+    if queryset is None:
+        queryset = Transaction.objects.all()
+    condition, rank = _build(query, queryset)
+    if condition is None:
+        return queryset.none().annotate(rank=Value(0.0, FloatField()))
+    return condition(queryset)\
+        .annotate(rank=rank)\
+        .order_by('-rank', '-date', '-pk')
+
+
+def filter_amount(queryset, bucket: str):
+    """
+    Function filters transactions by absolute value of amount using one of
+    `AMOUNTS` buckets.
+    """
+    for name, low, high in AMOUNTS:
+        if name == bucket:
+            return queryset.filter(_amount_condition(low, high))
+    raise ValueError('unknown amount bucket {}'.format(bucket))
+
+
+def _amount_condition(low, high):
+    positive, negative = Q(amount__gte=low), Q(amount__lte=-low)
+    if high is not None:
+        positive &= Q(amount__lt=high)
+        negative &= Q(amount__gt=-high)
+    return positive | negative
+
+
+def facets(queryset):
+    """
+    Function calculates facets of found transactions: top accounts, years,
+    currencies with totals and buckets of amount, every facet with one
+    grouped query.
+    :param queryset: QuerySet returned by `match`, maybe filtered
+    :return: dictionary with lists of dictionaries with counts
+    """
+    queryset = queryset.order_by()
+    amounts = queryset.aggregate(**{
+        name: Sum(Case(When(_amount_condition(low, high), then=Value(1)),
+                       default=Value(0), output_field=IntegerField()))
+        for name, low, high in AMOUNTS
+    })
+    return {
+        'accounts': list(queryset
+                         .values('account', 'account__title')
+                         .annotate(count=Count('pk'))
+                         .order_by('-count', 'account__title')[:FACET_SIZE]),
+        'years': list(queryset
+                      .annotate(year=ExtractYear('date'))
+                      .values('year')
+                      .annotate(count=Count('pk'))
+                      .order_by('-year')),
+        'currencies': list(queryset
+                           .values('currency')
+                           .annotate(count=Count('pk'), total=Sum('amount'),
+                                     min=Min('amount'), max=Max('amount'))
+                           .order_by('currency')),
+        'amounts': [{'amount': name, 'count': amounts[name]}
+                    for name, _, _ in AMOUNTS if amounts[name]],
+    }
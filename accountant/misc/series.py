@@ -0,0 +1,124 @@
+from collections import OrderedDict
+from datetime import date, timedelta
+from decimal import Decimal
+
+from django.db.models import Sum, F, DateField, Value, Subquery
+from django.db.models.functions import Coalesce
+
+from accountant.models import Transaction, PeriodClose, Checkpoint
+
+DAY = 'day'
+WEEK = 'week'
+MONTH = 'month'
+GRANULARITIES = (DAY, WEEK, MONTH)
+
+BALANCE = 'balance'
+FLOW = 'flow'
+KINDS = (BALANCE, FLOW)
+
+
+def _period_end(day: date, granularity: str):
+    if granularity == DAY:
+        return day
+    if granularity == WEEK:
+        return day + timedelta(days=6 - day.weekday())
+    next_month = (day.replace(day=28) + timedelta(days=4)).replace(day=1)
+    return next_month - timedelta(days=1)
+
+
+def bucket_ends(start: date, end: date, granularity: str = DAY):
+    """
+    Function splits date range to periods of given granularity. Weeks start
+    on Monday, first and last periods are cut by range bounds.
+
+    >>> bucket_ends(date(2017, 10, 30), date(2017, 11, 7), WEEK)
+    [date(2017, 11, 5), date(2017, 11, 7)]
+
+    :return: list with last dates of periods
+    """
+    if granularity not in GRANULARITIES:
+        raise ValueError('unknown granularity {}'.format(granularity))
+    result = list()
+    day = start
+    while day <= end:
+        result.append(min(_period_end(day, granularity), end))
+        day = result[-1] + timedelta(days=1)
+    return result
+
+
+def downsample(ends: list, max_points: int = None):
+    """
+    Function merges neighbouring periods so there will be no more than
+    `max_points` of them. Last period is always kept, so balance at the end
+    of range stays in the series.
+    :param ends: list with last dates of periods
+    :return: list with last dates of merged periods
+    """
+    if not max_points or len(ends) <= max_points:
+        return ends
+    step = -(-len(ends) // max_points)
+    return ends[::-1][::step][::-1]
+
+
+def series(accounts, start: date, end: date, granularity: str = DAY,
+           kind: str = BALANCE, max_points: int = None):
+    """
+    Function builds time series for set of accounts from one grouped query
+    of approved transactions. For balance series every point is the sum of
+    all transactions up to the end of period, for flow series it's the sum
+    of transactions inside of the period.
+    :param accounts: QuerySet with accounts, usually whole subtree
+    :param kind: `BALANCE` or `FLOW`
+    :param max_points: limit of points, longer series are downsampled
+    :return: list of tuples with last date of period and dictionary with
+     currencies as keys and amounts as values
+    """
+    if kind not in KINDS:
+        raise ValueError('unknown kind {}'.format(kind))
+    ends = downsample(bucket_ends(start, end, granularity), max_points)
+
+    transactions = Transaction.objects\
+        .filter(account__in=accounts, approved=True, date__lte=end)
+    if kind == FLOW:
+        changes = transactions.filter(date__gte=start)\
+            .annotate(day=F('date'))\
+            .values('day', 'currency')\
+            .annotate(amount=Sum('amount'))\
+            .order_by('day', 'currency')
+    else:
+        # Balance at the start is the checkpoint of the latest closed period
+        # plus transactions since its end, so only open period is scanned
+        closed = Subquery(PeriodClose.objects
+                          .filter(date__lte=start)
+                          .order_by('-date')
+                          .values('date')[:1],
+                          output_field=DateField())
+        checkpoints = Checkpoint.objects\
+            .filter(account__in=accounts, period__date=closed)\
+            .annotate(day=F('period__date'))\
+            .values('day', 'currency')\
+            .annotate(amount=Sum('amount'))\
+            .order_by()
+        changes = transactions\
+            .filter(date__gt=Coalesce(closed, Value(date.min)))\
+            .annotate(day=F('date'))\
+            .values('day', 'currency')\
+            .annotate(amount=Sum('amount'))\
+            .order_by()\
+            .union(checkpoints, all=True)\
+            .order_by('day', 'currency')
+    changes = iter(changes)
+
+    result = list()
+    totals = OrderedDict()
+    change = next(changes, None)
+    for period_end in ends:
+        if kind == FLOW:
+            totals = OrderedDict()
+        while change is not None and change['day'] <= period_end:
+            currency = str(change['currency'])
+            totals[currency] = totals.get(currency, Decimal(0)) + \
+                change['amount']
+            change = next(changes, None)
+        result.append((period_end, dict(totals)))
+    return result
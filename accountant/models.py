@@ -1,16 +1,25 @@
+import json
 import logging
 import mimetypes
 import os
+from collections import defaultdict
+from uuid import uuid4
 
 from decimal import Decimal
 from django.conf import settings
 from django.contrib.auth.models import User
-from django.db import models, transaction
-from django.db.models import Sum, Func
+from django.core.exceptions import ValidationError
+from django.db import models, transaction, connections, IntegrityError
+from django.db.models import Sum, Func, F, Q, Case, When, Value, Min
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
 from django.urls import reverse
+from django.utils import timezone
 from django.utils.translation import ugettext_lazy as _
 from djmoney.models.fields import CurrencyField
-from treebeard.ns_tree import NS_Node
+from treebeard.ns_tree import NS_Node, NS_NodeManager, NS_NodeQuerySet
+
+from accountant.misc.db import BATCH_SIZE, batches, bulk_set, case_of_values
 
 logger = logging.getLogger(__name__)
 
@@ -20,7 +29,104 @@ class Round(Func):
     template='%(function)s(%(expressions)s, {})'.format(settings.DECIMAL_PLACES)
 
 
+class VersionStamp(models.Model):
+    """
+    Random stamp that is replaced on every change of some set of data. Caches
+    of all processes compare their stamp with this one to find out whether
+    they are stale. Stamp is random, not sequential, so rolled back changes
+    can't make two different states look the same.
+    """
+    name = models.CharField(
+        verbose_name=_('name'),
+        max_length=64,
+        primary_key=True
+    )
+    value = models.CharField(
+        verbose_name=_('value'),
+        max_length=32
+    )
+    updated = models.DateTimeField(
+        verbose_name=_('updated'),
+        default=timezone.now
+    )
+
+    @classmethod
+    def get(cls, name: str):
+        return cls.objects.filter(name=name)\
+            .values_list('value', flat=True)\
+            .first()
+
+    @classmethod
+    def state(cls, names):
+        """
+        method returns combined stamp of several sets of data and time of
+         the latest change of them with one query.
+        :return: tuple with string and datetime or None if data never changed
+        """
+        stamps = {name: (value, updated) for name, value, updated in
+                  cls.objects.filter(name__in=names)
+                  .values_list('name', 'value', 'updated')}
+        return (
+            '-'.join(stamps.get(name, ('', None))[0] for name in names),
+            max((i[1] for i in stamps.values()), default=None)
+        )
+
+    @classmethod
+    def values(cls, names):
+        """
+        method returns stamps of several sets of data with one query.
+        :return: tuple with stamps in order of names, None for data that
+         never changed
+        """
+        stamps = dict(cls.objects.filter(name__in=names)
+                      .values_list('name', 'value'))
+        return tuple(stamps.get(name) for name in names)
+
+    @classmethod
+    def bump(cls, name: str):
+        value, updated = uuid4().hex, timezone.now()
+        if not cls.objects.filter(name=name).update(value=value,
+                                                    updated=updated):
+            cls.objects.update_or_create(
+                name=name, defaults={'value': value, 'updated': updated})
+        return value
+
+    def __str__(self):
+        return '{} {}'.format(self.name, self.value)
+
+
+class AccountQuerySet(NS_NodeQuerySet):
+    @transaction.atomic
+    def delete(self, removed_ranges=None):
+        super(AccountQuerySet, self).delete(removed_ranges)
+        # Treebeard calls this method again with removed ranges after
+        # collecting descendants, so subtree totals are fixed only once
+        if removed_ranges is not None:
+            TreeSheaf.rebuild({tree_id for tree_id, _, _ in removed_ranges})
+            VersionStamp.bump(Account.VERSION)
+
+    def with_sheaves(self):
+        """
+        method returns QuerySet with prefetched sheaves and subtree totals, so
+         whole list of accounts is rendered with three queries.
+        """
+        return self.prefetch_related('sheaves', 'tree_sheaves')
+
+    def update(self, **kwargs):
+        result = super(AccountQuerySet, self).update(**kwargs)
+        VersionStamp.bump(Account.VERSION)
+        return result
+
+
+class AccountManager(NS_NodeManager):
+    def get_queryset(self):
+        return AccountQuerySet(self.model).order_by('tree_id', 'lft')
+
+
 class Account(NS_Node):
+    # Name of version stamp of all accounts (see `accountant.misc.registry`)
+    VERSION = 'accounts'
+
     INCOME = 1
     EXPENSE = 2
     ACCOUNT = 3
@@ -62,6 +168,8 @@ class Account(NS_Node):
         blank=True
     )
 
+    objects = AccountManager()
+
     def get_absolute_url(self):
         return reverse('accountant:account_detail', kwargs={'pk': self.pk})
 
@@ -88,41 +196,41 @@ class Account(NS_Node):
         """
         Property contains list of sheaves for the account, sorted buy currency
         in alphabetical order. Sheaf in base currency will be placed of first
-        place if exists.
+        place if exists. Sheaves are sorted in memory, so prefetched ones
+        (see `AccountQuerySet.with_sheaves`) don't cause queries.
         :return:
         """
-        result = list()
-        for sheaf in self.sheaves.order_by('currency'):
-            if sheaf.currency == settings.BASE_CURRENCY:
-                result.insert(0, sheaf)
-            else:
-                result.append(sheaf)
-        return result
+        return self.__sort_sheaves(self.sheaves.all())
 
-    def recalculate_summary(self, atomic=True):
-        def do():
-            self.sheaves.all().delete()
-            result = Transaction.objects.filter(account=self)\
-                .filter(approved=True)\
-                .values('currency')\
-                .annotate(amount=Sum('amount'))\
-                .order_by('currency')
-            for item in result:
-                Sheaf.objects.create(account=self,
-                                     amount=item['amount'],
-                                     currency=item['currency']).save()
+    @property
+    def sorted_tree_sheaves(self):
+        """
+        Property contains subtree totals of the account sorted like
+        `sorted_sheaves`
+        """
+        return self.__sort_sheaves(self.tree_sheaves.all())
 
-        if atomic:
-            with transaction.atomic():
-                do()
-        else:
-            do()
+    @staticmethod
+    def __sort_sheaves(sheaves):
+        return sorted(sheaves, key=lambda i: (
+            str(i.currency) != settings.BASE_CURRENCY, str(i.currency)))
+
+    def recalculate_summary(self):
+        """
+        method rebuilds sheaves and daily balances of the account from its
+         approved transactions.
+        :return: list of changed sheaves (see `accountant.misc.ledger.Diff`)
+        """
+        from accountant.misc import ledger
+        return ledger.rebuild(Account.objects.filter(pk=self.pk))
 
     def summary_at(self, date):
         """
         method returns QuerySet with dictionaries with expected account summary
          for specified date (including that date) for this account and all
          child ones. Result is sorted by currency in alphabetical order.
+         Summary is read from daily balances, so only approved transactions
+         are counted.
 
         >>> account = Account.objects.get(pk=1)
         >>> account.summary_at(date.today())
@@ -132,15 +240,56 @@ class Account(NS_Node):
         :param date: date of summary
         :return: dictionary with summary
         """
-        return Transaction.objects.filter(account__in=self.get_tree(self))\
-            .filter(date__lte=date)\
+        return DailyBalance.latest(self.get_tree(self), date)\
             .values('currency')\
             .annotate(amount=Sum('amount'))\
             .order_by('currency')
 
+    def balance_history(self, dates):
+        """
+        method returns list with summaries of this account and all child ones
+         for each of specified dates. Every summary is a dictionary with
+         currencies as keys and amounts as values. Whole history is built
+         from two queries regardless of number of dates.
+
+        >>> account = Account.objects.get(pk=1)
+        >>> account.balance_history([date(2017, 10, 1), date(2017, 10, 2)])
+        [{'RUB': Decimal('88891.50000')}, {'RUB': Decimal('88391.50000')}]
+
+        :param dates: iterable with dates in ascending order
+        :return: list with dictionaries
+        """
+        dates = list(dates)
+        if not dates:
+            return list()
+        tree = self.get_tree(self)
+        balances = {
+            (i['account'], i['currency']): i['amount']
+            for i in DailyBalance.latest(tree, dates[0])
+                .values('account', 'currency', 'amount')
+        }
+        changes = iter(DailyBalance.objects.filter(account__in=tree)
+                       .filter(date__gt=dates[0], date__lte=dates[-1])
+                       .values('account', 'currency', 'date', 'amount')
+                       .order_by('date'))
+        change = next(changes, None)
+
+        result = list()
+        for date in dates:
+            while change is not None and change['date'] <= date:
+                balances[(change['account'], change['currency'])] = \
+                    change['amount']
+                change = next(changes, None)
+            summary = dict()
+            for (account, currency), amount in balances.items():
+                summary[currency] = summary.get(currency, Decimal(0)) + amount
+            result.append(summary)
+        return result
+
     def tree_summary(self):
         """
-        method returns summary of all child accounts ordered by currency
+        method returns summary of all child accounts ordered by currency.
+         Summary is read from precalculated subtree totals (see `TreeSheaf`).
         >>> account = Account.objects.get(pk=34)
         >>> account.tree_summary()
         <QuerySet [{'currency': 'GBP', 'amount': Decimal('99.00000')},
@@ -149,9 +298,21 @@ class Account(NS_Node):
 
         :return: QuerySet with summary
         """
-        return Sheaf.objects.filter(account__in=self.get_tree(self))\
-            .values('currency')\
-            .annotate(amount=Sum('amount')).order_by('currency')
+        return self.tree_sheaves.values('currency', 'amount')\
+            .order_by('currency')
+
+    @transaction.atomic
+    def move(self, target, pos=None):
+        tree_ids = {self.tree_id, target.tree_id}
+        super(Account, self).move(target, pos)
+        tree_ids.add(Account.objects.get(pk=self.pk).tree_id)
+        TreeSheaf.rebuild(tree_ids)
+        VersionStamp.bump(self.VERSION)
+
+    def save(self, *args, **kwargs):
+        result = super(Account, self).save(*args, **kwargs)
+        VersionStamp.bump(self.VERSION)
+        return result
 
     @staticmethod
     def get_expenses():
@@ -209,13 +370,501 @@ class Sheaf(models.Model):
     def __ne__(self, other):
         return not self.__eq__(other)
 
+    @classmethod
+    def add(cls, account_id: int, currency: str, amount: Decimal):
+        """
+        method adds amount to the sheaf of specified account and currency,
+         sheaf will be created if it doesn't exist yet and deleted if it
+         becomes zero.
+        """
+        if not amount:
+            return
+        rows = cls.objects.filter(account_id=account_id, currency=currency)
+        if rows.update(amount=F('amount') + amount):
+            TreeSheaf.add(account_id, currency, amount)
+            rows.filter(amount=0).delete()
+        else:
+            cls.objects.create(account_id=account_id,
+                               currency=currency,
+                               amount=amount)
+
+    @transaction.atomic
+    def save(self, *args, **kwargs):
+        old = Sheaf.objects.filter(pk=self.pk)\
+            .values_list('account', 'currency', 'amount')\
+            .first() if self.pk else None
+        super(Sheaf, self).save(*args, **kwargs)
+        if old is not None:
+            TreeSheaf.add(*old[:2], amount=-old[2])
+        TreeSheaf.add(self.account_id, str(self.currency),
+                      Decimal(self.amount))
+
+    @transaction.atomic
+    def delete(self, *args, **kwargs):
+        TreeSheaf.add(self.account_id, str(self.currency),
+                      -Decimal(self.amount))
+        return super(Sheaf, self).delete(*args, **kwargs)
+
+    class Meta:
+        unique_together = ('account', 'currency')
+
+
+class TreeSheaf(models.Model):
+    """
+    Total of sheaves of account and all its descendants in some currency.
+    It's kept in sync with sheaves along the path to the root of the tree, so
+    summary of any subtree is a single lookup.
+    """
+    account = models.ForeignKey(
+        verbose_name=_('account'),
+        to=Account,
+        related_name='tree_sheaves'
+    )
+    amount = models.DecimalField(
+        verbose_name=_('subtree total'),
+        max_digits=settings.MAX_DIGITS,
+        decimal_places=settings.DECIMAL_PLACES
+    )
+    currency = CurrencyField(
+        verbose_name=_('currency'),
+        price_field='amount',
+        default=settings.BASE_CURRENCY
+    )
+
+    @classmethod
+    def add(cls, account_id: int, currency: str, amount: Decimal):
+        """
+        method adds amount to subtree totals of specified account and all its
+         ancestors, missing totals will be created and totals that become
+         zero will be deleted.
+        """
+        if not amount:
+            return
+        node = Account.objects.filter(pk=account_id)\
+            .values('tree_id', 'lft', 'rgt', 'depth')\
+            .first()
+        if node is None:
+            return
+        ancestors = Account.objects.filter(tree_id=node['tree_id'],
+                                           lft__lte=node['lft'],
+                                           rgt__gte=node['rgt'])
+        totals = cls.objects.filter(account__in=ancestors, currency=currency)
+        if totals.update(amount=F('amount') + amount) < node['depth']:
+            cls.objects.bulk_create([
+                cls(account_id=pk, currency=currency, amount=amount)
+                for pk in ancestors
+                    .exclude(pk__in=totals.values('account'))
+                    .values_list('pk', flat=True)
+            ])
+        totals.filter(amount=0).delete()
+
+    @staticmethod
+    def calculate(accounts, sheaves):
+        """
+        method sums sheaves up along the tree.
+        :param accounts: iterable with (id, tree id, lft, rgt) tuples
+        :param sheaves: iterable with (account id, currency, amount) tuples
+        :return: dictionary with non-zero subtree totals by (account id,
+         currency)
+        """
+        ancestors = dict()
+        stack = list()
+        for pk, tree_id, lft, rgt in sorted(accounts, key=lambda x: x[1:3]):
+            while stack and (stack[-1][1] != tree_id or stack[-1][2] < lft):
+                stack.pop()
+            stack.append((pk, tree_id, rgt))
+            ancestors[pk] = [i[0] for i in stack]
+
+        result = defaultdict(Decimal)
+        for account_id, currency, amount in sheaves:
+            for pk in ancestors.get(account_id, ()):
+                result[(pk, currency)] += amount
+        return {key: amount for key, amount in result.items() if amount}
+
+    @classmethod
+    def rebuild(cls, tree_ids=None):
+        """
+        method recalculates subtree totals of specified trees from sheaves.
+        :param tree_ids: iterable with ids of trees, all trees will be
+         rebuilt if it's None
+        """
+        accounts = Account.objects.all()
+        if tree_ids is not None:
+            accounts = accounts.filter(tree_id__in=list(tree_ids))
+        totals = cls.calculate(
+            accounts.values_list('pk', 'tree_id', 'lft', 'rgt'),
+            Sheaf.objects.filter(account__in=accounts)
+                .values_list('account', 'currency', 'amount')
+        )
+        cls.objects.filter(account__in=accounts).delete()
+        cls.objects.bulk_create(
+            [cls(account_id=account_id, currency=currency, amount=amount)
+             for (account_id, currency), amount in totals.items()],
+            batch_size=500
+        )
+        VersionStamp.bump(Transaction.VERSION)
+
+    def __str__(self):
+        return '{amount} {currency} on {account} with descendants'.format(
+            amount=self.amount,
+            currency=self.currency,
+            account=self.account
+        )
+
     class Meta:
         unique_together = ('account', 'currency')
 
 
+class DailyBalance(models.Model):
+    """
+    Closing balance of account in some currency at the end of the day. Rows
+    exist only for days with approved transactions, so balance at any date is
+    the amount of the latest row not later than that date.
+    """
+    account = models.ForeignKey(
+        verbose_name=_('account'),
+        to=Account,
+        related_name='daily_balances'
+    )
+    date = models.DateField(
+        verbose_name=_('date')
+    )
+    amount = models.DecimalField(
+        verbose_name=_('closing balance'),
+        max_digits=settings.MAX_DIGITS,
+        decimal_places=settings.DECIMAL_PLACES
+    )
+    currency = CurrencyField(
+        verbose_name=_('currency'),
+        price_field='amount',
+        default=settings.BASE_CURRENCY
+    )
+
+    @classmethod
+    def add(cls, account_id: int, currency: str, date, amount: Decimal):
+        """
+        method adds amount to closing balances of specified account and
+         currency at the date and all later dates. Row for the date will be
+         created if it doesn't exist yet and deleted if there are no approved
+         transactions at the date anymore. It should be called after
+         transactions are written.
+        """
+        rows = cls.objects.filter(account_id=account_id, currency=currency)
+        if not Transaction.objects.filter(account_id=account_id,
+                                          currency=currency, date=date,
+                                          approved=True).exists():
+            rows.filter(date=date).delete()
+            if amount:
+                rows.filter(date__gt=date).update(amount=F('amount') + amount)
+            return
+        if not rows.filter(date=date).exists():
+            previous = rows.filter(date__lt=date)\
+                .order_by('-date')\
+                .values_list('amount', flat=True)\
+                .first()
+            cls.objects.create(account_id=account_id,
+                               currency=currency,
+                               date=date,
+                               amount=previous or Decimal(0))
+        if amount:
+            rows.filter(date__gte=date).update(amount=F('amount') + amount)
+
+    @classmethod
+    def latest(cls, accounts, date):
+        """
+        method returns QuerySet with the latest closing balance not later
+         than specified date for every account and currency. Every balance
+         is found by one seek of (account, currency, date) index, so cost
+         doesn't depend on length of history.
+        :param accounts: QuerySet or iterable with accounts
+        :param date: date of balances
+        :return: QuerySet with DailyBalance objects
+        """
+        rows = cls.objects.filter(account__in=accounts)
+        keys = rows.values_list('account', 'currency').distinct().order_by()
+        latest = [
+            cls.objects.filter(account=account_id, currency=currency,
+                               date__lte=date)
+            .order_by('-date').values_list('pk', flat=True).first()
+            for account_id, currency in keys
+        ]
+        return cls.objects.filter(pk__in=[i for i in latest if i is not None])
+
+    def __str__(self):
+        return '{amount} {currency} on {account} at {date}'.format(
+            amount=self.amount,
+            currency=self.currency,
+            account=self.account,
+            date=self.date
+        )
+
+    class Meta:
+        unique_together = ('account', 'currency', 'date')
+
+
+class ExchangeRate(models.Model):
+    """
+    Price of one unit of currency in base currency at some date. Rate at any
+    date is the rate of the latest row not later than that date (see
+    `accountant.misc.rates`).
+    """
+    VERSION = 'rates'
+
+    currency = CurrencyField(
+        verbose_name=_('currency')
+    )
+    date = models.DateField(
+        verbose_name=_('date')
+    )
+    rate = models.DecimalField(
+        verbose_name=_('rate'),
+        max_digits=settings.MAX_DIGITS,
+        decimal_places=10
+    )
+
+    def __str__(self):
+        return '{currency} = {rate} {base} at {date}'.format(
+            currency=self.currency,
+            rate=self.rate,
+            base=settings.BASE_CURRENCY,
+            date=self.date
+        )
+
+    class Meta:
+        unique_together = ('currency', 'date')
+
+
+class ClosedPeriodError(ValidationError):
+    pass
+
+
+class PeriodClose(models.Model):
+    """
+    Closed period of the ledger. Closing balances of all accounts at the end
+    of the period are frozen in checkpoints, so balance at any later date is
+    the checkpoint plus transactions since the period end. Transactions dated
+    by closed period can't be changed unless CLOSED_PERIOD_EDITS setting is
+    'recompute', then all affected checkpoints are recomputed.
+    """
+    date = models.DateField(
+        verbose_name=_('end of period'),
+        unique=True
+    )
+    user = models.ForeignKey(
+        verbose_name=_('user'),
+        to=User,
+        blank=True,
+        null=True
+    )
+    created = models.DateTimeField(
+        verbose_name=_('closed at'),
+        auto_now_add=True
+    )
+
+    @classmethod
+    def last_date(cls):
+        return cls.objects.values_list('date', flat=True).first()
+
+    @classmethod
+    @transaction.atomic
+    def close(cls, date, user=None):
+        """
+        method closes the period from the previous close till specified date.
+         Checkpoints are built from checkpoints of the previous period and one
+         grouped query of transactions since then.
+        :return: new PeriodClose object
+        """
+        previous = cls.objects.first()
+        if previous is not None and previous.date >= date:
+            raise ValueError('period till {} is already closed'
+                             .format(previous.date))
+
+        amounts = defaultdict(Decimal)
+        transactions = Transaction.objects.filter(approved=True,
+                                                  date__lte=date)
+        if previous is not None:
+            for account_id, currency, amount in previous.checkpoints\
+                    .values_list('account', 'currency', 'amount'):
+                amounts[(account_id, str(currency))] += amount
+            transactions = transactions.filter(date__gt=previous.date)
+        for item in transactions.values('account', 'currency')\
+                .annotate(amount=Sum('amount'))\
+                .order_by():
+            amounts[(item['account'], str(item['currency']))] += \
+                item['amount']
+
+        period = cls.objects.create(date=date, user=user)
+        Checkpoint.objects.bulk_create([
+            Checkpoint(period=period, account_id=account_id,
+                       currency=currency, amount=amount)
+            for (account_id, currency), amount in sorted(amounts.items())
+            if amount
+        ])
+        logger.info('Period till {} closed'.format(date))
+        return period
+
+    @classmethod
+    def reopen(cls, date):
+        """
+        method removes all closes not earlier than specified date together
+         with their checkpoints.
+        """
+        logger.info('Periods since {} reopened'.format(date))
+        return cls.objects.filter(date__gte=date).delete()
+
+    def __str__(self):
+        return _('Period till {date}').format(date=self.date)
+
+    class Meta:
+        ordering = ['-date']
+
+
+class Checkpoint(models.Model):
+    """
+    Closing balance of account in some currency at the end of closed period
+    """
+    period = models.ForeignKey(
+        verbose_name=_('period'),
+        to=PeriodClose,
+        related_name='checkpoints'
+    )
+    account = models.ForeignKey(
+        verbose_name=_('account'),
+        to=Account,
+        related_name='checkpoints'
+    )
+    amount = models.DecimalField(
+        verbose_name=_('closing balance'),
+        max_digits=settings.MAX_DIGITS,
+        decimal_places=settings.DECIMAL_PLACES
+    )
+    currency = CurrencyField(
+        verbose_name=_('currency'),
+        price_field='amount',
+        default=settings.BASE_CURRENCY
+    )
+
+    @classmethod
+    def apply(cls, deltas: dict):
+        """
+        method checks changes of balances (see `Transaction.ledger_delta`)
+         against closed periods. Changes in closed periods are rejected with
+         ClosedPeriodError or added to checkpoints of all periods closed
+         after their dates, depending on CLOSED_PERIOD_EDITS setting.
+        """
+        closed = PeriodClose.last_date()
+        if closed is None:
+            return
+        late = {key: amount for key, amount in deltas.items()
+                if amount and key[2] <= closed}
+        if not late:
+            return
+        if getattr(settings, 'CLOSED_PERIOD_EDITS', 'reject') != 'recompute':
+            raise ClosedPeriodError(
+                _('Period till {date} is closed').format(date=closed))
+
+        for (account_id, currency, date), amount in late.items():
+            periods = set(PeriodClose.objects.filter(date__gte=date)
+                          .values_list('pk', flat=True))
+            rows = cls.objects.filter(period__in=periods,
+                                      account_id=account_id,
+                                      currency=currency)
+            existing = set(rows.values_list('period', flat=True))
+            rows.update(amount=F('amount') + amount)
+            cls.objects.bulk_create([
+                cls(period_id=period_id, account_id=account_id,
+                    currency=currency, amount=amount)
+                for period_id in sorted(periods - existing)
+            ])
+        logger.info('Checkpoints recomputed after change of closed period')
+
+    def __str__(self):
+        return '{amount} {currency} on {account} at {date}'.format(
+            amount=self.amount,
+            currency=self.currency,
+            account=self.account,
+            date=self.period.date
+        )
+
+    class Meta:
+        unique_together = ('period', 'account', 'currency')
+
+
+class InvoiceQuerySet(models.QuerySet):
+    @transaction.atomic
+    def ingest(self, invoices):
+        """
+        method saves invoices together with their transactions. Transactions
+         of all invoices are inserted with bulk queries and their changes of
+         balances are applied once (see `TransactionQuerySet.bulk_create`).
+
+        >>> invoice = Invoice(timestamp=timezone.now())
+        >>> Invoice.objects.ingest([(invoice, [Transaction(...), ...])])
+        [<Invoice: Invoice dated by 2017-10-15 22:38:00+03:00>]
+
+        :param invoices: iterable with (invoice, list of transactions) tuples
+        :return: list with saved invoices
+        """
+        invoices = list(invoices)
+        if connections[self.db].features.can_return_ids_from_bulk_insert:
+            self.bulk_create([invoice for invoice, _ in invoices])
+        else:
+            for invoice, _ in invoices:
+                invoice.save(using=self.db)
+
+        transactions = list()
+        for invoice, items in invoices:
+            for item in items:
+                item.invoice = invoice
+                transactions.append(item)
+        Transaction.objects.using(self.db).bulk_create(transactions)
+        return [invoice for invoice, _ in invoices]
+
+    def receipts(self, fiscal_ids=None):
+        """
+        method finds invoices created from receipts with given fiscal
+         identifiers with unique index (see `Invoice.fiscal_id`).
+        :param fiscal_ids: iterable with (fiscal drive number, fiscal
+         document number, fiscal sign) tuples, all invoices created from
+         receipts are found by default
+        :return: dictionary with primary keys of invoices by identifiers
+        """
+        if fiscal_ids is None:
+            invoices = self.exclude(fiscal_sign=None)
+        else:
+            condition = Q()
+            for drive, document, sign in fiscal_ids:
+                condition |= Q(fiscal_drive_number=drive,
+                               fiscal_document_number=document,
+                               fiscal_sign=sign)
+            if not condition:
+                return dict()
+            invoices = self.filter(condition)
+        return {row[:3]: row[3] for row in invoices.order_by().values_list(
+            *Invoice.FISCAL_FIELDS + ('pk',))}
+
+    @transaction.atomic
+    def delete(self):
+        # Transactions are deleted explicitly to keep balances in sync,
+        # cascade deletion doesn't know anything about them
+        Transaction.objects.filter(invoice__in=self).delete()
+        return super(InvoiceQuerySet, self).delete()
+
+    def bulk_create(self, objs, batch_size=None):
+        result = super(InvoiceQuerySet, self).bulk_create(objs, batch_size)
+        VersionStamp.bump(Transaction.VERSION)
+        return result
+
+    def update(self, **kwargs):
+        result = super(InvoiceQuerySet, self).update(**kwargs)
+        VersionStamp.bump(Transaction.VERSION)
+        return result
+
+
 class Invoice(models.Model):
     timestamp = models.DateTimeField(
-        verbose_name=_('date and time')
+        verbose_name=_('date and time'),
+        db_index=True
     )
 
     comment = models.TextField(
@@ -230,12 +879,45 @@ class Invoice(models.Model):
         null=True
     )
 
+    # Fiscal identifiers of receipt the invoice is created from, together
+    # they identify the receipt and guard against importing it twice
+    fiscal_drive_number = models.CharField(
+        verbose_name=_('fiscal drive number'),
+        max_length=32,
+        blank=True,
+        null=True
+    )
+    fiscal_document_number = models.BigIntegerField(
+        verbose_name=_('fiscal document number'),
+        blank=True,
+        null=True
+    )
+    fiscal_sign = models.BigIntegerField(
+        verbose_name=_('fiscal sign'),
+        blank=True,
+        null=True
+    )
+    FISCAL_FIELDS = ('fiscal_drive_number', 'fiscal_document_number',
+                     'fiscal_sign')
+
+    objects = InvoiceQuerySet.as_manager()
+
+    @property
+    def fiscal_id(self):
+        """
+        Tuple with fiscal drive number, fiscal document number and fiscal
+         sign or None if the invoice isn't created from receipt
+        """
+        key = tuple(getattr(self, name) for name in self.FISCAL_FIELDS)
+        return None if None in key else key
+
     def json(self):
         return {
             'id': self.id,
             'timestamp': self.timestamp.isoformat(),
             'comment': self.comment,
-            'user': self.user.id
+            'user': self.user.id,
+            'fiscal_id': self.fiscal_id
         }
 
     def get_absolute_url(self):
@@ -253,6 +935,8 @@ class Invoice(models.Model):
         :return: QuerySet with amounts and currencies. Empty QuerySet can
          be thought as sign of verified invoice.
         """
+        if hasattr(self, '_transactions'):
+            return self._summarize_transactions()[0]
         return self.transactions\
             .values('currency')\
             .annotate(amount=Round(Sum('amount')))\
@@ -263,6 +947,44 @@ class Invoice(models.Model):
     def is_verified(self):
         return not bool(self.verify())
 
+    def fetch_transactions(self):
+        """
+        method fetches all transactions of the invoice with their accounts
+         by one query and calculates P&L, imbalance and groups of accounts
+         and transactions in memory. After that `pnl`, `verify`, `incomes`,
+         `income_transactions` and others return these results and don't
+         query database anymore.
+        :return: the invoice itself
+        """
+        self._transactions = list(self.transactions
+                                  .select_related('account')
+                                  .order_by('date', 'pk'))
+        return self
+
+    def _summarize_transactions(self):
+        """
+        method calculates imbalance and P&L of transactions, which were
+         fetched by `fetch_transactions` or prefetched to `_transactions`
+         attribute (see `InvoiceListView`), once.
+        :return: tuple with imbalance and P&L lists
+        """
+        if getattr(self, '_summary', (None,))[0] is not self._transactions:
+            pnl, total = defaultdict(Decimal), defaultdict(Decimal)
+            for item in self._transactions:
+                total[item.currency] += item.amount
+                if item.account.type == Account.ACCOUNT:
+                    pnl[item.currency] += item.amount
+            exp = Decimal(1).scaleb(-settings.DECIMAL_PLACES)
+            imbalance = [
+                {'currency': currency, 'amount': amount.quantize(exp)}
+                for currency, amount in sorted(total.items())
+                if amount.quantize(exp)
+            ]
+            pnl = [{'currency': currency, 'amount': amount}
+                   for currency, amount in sorted(pnl.items()) if amount]
+            self._summary = (self._transactions, imbalance, pnl)
+        return self._summary[1:]
+
     @property
     def pnl(self):
         """
@@ -276,6 +998,8 @@ class Invoice(models.Model):
         >>> invoice.verify()
         <QuerySet [{'amount': Decimal('-500.00000'), 'currency': 'RUB'}]>
         """
+        if hasattr(self, '_transactions'):
+            return self._summarize_transactions()[1]
         return Transaction.objects\
             .filter(invoice=self)\
             .filter(account__type=Account.ACCOUNT)\
@@ -285,11 +1009,20 @@ class Invoice(models.Model):
             .order_by('currency')
 
     def __get_distinct_accounts_by_type(self, type: int):
+        if hasattr(self, '_transactions'):
+            accounts = {i.account.pk: i.account for i in self._transactions
+                        if i.account.type == type}
+            return sorted(accounts.values(), key=lambda i: (i.tree_id, i.lft))
         return Account.objects \
             .filter(transactions__invoice=self) \
             .filter(type=type) \
             .distinct()
 
+    def __get_transactions_by_type(self, type: int):
+        if hasattr(self, '_transactions'):
+            return [i for i in self._transactions if i.account.type == type]
+        return self.transactions.filter(account__type=type)
+
     @property
     def incomes(self):
         """
@@ -313,15 +1046,25 @@ class Invoice(models.Model):
 
     @property
     def income_transactions(self):
-        return self.transactions.filter(account__in=self.incomes)
+        return self.__get_transactions_by_type(Account.INCOME)
 
     @property
     def expense_transactions(self):
-        return self.transactions.filter(account__in=self.expenses)
+        return self.__get_transactions_by_type(Account.EXPENSE)
 
     @property
     def internal_transactions(self):
-        return self.transactions.filter(account__in=self.accounts)
+        return self.__get_transactions_by_type(Account.ACCOUNT)
+
+    @transaction.atomic
+    def save(self, *args, **kwargs):
+        super(Invoice, self).save(*args, **kwargs)
+        VersionStamp.bump(Transaction.VERSION)
+
+    @transaction.atomic
+    def delete(self, *args, **kwargs):
+        self.transactions.all().delete()
+        return super(Invoice, self).delete(*args, **kwargs)
 
     def __str__(self):
         return _('Invoice dated by {timestamp}{comment}').format(
@@ -331,9 +1074,251 @@ class Invoice(models.Model):
 
     class Meta:
         ordering = ['-timestamp']
+        unique_together = ('fiscal_drive_number', 'fiscal_document_number',
+                           'fiscal_sign')
+        # pages of invoices are ordered and sought by (timestamp, id)
+        index_together = [('timestamp', 'id')]
+
+
+class TransactionQuerySet(models.QuerySet):
+    LEDGER_FIELDS = {'account', 'account_id', 'amount', 'currency', 'date',
+                     'approved'}
+    # Fields that move transactions between running balances, not approved
+    # transactions have running balances too
+    POSITION_FIELDS = {'account', 'account_id', 'currency', 'date'}
+    # Fields stored by categorization index of goods (see `ItemCategory`)
+    CATEGORY_FIELDS = {'account', 'account_id', 'comment', 'unit'}
+
+    def ledger_deltas(self, sign: int = 1):
+        """
+        method returns changes of balances caused by transactions of this
+         QuerySet calculated with one grouped query.
+        :param sign: 1 for added transactions, -1 for removed ones
+        :return: dictionary with (account id, currency, date) tuples as keys
+         and amounts as values
+        """
+        deltas = defaultdict(Decimal)
+        for item in self.filter(approved=True)\
+                .values('account', 'currency', 'date')\
+                .annotate(amount=Sum('amount'))\
+                .order_by():
+            deltas[(item['account'], item['currency'], item['date'])] += \
+                sign * item['amount']
+        return deltas
+
+    def before(self, date, pk):
+        """
+        method returns transactions placed before specified position in
+         (date, id) order, latest ones first.
+        """
+        return self.filter(Q(date__lt=date) | Q(date=date, pk__lt=pk))\
+            .order_by('-date', '-pk')
+
+    def after(self, date, pk):
+        """
+        method returns transactions placed after specified position in
+         (date, id) order.
+        """
+        return self.filter(Q(date__gt=date) | Q(date=date, pk__gt=pk))
+
+    def balance_at(self, account, currency, date):
+        """
+        method returns running balance of the account in the currency at the
+         end of specified date with one index seek.
+        :return: Decimal with balance
+        """
+        return self.filter(account=account, currency=currency)\
+            .filter(date__lte=date)\
+            .order_by('-date', '-pk')\
+            .values_list('balance', flat=True)\
+            .first() or Decimal(0)
+
+    def repair_balances(self, since: dict = None, dry_run: bool = False):
+        """
+        method recalculates running balances of transactions.
+        :param since: dictionary with (account id, currency) tuples as keys
+         and dates as values, balances are recalculated starting from these
+         dates. If it's None, balances of all accounts and currencies of this
+         QuerySet are recalculated from the very beginning.
+        :param dry_run: if True wrong balances will be counted, but not fixed
+        :return: number of fixed transactions
+        """
+        if since is None:
+            since = {(i['account'], i['currency']): None for i in
+                     self.values('account', 'currency').distinct().order_by()}
+
+        fixed = dict()
+        for (account_id, currency), date in since.items():
+            rows = Transaction.objects.filter(account_id=account_id,
+                                              currency=currency)
+            balance = Decimal(0)
+            if date is not None:
+                balance = rows.filter(date__lt=date)\
+                    .order_by('-date', '-pk')\
+                    .values_list('balance', flat=True)\
+                    .first() or Decimal(0)
+                rows = rows.filter(date__gte=date)
+            for pk, amount, approved, old_balance in rows\
+                    .order_by('date', 'pk')\
+                    .values_list('pk', 'amount', 'approved', 'balance')\
+                    .iterator():
+                if approved:
+                    balance += amount
+                if balance != old_balance:
+                    fixed[pk] = balance
+        if fixed and not dry_run:
+            bulk_set(Transaction, 'balance', fixed)
+            VersionStamp.bump(Transaction.VERSION)
+        return len(fixed)
+
+    def positions(self):
+        """
+        method returns the earliest date of transactions of this QuerySet for
+         every account and currency with one grouped query.
+        :return: list with (account id, currency, date) tuples
+        """
+        return list(self.values_list('account', 'currency')
+                    .annotate(Min('date')).order_by())
+
+    @staticmethod
+    def earliest_dates(deltas):
+        """
+        method returns the earliest changed date for every account and
+         currency in deltas (see `ledger_deltas`) or other iterable with
+         (account id, currency, date) tuples.
+        """
+        result = dict()
+        for account_id, currency, date in deltas:
+            key = (account_id, currency)
+            result[key] = min(result.get(key, date), date)
+        return result
+
+    @transaction.atomic
+    def bulk_create(self, objs, batch_size=None):
+        """
+        method inserts transactions with one query per batch. Changes of
+         balances are summed up and applied once per account, currency and
+         date, running balances are recalculated from the earliest date of
+         new transactions.
+        """
+        objs = list(objs)
+        result = super(TransactionQuerySet, self).bulk_create(objs,
+                                                              batch_size)
+        deltas = defaultdict(Decimal)
+        since = dict()
+        for obj in objs:
+            for key, amount in obj.ledger_delta().items():
+                deltas[key] += amount
+            key = (obj.account_id, str(obj.currency))
+            since[key] = min(since.get(key, obj.date), obj.date)
+        Transaction.apply_deltas(deltas)
+        self.repair_balances(since)
+        ItemCategory.learn(objs)
+        VersionStamp.bump(Transaction.VERSION)
+        return result
+
+    @transaction.atomic
+    def bulk_update(self, objs, fields, batch_size=None):
+        """
+        method saves changed fields of many transactions with one UPDATE
+         query per batch. Old balances of all transactions are taken back
+         with one grouped query, new ones are applied once per account,
+         currency and date and running balances are recalculated from the
+         earliest changed date.
+        :param objs: list with changed Transaction objects
+        :param fields: names of fields to save
+        :return: number of updated rows
+        """
+        objs = [obj for obj in objs if obj.pk is not None]
+        if not objs:
+            return 0
+        batch_size = batch_size or BATCH_SIZE
+        ledger_changed = self.LEDGER_FIELDS.intersection(fields)
+        moved = self.POSITION_FIELDS.intersection(fields)
+        deltas = defaultdict(Decimal)
+        positions = list()
+        result = 0
+        for batch in batches(objs, batch_size):
+            rows = Transaction.objects.filter(pk__in=[obj.pk for obj in batch])
+            if moved:
+                positions.extend(rows.positions())
+                positions.extend((obj.account_id, str(obj.currency), obj.date)
+                                 for obj in batch)
+            if ledger_changed:
+                for key, amount in rows.ledger_deltas(-1).items():
+                    deltas[key] += amount
+                for obj in batch:
+                    for key, amount in obj.ledger_delta().items():
+                        deltas[key] += amount
+            # Plain QuerySet.update is used because balances are fixed below
+            result += models.QuerySet.update(rows, **{
+                field: case_of_values(
+                    Transaction, field,
+                    [(obj.pk, getattr(obj, Transaction._meta.get_field(field)
+                                      .attname)) for obj in batch]
+                )
+                for field in fields
+            })
+        Transaction.apply_deltas(deltas)
+        self.repair_balances(self.earliest_dates(
+            [key for key, amount in deltas.items() if amount] + positions))
+        if self.CATEGORY_FIELDS.intersection(fields):
+            ItemCategory.learn(objs)
+        VersionStamp.bump(Transaction.VERSION)
+        return result
+
+    @transaction.atomic
+    def delete(self):
+        deltas = self.ledger_deltas(-1)
+        result = super(TransactionQuerySet, self).delete()
+        Transaction.apply_deltas(deltas)
+        self.repair_balances(self.earliest_dates(deltas))
+        VersionStamp.bump(Transaction.VERSION)
+        return result
+
+    def update(self, **kwargs):
+        if kwargs.keys() == {'balance'}:
+            # running balances are shifted on every save, they're derived
+            # from other fields, so the ledger isn't changed by that
+            return super(TransactionQuerySet, self).update(**kwargs)
+        ledger = self.LEDGER_FIELDS.intersection(kwargs)
+        categorized = self.CATEGORY_FIELDS.intersection(kwargs)
+        if not ledger and not categorized:
+            result = super(TransactionQuerySet, self).update(**kwargs)
+            VersionStamp.bump(Transaction.VERSION)
+            return result
+
+        with transaction.atomic():
+            # Update can move rows out of this QuerySet (e.g. new account),
+            # so changed rows should be identified by primary keys
+            pks = list(self.values_list('pk', flat=True))
+            deltas = self.ledger_deltas(-1) if ledger else None
+            moved = self.POSITION_FIELDS.intersection(kwargs)
+            positions = self.positions() if moved else list()
+            result = super(TransactionQuerySet, self).update(**kwargs)
+            for batch in batches(pks):
+                chunk = Transaction.objects.filter(pk__in=batch)
+                if ledger:
+                    for key, amount in chunk.ledger_deltas().items():
+                        deltas[key] += amount
+                if moved:
+                    positions.extend(chunk.positions())
+                if categorized:
+                    ItemCategory.learn(chunk.only('account', 'comment',
+                                                  'unit'))
+            if ledger:
+                Transaction.apply_deltas(deltas)
+                self.repair_balances(self.earliest_dates(
+                    list(deltas) + positions))
+            VersionStamp.bump(Transaction.VERSION)
+        return result
 
 
 class Transaction(models.Model):
+    # Name of version stamp of all transactions and invoices, it's bumped by
+    # every write of them (see `accountant.misc.caching`)
+    VERSION = 'ledger'
+
     UNITS = (
         ('pcs', _('pieces')),
         ('kg', _('kilos')),
@@ -396,6 +1381,16 @@ class Transaction(models.Model):
         blank=True
     )
 
+    balance = models.DecimalField(
+        verbose_name=_('balance after transaction'),
+        max_digits=settings.MAX_DIGITS,
+        decimal_places=settings.DECIMAL_PLACES,
+        default=Decimal(0),
+        editable=False
+    )
+
+    objects = TransactionQuerySet.as_manager()
+
     @property
     def price(self):
         if self.quantity:
@@ -409,27 +1404,249 @@ class Transaction(models.Model):
                         date=self.date,
                         app='not ' if not self.approved else ''))
 
+    def ledger_delta(self, sign: int = 1):
+        """
+        method returns changes of balances caused by this transaction. Not
+         approved transactions don't change balances.
+        :param sign: 1 for added transaction, -1 for removed one
+        :return: dictionary with (account id, currency, date) tuples as keys
+         and amounts as values
+        """
+        deltas = defaultdict(Decimal)
+        if self.approved:
+            deltas[(self.account_id, str(self.currency), self.date)] = \
+                sign * Decimal(self.amount)
+        return deltas
+
+    @staticmethod
+    def apply_deltas(deltas: dict):
+        """
+        method applies changes of balances (see `Transaction.ledger_delta`)
+         to sheaves and daily balances. Changes in closed periods are
+         checked by `Checkpoint.apply`. Keys with zero change are applied as
+         well, daily balances of days left without approved transactions
+         are deleted by them.
+        """
+        Checkpoint.apply(deltas)
+        sheaves = defaultdict(Decimal)
+        for (account_id, currency, date), amount in deltas.items():
+            sheaves[(account_id, currency)] += amount
+            DailyBalance.add(account_id, currency, date, amount)
+        for (account_id, currency), amount in sheaves.items():
+            Sheaf.add(account_id, currency, amount)
+
+    def shift_balances(self, amount: Decimal):
+        """
+        method adds amount to running balances of all transactions of the
+         same account and currency placed after this one.
+        """
+        if amount:
+            Transaction.objects\
+                .filter(account_id=self.account_id, currency=self.currency)\
+                .after(self.date, self.pk)\
+                .update(balance=F('balance') + amount)
+
+    @property
+    def ledger_state(self):
+        """
+        Tuple with all fields of the transaction that affect balances
+        """
+        return (self.account_id, str(self.currency), self.date,
+                Decimal(self.amount), self.approved)
+
     @transaction.atomic
     def save(self, *args, **kwargs):
-        if not self.id:
-            sheaf = self.account.sheaves.filter(currency=self.currency).first()
-            if not sheaf:
-                Sheaf.objects.create(account=self.account,
-                                     currency=self.currency,
-                                     amount=self.amount).save()
-            else:
-                sheaf.amount += self.amount
-                sheaf.save()
+        # Only difference between stored and new state of the transaction is
+        # applied to balances, so cost of save doesn't depend on history
+        old = Transaction.objects.filter(pk=self.pk).first() \
+            if self.pk else None
+        if old is not None and old.ledger_state == self.ledger_state:
+            self.balance = old.balance
             super(Transaction, self).save(*args, **kwargs)
+            ItemCategory.learn([self])
+            VersionStamp.bump(self.VERSION)
+            return
+
+        if old is None:
+            deltas = defaultdict(Decimal)
         else:
-            old_account = Transaction.objects.get(pk=self.pk).account
-            super(Transaction, self).save(*args, **kwargs)
-            self.account.recalculate_summary(atomic=False)
-            if self.account != old_account:
-                old_account.recalculate_summary(atomic=False)
+            deltas = old.ledger_delta(-1)
+            if old.approved:
+                old.shift_balances(-Decimal(old.amount))
+        for key, amount in self.ledger_delta().items():
+            deltas[key] += amount
+
+        # New transaction gets the largest id, so all transactions
+        # with the same date are placed before it. Stored row of moved
+        # transaction still has its old balance, so it isn't a predecessor
+        previous = Transaction.objects\
+            .filter(account_id=self.account_id, currency=self.currency)\
+            .exclude(pk=self.pk)
+        if old is None:
+            previous = previous.filter(date__lte=self.date)\
+                .order_by('-date', '-pk')
+        else:
+            previous = previous.before(self.date, self.pk)
+        own_amount = Decimal(self.amount) if self.approved else Decimal(0)
+        self.balance = (previous.values_list('balance', flat=True).first() or
+                        Decimal(0)) + own_amount
+        super(Transaction, self).save(*args, **kwargs)
+        self.shift_balances(own_amount)
+        self.apply_deltas(deltas)
+        ItemCategory.learn([self])
+        VersionStamp.bump(self.VERSION)
+
+    @transaction.atomic
+    def delete(self, *args, **kwargs):
+        old = Transaction.objects.filter(pk=self.pk).first()
+        result = super(Transaction, self).delete(*args, **kwargs)
+        if old is not None:
+            self.apply_deltas(old.ledger_delta(-1))
+            if old.approved:
+                old.shift_balances(-Decimal(old.amount))
+        VersionStamp.bump(self.VERSION)
+        return result
 
     class Meta:
         ordering = ['-date']
+        # running balances are sought by the first index, pages of all
+        # transactions are ordered and sought by the second one
+        index_together = [('account', 'currency', 'date', 'id'),
+                          ('date', 'id')]
+
+
+class ItemCategory(models.Model):
+    """
+    Expense account and unit of measurement last used for goods with some
+    name. Receipts are categorized with this index (see
+    `accountant.misc.categorizer`), it's updated by every save of expense
+    transactions with comments.
+    """
+    # Name of version stamp of categories, it's bumped by every change
+    VERSION = 'categories'
+    # Name of version stamp bumped by deletes of categories, caches can't
+    # find deleted rows, so they're loaded again after it
+    GENERATION = 'categories-generation'
+
+    name = models.CharField(
+        verbose_name=_('normalized name of goods'),
+        max_length=255,
+        unique=True
+    )
+    account = models.ForeignKey(
+        verbose_name=_('account'),
+        to=Account,
+        related_name='item_categories'
+    )
+    unit = models.CharField(
+        verbose_name=_('unit of measurement'),
+        max_length=255,
+        choices=Transaction.UNITS,
+        null=True,
+        blank=True,
+        default=None
+    )
+    updated = models.DateTimeField(
+        verbose_name=_('updated'),
+        auto_now=True,
+        db_index=True
+    )
+
+    @staticmethod
+    def normalize(name: str):
+        """
+        method returns name of goods in lower case with single spaces
+        """
+        return ' '.join((name or '').lower().split())[:255]
+
+    @classmethod
+    def lookup(cls, names):
+        """
+        method finds categories of many goods with one query per batch.
+        :param names: iterable with names of goods, not normalized
+        :return: dictionary with normalized names as keys and (account id,
+         unit) tuples as values, unknown names are omitted
+        """
+        names = list({cls.normalize(name) for name in names} - {''})
+        result = dict()
+        for batch in batches(names):
+            result.update(
+                (name, (account_id, unit)) for name, account_id, unit in
+                cls.objects.filter(name__in=batch)
+                .values_list('name', 'account_id', 'unit')
+            )
+        return result
+
+    @classmethod
+    def learn(cls, transactions):
+        """
+        method stores categories of expense transactions with comments, the
+         last transaction wins if several ones have the same name.
+        :param transactions: iterable with saved Transaction objects
+        """
+        transactions = [i for i in transactions if cls.normalize(i.comment)]
+        if not transactions:
+            return
+        expenses = set(
+            Account.objects
+            .filter(pk__in={i.account_id for i in transactions},
+                    type=Account.EXPENSE)
+            .values_list('pk', flat=True)
+        )
+        categories = {cls.normalize(item.comment): (item.account_id, item.unit)
+                      for item in transactions
+                      if item.account_id in expenses}
+        if categories:
+            with transaction.atomic():
+                cls._store(categories)
+
+    @classmethod
+    def _store(cls, categories: dict):
+        stored = cls.lookup(categories)
+        changed = {name: category for name, category in categories.items()
+                   if name in stored and stored[name] != category}
+        for batch in batches(list(changed)):
+            cls.objects.filter(name__in=batch).update(updated=timezone.now(), **{
+                field: Case(
+                    *[When(name=name, then=Value(changed[name][index]))
+                      for name in batch],
+                    output_field=cls._meta.get_field(field)
+                )
+                for field, index in (('account', 0), ('unit', 1))
+            })
+
+        new = [cls(name=name, account_id=account_id, unit=unit)
+               for name, (account_id, unit) in categories.items()
+               if name not in stored]
+        if changed or new:
+            VersionStamp.bump(cls.VERSION)
+        if not new:
+            return
+        try:
+            with transaction.atomic():
+                cls.objects.bulk_create(new)
+        except IntegrityError:
+            # the same goods were categorized by another process meanwhile
+            for item in new:
+                cls.objects.update_or_create(
+                    name=item.name,
+                    defaults={'account_id': item.account_id,
+                              'unit': item.unit})
+
+    def save(self, *args, **kwargs):
+        super(ItemCategory, self).save(*args, **kwargs)
+        VersionStamp.bump(self.VERSION)
+
+    def __str__(self):
+        return '{} → {}'.format(self.name, self.account)
+
+
+@receiver(post_delete, sender=ItemCategory)
+def item_category_deleted(sender, **kwargs):
+    # Categories are deleted one by one, by QuerySet or by cascade from
+    # their accounts, this signal is sent by all of them
+    VersionStamp.bump(ItemCategory.VERSION)
+    VersionStamp.bump(ItemCategory.GENERATION)
 
 
 class Document(models.Model):
@@ -465,4 +1682,98 @@ class Document(models.Model):
             'description': self.description,
             'invoice': self.invoice.id if self.invoice else None,
             'file': self.file.url
-        }
\ No newline at end of file
+        }
+
+
+class ImportJob(models.Model):
+    """
+    Bulk import of receipts from an archive (see
+    `accountant.misc.receipt_import`). Progress and errors of separate
+    receipts are saved after every batch, so the job can be polled while
+    it's running. Time of the last progress is saved too, so jobs of
+    stopped processes are found (see `receipt_import.fail_stale`).
+    """
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUSES = (
+        (PENDING, _('pending')),
+        (RUNNING, _('running')),
+        (DONE, _('done')),
+        (FAILED, _('failed')),
+    )
+
+    user = models.ForeignKey(
+        verbose_name=_('user'),
+        to=User,
+        related_name='import_jobs'
+    )
+    document = models.ForeignKey(
+        verbose_name=_('archive'),
+        to=Document,
+        related_name='import_jobs'
+    )
+    status = models.CharField(
+        verbose_name=_('status'),
+        max_length=16,
+        choices=STATUSES,
+        default=PENDING
+    )
+    processed = models.PositiveIntegerField(
+        verbose_name=_('processed receipts'),
+        default=0
+    )
+    imported = models.PositiveIntegerField(
+        verbose_name=_('imported receipts'),
+        default=0
+    )
+    errors = models.TextField(
+        verbose_name=_('errors of receipts in JSON'),
+        default='[]',
+        editable=False
+    )
+    created = models.DateTimeField(
+        verbose_name=_('created'),
+        auto_now_add=True
+    )
+    updated = models.DateTimeField(
+        verbose_name=_('updated'),
+        null=True,
+        blank=True,
+        default=None
+    )
+    finished = models.DateTimeField(
+        verbose_name=_('finished'),
+        null=True,
+        blank=True,
+        default=None
+    )
+
+    @property
+    def error_list(self):
+        """
+        List of dictionaries with receipt (name of file in archive or number
+         of line) and message
+        """
+        return json.loads(self.errors)
+
+    def json(self):
+        return {
+            'id': self.id,
+            'status': self.status,
+            'processed': self.processed,
+            'imported': self.imported,
+            'failed': self.processed - self.imported,
+            'errors': self.error_list,
+            'created': self.created.isoformat(),
+            'finished': self.finished.isoformat() if self.finished else None,
+            'document': self.document_id,
+        }
+
+    def __str__(self):
+        return '{} import of {} by {}'.format(self.status, self.document_id,
+                                              self.user)
+
+    class Meta:
+        ordering = ['-created']
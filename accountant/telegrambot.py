@@ -1,7 +1,6 @@
 import logging
 from io import BytesIO
 
-from django.conf import settings
 from django.contrib.auth.models import User
 from django.core.files.uploadedfile import *
 from django_telegrambot.apps import DjangoTelegramBot
@@ -9,8 +8,8 @@ from moneyed import Money
 from telegram import Update, Bot
 from telegram.ext import CommandHandler, MessageHandler, Filters
 
-from accountant.misc.fns_parser import is_valid_invoice, parse
-from accountant.models import Account, Document
+from accountant.misc.fns_parser import ingest
+from accountant.models import Invoice, ClosedPeriodError
 
 logger = logging.getLogger(__name__)
 
@@ -34,26 +33,15 @@ def start(bot, update):
         )
 
 
-def json_handler(bot: Bot, user: User, document: Document, update: Update):
-        default_expense = getattr(settings, 'DEFAULT_EXPENSE', 10)
-        default_account = getattr(settings, 'DEFAULT_ACCOUNT', 2)
-
-        result = parse(
-            document.file.read().decode(),
-            user,
-            Account.objects.get(pk=default_expense),
-            Account.objects.get(pk=default_account)
-        )
-        document.invoice = result
-        document.save()
-        bot.send_message(
-            update.message.chat_id,
-            "Invoice parsed successfully. {} items, total sum {}"
-            .format(
-                result.transactions.count() - 1,
-                Money(-result.pnl[0]['amount'], result.pnl[0]['currency'])
-            )
+def receipt_handler(bot: Bot, invoice: Invoice, update: Update):
+    bot.send_message(
+        update.message.chat_id,
+        "Invoice parsed successfully. {} items, total sum {}"
+        .format(
+            invoice.transactions.count() - 1,
+            Money(-invoice.pnl[0]['amount'], invoice.pnl[0]['currency'])
         )
+    )
 
 
 def document_handler(bot: Bot, update: Update):
@@ -83,16 +71,27 @@ def document_handler(bot: Bot, update: Update):
             remote_file.download(out=local_file)
             logger.info('File {} downloaded via Telegram API'.format(local_file))
 
-            document = Document.objects.create(
-                file=local_file,
-                invoice=None,
-                description=''
-            )
-
-            local_file.seek(0)
-            if is_valid_invoice(local_file.read().decode()):
-                json_handler(bot, user, document, update)
-            else:
+            # the file is stored and decoded once, receipts found in it
+            # become invoices
+            try:
+                document, invoices, duplicates = ingest(local_file, user)
+            except ClosedPeriodError as e:
+                logger.error('Import of {} failed: {}'.format(local_file, e))
+                bot.send_message(
+                    update.message.chat_id,
+                    'Receipts are not imported: {}'
+                    .format('; '.join(e.messages))
+                )
+                return
+            for invoice in invoices:
+                receipt_handler(bot, invoice, update)
+            for pk in duplicates:
+                bot.send_message(
+                    update.message.chat_id,
+                    'Receipt has been imported already as invoice {}'
+                    .format(pk)
+                )
+            if document is not None and not invoices:
                 bot.send_message(
                     update.message.chat_id,
                     'Attached document has been saved as {} ({})'
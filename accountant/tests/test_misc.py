@@ -1,16 +1,43 @@
+import csv
 import json
-from datetime import date, datetime
+import os
+import re
+import zipfile
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from itertools import count
 from decimal import Decimal
+from io import StringIO, BytesIO
 from os.path import abspath, dirname, join
-from unittest import TestCase
+from tempfile import NamedTemporaryFile, TemporaryDirectory
+from unittest import TestCase, skipUnless
 from testfixtures import LogCapture
 
 from pytz import timezone
+from django.conf import settings
 from django.contrib.auth.models import User
-from moneyed import RUB
+from django.core.management import call_command
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.paginator import InvalidPage
+from django.db.models import Sum
+from django.db import connection, IntegrityError
+from django.test import TestCase as DjangoTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils.timezone import now
+from moneyed import RUB, EUR, USD
 
-from accountant.misc.fns_parser import parse, is_valid_invoice
-from accountant.models import Account, Transaction
+from accountant.misc import ledger, series, rates, search, export, \
+    receipt_import
+from accountant.misc.categorizer import Categorizer, get_categorizer, \
+    clear_cache
+from accountant.misc.paginator import CursorPaginator
+from accountant.misc.registry import get_registry
+from accountant.misc.fns_parser import parse, is_valid_invoice, \
+    iter_receipts, ingest
+from accountant.models import Account, Transaction, Sheaf, DailyBalance, \
+    ExchangeRate, PeriodClose, Invoice, ItemCategory, ImportJob, VersionStamp, \
+    Document
+from frekenbok.tests.test_data import add_test_data
 
 
 class FnsInvoiceParserTestCase(TestCase):
@@ -32,6 +59,8 @@ class FnsInvoiceParserTestCase(TestCase):
         cls.wrong_beer = Account(title='Wrong beer', type=Account.ACCOUNT)
         Account.add_root(instance=cls.wrong_beer)
 
+        cls.document_numbers = count(1)
+
         cls.beer_comment = 'ПИВО ТРИ МЕДВЕДЯ СВЕТЛОЕ АЛК.4'
         cls.wrong_beer_comment = 'ПИВО ЧЕРНИГОВСКОЕ СВЕТЛОЕ АЛК.'
         # This transaction should be used to guess account and unit for transaction
@@ -65,12 +94,19 @@ class FnsInvoiceParserTestCase(TestCase):
         self.invoice.delete()
         del self.invoice
 
+    def adjusted(self):
+        # adjusted receipts get their own fiscal document numbers, so they
+        # aren't duplicates of the original one
+        receipt = json.loads(self.incoming)
+        receipt['fiscalDocumentNumber'] = next(self.document_numbers)
+        return receipt
+
     def test_total_sum(self):
         actual_sum = sum(i.amount for i in self.invoice.transactions.all())
         self.assertEqual(actual_sum, Decimal('0.00000'))
 
     def test_bad_total_sum(self):
-        adjusted_incoming = json.loads(self.incoming)
+        adjusted_incoming = self.adjusted()
         adjusted_incoming['items'].pop()
 
         with LogCapture() as l:
@@ -137,15 +173,30 @@ class FnsInvoiceParserTestCase(TestCase):
 
     def test_account_guessing(self):
         self.assertEqual(
-            len(self.invoice.transactions.filter(account=self.beer).all()),
-            1
+            self.invoice.transactions.get(comment=self.beer_comment).account,
+            self.beer
+        )
+        self.assertFalse(
+            self.invoice.transactions.filter(account=self.wrong_beer).exists()
         )
 
     def test_unit_guessing(self):
         self.assertEqual(
-            len(self.invoice.transactions.filter(unit='l').all()),
-            1
+            self.invoice.transactions.get(comment=self.beer_comment).unit,
+            'l'
+        )
+
+    def test_fuzzy_guessing(self):
+        adjusted_incoming = self.adjusted()
+        adjusted_incoming['items'][0]['name'] = 'Пиво Три медведя светлое'
+        result = parse(json.dumps(adjusted_incoming),
+                       self.user, self.expense, self.account)
+        self.assertEqual(
+            result.transactions.get(comment='Пиво Три медведя светлое')
+                .account,
+            self.beer
         )
+        result.delete()
 
     def test_invoice_timestamp(self):
         self.assertEqual(
@@ -160,3 +211,1076 @@ class FnsInvoiceParserTestCase(TestCase):
 
     def test_is_valid_invoice(self):
         self.assertTrue(is_valid_invoice(self.incoming))
+
+    def test_ingest(self):
+        with TemporaryDirectory() as media, \
+                override_settings(MEDIA_ROOT=media):
+            receipt = self.adjusted()
+            document, invoices, duplicates = ingest(
+                SimpleUploadedFile('receipt.json', json.dumps(receipt).encode()),
+                self.user, self.expense, self.account
+            )
+            self.assertEqual(len(invoices), 1)
+            self.assertEqual(duplicates, list())
+            self.assertEqual(document.invoice, invoices[0])
+            self.assertEqual(invoices[0].transactions.count(), 9)
+            invoices[0].delete()
+
+            other = self.adjusted()
+            document, invoices, duplicates = ingest(
+                SimpleUploadedFile('receipts.json', json.dumps(
+                    [receipt, {'bad': 'receipt'}, other, receipt]).encode()),
+                self.user, self.expense, self.account
+            )
+            self.assertEqual(len(invoices), 2)
+            self.assertEqual(duplicates, [invoices[0].pk])
+            self.assertIsNone(document.invoice)
+            for invoice in invoices:
+                invoice.delete()
+
+            broken = dict(self.adjusted(), dateTime='yesterday')
+            first, last = self.adjusted(), self.adjusted()
+            document, invoices, duplicates = ingest(
+                SimpleUploadedFile('receipts.json', json.dumps(
+                    [first, broken, last]).encode()),
+                self.user, self.expense, self.account
+            )
+            self.assertEqual([i.fiscal_document_number for i in invoices],
+                             [first['fiscalDocumentNumber'],
+                              last['fiscalDocumentNumber']])
+            self.assertFalse(Invoice.objects.filter(
+                fiscal_document_number=broken['fiscalDocumentNumber'])
+                .exists())
+            for invoice in invoices:
+                invoice.delete()
+
+            document, invoices = ingest(
+                SimpleUploadedFile('photo.jpg', b'\xff\xd8\xff\xe0'),
+                self.user, self.expense, self.account
+            )[:2]
+            self.assertEqual(invoices, list())
+            self.assertTrue(document.pk)
+
+    def test_duplicate_receipt(self):
+        self.assertEqual(self.invoice.fiscal_id,
+                         ('8710000101057618', 35054, 2223338679))
+        with TemporaryDirectory() as media, \
+                override_settings(MEDIA_ROOT=media), \
+                CaptureQueriesContext(connection) as context:
+            document, invoices, duplicates = ingest(
+                SimpleUploadedFile('receipt.json', self.incoming.encode()),
+                self.user, self.expense, self.account
+            )
+        self.assertIsNone(document)
+        self.assertEqual(invoices, list())
+        self.assertEqual(duplicates, [self.invoice.pk])
+        # the only query besides transaction control is probe of index
+        queries = [i['sql'] for i in context.captured_queries
+                   if i['sql'].startswith(('SELECT', 'INSERT', 'UPDATE'))]
+        self.assertEqual(len(queries), 1)
+        self.assertIn('"fiscal_sign" =', queries[0])
+
+        with self.assertRaises(IntegrityError):
+            parse(self.incoming, self.user, self.expense, self.account)
+
+    def test_normalized_guessing(self):
+        adjusted_incoming = self.adjusted()
+        for item in adjusted_incoming['items']:
+            item['name'] = ' {} '.format(item['name'].lower())
+        result = parse(json.dumps(adjusted_incoming),
+                       self.user, self.expense, self.account)
+        beer = result.transactions.get(
+            comment=' {} '.format(self.beer_comment.lower()))
+        self.assertEqual((beer.account, beer.unit), (self.beer, 'l'))
+        result.delete()
+
+    def test_learning(self):
+        milk = 'Молоко Домик в деревне 3.2%'
+        self.assertEqual(ItemCategory.lookup([milk]), dict())
+        transaction = Transaction.objects.create(
+            date=date.today(), account=self.expense, amount=89,
+            currency=RUB, comment=milk
+        )
+        self.assertEqual(ItemCategory.lookup([milk]),
+                         {'молоко домик в деревне 3.2%': (self.expense.pk,
+                                                          None)})
+
+        transaction.account = self.beer
+        transaction.unit = 'l'
+        transaction.save()
+        self.assertEqual(list(ItemCategory.lookup([milk]).values()),
+                         [(self.beer.pk, 'l')])
+
+        Transaction.objects.filter(pk=transaction.pk)\
+            .update(account=self.expense)
+        self.assertEqual(list(ItemCategory.lookup([milk]).values()),
+                         [(self.expense.pk, 'l')])
+        transaction.delete()
+
+    def test_batched_lookup(self):
+        def receipt(size: int):
+            adjusted_incoming = self.adjusted()
+            adjusted_incoming['items'] = [
+                dict(adjusted_incoming['items'][0], name='Товар {} {}'
+                     .format(size, i)) for i in range(size)
+            ]
+            adjusted_incoming['totalSum'] = \
+                size * adjusted_incoming['items'][0]['sum']
+            return json.dumps(adjusted_incoming)
+
+        def queries(size: int):
+            # categories learned from the previous receipt are loaded here
+            get_categorizer()
+            with CaptureQueriesContext(connection) as context:
+                result = parse(receipt(size), self.user, self.expense,
+                               self.account)
+            self.assertEqual(result.transactions.count(), size + 1)
+            result.delete()
+            return [i['sql'] for i in context.captured_queries]
+
+        small, large = queries(5), queries(60)
+        self.assertEqual(len(small), len(large))
+        self.assertFalse([i for i in large if 'accountant_transaction' in i
+                          and '"comment" =' in i])
+
+
+class ReceiptDecodingTestCase(TestCase):
+    receipt = {'totalSum': 61889, 'items': [{'name': 'Хлеб', 'sum': 4.5}]}
+
+    @staticmethod
+    def chunks(content: str, size: int = 7):
+        data = content.encode()
+        return (data[i:i + size] for i in range(0, len(data), size))
+
+    def test_single_receipt(self):
+        receipts = list(iter_receipts(self.chunks(json.dumps(self.receipt))))
+        self.assertEqual(receipts, [self.receipt])
+        self.assertIsInstance(receipts[0]['totalSum'], Decimal)
+        self.assertIsInstance(receipts[0]['items'][0]['sum'], Decimal)
+
+    def test_array_of_receipts(self):
+        content = '\ufeff [ {} ,\n{}, {} ]\n'.format(
+            *[json.dumps(self.receipt, ensure_ascii=False)] * 3)
+        for size in (1, 7, 2 ** 16):
+            self.assertEqual(list(iter_receipts(self.chunks(content, size))),
+                             [self.receipt] * 3)
+        self.assertEqual(list(iter_receipts(self.chunks('[]'))), list())
+
+    def test_bounded_memory(self):
+        receipts = iter_receipts(self.chunks('[{}]'.format(
+            json.dumps({'items': ['x' * 100] * 100}))), max_size=1000)
+        with self.assertRaises(ValueError):
+            next(receipts)
+
+    def test_broken_files(self):
+        for content in ('', '{"items": [', '[{}, {}', '{} {}', 'totalSum',
+                        '[,{}]', '[{},]', '[{}{}]', '[{},,{}]', '{},'):
+            with self.assertRaises(ValueError):
+                list(iter_receipts(self.chunks(content)))
+        with self.assertRaises(ValueError):
+            list(iter_receipts([b'\xff\xd8\xff\xe0']))
+
+
+class CategorizerTestCase(TestCase):
+    def setUp(self):
+        self.categorizer = Categorizer()
+        for name, account_id, unit in (
+                ('Молоко Домик в деревне 3.2% 1л', 1, 'l'),
+                ('Кефир Домик в деревне 1%', 1, 'l'),
+                ('Хлеб Бородинский нарезка', 2, 'pcs'),
+                ('Батон нарезной', 2, 'pcs'),
+                ('Пакет-майка Дикси', 3, None)):
+            self.categorizer.add(name, account_id, unit)
+
+    def test_exact(self):
+        guess = self.categorizer.categorize('  батон   НАРЕЗНОЙ ')
+        self.assertEqual((guess.account_id, guess.unit, guess.confidence),
+                         (2, 'pcs', 1.0))
+
+    def test_fuzzy(self):
+        guess = self.categorizer.categorize('МОЛОКО ДОМИК В ДЕРЕВНЕ 3,2% 1Л')
+        self.assertEqual((guess.account_id, guess.unit), (1, 'l'))
+        self.assertEqual(guess.confidence, 1.0)
+
+        guess = self.categorizer.categorize('Хлеб бородинск.')
+        self.assertEqual(guess.account_id, 2)
+        self.assertLess(guess.confidence, 1.0)
+        self.assertGreater(guess.confidence, 0.5)
+
+        self.assertIsNone(self.categorizer.categorize('Zyx'))
+        self.assertIsNone(self.categorizer.categorize('%%'))
+
+    def test_rare_features_weigh_more(self):
+        # "домик в деревне" is shared by milk and kefir, "молоко" isn't
+        guess = self.categorizer.categorize('Молоко Простоквашино')
+        self.assertEqual(guess.name, 'молоко домик в деревне 3.2% 1л')
+        self.assertLess(self.categorizer.idf['#домик'],
+                        self.categorizer.idf['#молоко'])
+
+    def test_skip(self):
+        guess = self.categorizer.categorize('Батон нарезной', skip={2})
+        self.assertNotEqual(guess and guess.account_id, 2)
+
+    def test_incremental_update(self):
+        self.assertNotEqual(self.categorizer.categorize('Сыр Российский')
+                            and 1, 4)
+        self.categorizer.add('Сыр Российский 45%', 4, 'kg')
+        self.assertEqual(len(self.categorizer), 6)
+        self.assertEqual(self.categorizer.categorize('сыр российский')
+                         .account_id, 4)
+
+        # recategorized name replaces old category
+        self.categorizer.add('Сыр Российский 45%', 1, 'kg')
+        self.assertEqual(len(self.categorizer), 6)
+        self.assertEqual(self.categorizer.categorize('сыр российский')
+                         .account_id, 1)
+
+        # norms are the same after full reweighting
+        norms = dict(self.categorizer.norms)
+        self.categorizer.reweight()
+        for name, norm in norms.items():
+            self.assertAlmostEqual(self.categorizer.norms[name], norm,
+                                   delta=norm * 0.2)
+
+
+class CategorizerSyncTestCase(DjangoTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        add_test_data(cls)
+        cls.food = Account(title='Еда', type=Account.EXPENSE)
+        Account.add_root(instance=cls.food)
+
+    def test_incremental_load(self):
+        categorizer = get_categorizer()
+        size = len(categorizer)
+        with CaptureQueriesContext(connection) as context:
+            self.assertIs(get_categorizer(), categorizer)
+        self.assertEqual(len(context.captured_queries), 1)
+
+        Transaction.objects.create(date=date.today(), account=self.food,
+                                   amount=60, comment='Сметана 20% 300г')
+        self.assertIs(get_categorizer(), categorizer)
+        self.assertEqual(len(categorizer), size + 1)
+        self.assertEqual(categorizer.categorize('СМЕТАНА 20 %').account_id,
+                         self.food.pk)
+
+    def test_deleted_categories(self):
+        clear_cache()
+        Transaction.objects.create(date=date.today(), account=self.food,
+                                   amount=60, comment='Сметана 20% 300г')
+        self.assertEqual(get_categorizer().categorize('сметана 20% 300г')
+                         .account_id, self.food.pk)
+
+        # rows deleted by QuerySet aren't seen by incremental sync
+        ItemCategory.objects.filter(account=self.food).delete()
+        self.assertIsNone(get_categorizer().categorize('сметана 20% 300г'))
+
+        Transaction.objects.create(date=date.today(), account=self.food,
+                                   amount=60, comment='Сметана 20% 300г')
+        self.assertIsNotNone(get_categorizer().categorize('сметана 20% 300г'))
+        # categories are deleted by cascade from their account
+        Account.objects.get(pk=self.food.pk).delete()
+        self.assertIsNone(get_categorizer().categorize('сметана 20% 300г'))
+
+    def test_command(self):
+        for comment in ('Сметана 20% 300г', 'СМЕТАНА 20%', 'Сметана 15%'):
+            Transaction.objects.create(date=date.today(), account=self.food,
+                                       amount=60, comment=comment)
+        out = StringIO()
+        call_command('benchmark_categorizer', threshold=0.3, stdout=out)
+        self.assertIn('items\t', out.getvalue())
+        self.assertIn('fuzzy matching accuracy', out.getvalue())
+
+
+class ReceiptImportTestCase(DjangoTestCase):
+    invoice_path = join(dirname(abspath(__file__)), 'test_fns_invoice.json')
+
+    @classmethod
+    def setUpTestData(cls):
+        add_test_data(cls)
+        with open(cls.invoice_path, encoding='utf-8') as f:
+            cls.receipt = json.load(f)
+
+    def setUp(self):
+        self.media = TemporaryDirectory()
+        self.settings = override_settings(
+            MEDIA_ROOT=self.media.name,
+            DEFAULT_EXPENSE=self.expenses[0].pk,
+            DEFAULT_ACCOUNT=self.card.pk
+        )
+        self.settings.enable()
+
+    def tearDown(self):
+        self.settings.disable()
+        self.media.cleanup()
+
+    def __receipt(self, number: int, **kwargs):
+        return json.dumps(dict(self.receipt, fiscalDocumentNumber=number,
+                               **kwargs))
+
+    def __import(self, name: str, content: bytes, workers: int):
+        job = receipt_import.create(SimpleUploadedFile(name, content),
+                                    self.test_user)
+        return receipt_import.run(job, workers)
+
+    def test_ndjson(self):
+        for workers in (1, 2):
+            lines = [self.__receipt(workers * 10), '', '{"broken": ',
+                     json.dumps({'not': 'receipt'}),
+                     self.__receipt(workers * 10 + 1),
+                     self.__receipt(workers * 10)]
+            invoices = Invoice.objects.count()
+            job = self.__import('receipts.ndjson',
+                                '\n'.join(lines).encode(), workers)
+            self.assertEqual(job.status, ImportJob.DONE)
+            self.assertEqual((job.processed, job.imported), (5, 2))
+            self.assertEqual([error['receipt'] for error in job.error_list],
+                             ['line 3', 'line 4', 'line 6'])
+            self.assertEqual(job.error_list[2]['message'],
+                             'duplicate of line 1')
+            self.assertIsNotNone(job.finished)
+            self.assertEqual(Invoice.objects.count(), invoices + 2)
+            self.assertEqual(
+                Invoice.objects.order_by('-pk').first().transactions.count(),
+                len(self.receipt['items']) + 1
+            )
+
+    def test_zip(self):
+        archive = BytesIO()
+        with zipfile.ZipFile(archive, 'w') as f:
+            f.writestr('first.json', self.__receipt(1))
+            f.writestr('photo.jpg', b'\xff\xd8\xff\xe0')
+            f.writestr('both.json', '[{}, {}]'.format(self.__receipt(2),
+                                                      self.__receipt(3)))
+        job = self.__import('receipts.zip', archive.getvalue(), 2)
+        self.assertEqual(job.status, ImportJob.DONE)
+        self.assertEqual((job.processed, job.imported), (4, 3))
+        self.assertEqual(job.error_list[0]['receipt'], 'photo.jpg')
+
+    def test_json_array(self):
+        content = json.dumps([self.receipt, {'bad': 'receipt'}]).encode()
+        job = self.__import('receipts.json', content, 1)
+        self.assertEqual((job.processed, job.imported), (2, 1))
+        self.assertEqual(job.error_list,
+                         [{'receipt': 'receipt 2', 'message': 'not a receipt'}])
+
+    def test_bad_receipt_doesnt_abort_batch(self):
+        PeriodClose.close(date(2016, 1, 1))
+        late = self.__receipt(2, dateTime=self.receipt['dateTime'] -
+                              3 * 365 * 24 * 60 * 60)
+        lines = [self.__receipt(1), late, self.__receipt(3)]
+        invoices = Invoice.objects.count()
+        job = self.__import('receipts.ndjson', '\n'.join(lines).encode(), 1)
+        self.assertEqual(job.status, ImportJob.DONE)
+        self.assertEqual((job.processed, job.imported), (3, 2))
+        self.assertEqual(job.error_list[0]['receipt'], 'line 2')
+        self.assertEqual(Invoice.objects.count(), invoices + 2)
+
+    def test_receipts_imported_before(self):
+        first = self.__import('receipt.json', self.__receipt(1).encode(), 1)
+        self.assertEqual(first.imported, 1)
+        invoice = Invoice.objects.receipts().popitem()[1]
+
+        lines = [self.__receipt(1), self.__receipt(2)]
+        job = self.__import('receipts.ndjson', '\n'.join(lines).encode(), 2)
+        self.assertEqual((job.processed, job.imported), (2, 1))
+        self.assertEqual(job.error_list, [{
+            'receipt': 'line 1',
+            'message': 'imported already as invoice {}'.format(invoice)
+        }])
+
+    def test_backfill(self):
+        single = ingest(SimpleUploadedFile('receipt.json',
+                                           self.__receipt(1).encode()),
+                        self.test_user)[0]
+        ingest(SimpleUploadedFile('receipts.json', '[{}, {}]'.format(
+            self.__receipt(2), self.__receipt(3, dateTime=1508096340)
+        ).encode()), self.test_user)
+        ingest(SimpleUploadedFile('photo.jpg', b'\xff\xd8\xff\xe0'),
+               self.test_user)
+        Invoice.objects.update(**dict.fromkeys(Invoice.FISCAL_FIELDS))
+
+        out = StringIO()
+        call_command('backfill_fiscal_ids', dry_run=True, stdout=out)
+        self.assertIn('3 invoices found', out.getvalue())
+        self.assertEqual(Invoice.objects.receipts(), dict())
+
+        call_command('backfill_fiscal_ids', stdout=out)
+        self.assertIn('3 invoices filled, 0 duplicates', out.getvalue())
+        receipts = Invoice.objects.receipts()
+        self.assertEqual(sorted(key[1] for key in receipts), [1, 2, 3])
+        self.assertEqual(receipts[('8710000101057618', 1, 2223338679)],
+                         single.invoice_id)
+
+    def test_workers_are_threads(self):
+        with receipt_import._pool(2, None) as map_units:
+            self.assertEqual(set(map_units(lambda _: os.getpid(), range(4))),
+                             {os.getpid()})
+
+    def test_stale_jobs_fail(self):
+        document = Document.objects.create(file=None, description='')
+        stale, fresh, pending = [
+            ImportJob.objects.create(user=self.test_user, document=document,
+                                     status=status)
+            for status in (ImportJob.RUNNING, ImportJob.RUNNING,
+                           ImportJob.PENDING)
+        ]
+        day_ago = now() - timedelta(days=1)
+        ImportJob.objects.filter(pk=stale.pk).update(updated=day_ago)
+        ImportJob.objects.filter(pk=fresh.pk).update(updated=now())
+        ImportJob.objects.filter(pk=pending.pk).update(created=day_ago)
+
+        job = self.__import('receipt.json', self.__receipt(1).encode(), 1)
+        self.assertEqual(job.status, ImportJob.DONE)
+        for item, status in ((stale, ImportJob.FAILED),
+                             (fresh, ImportJob.RUNNING),
+                             (pending, ImportJob.FAILED)):
+            item.refresh_from_db()
+            self.assertEqual(item.status, status)
+        self.assertIsNotNone(stale.finished)
+
+    def test_command(self):
+        with NamedTemporaryFile(suffix='.ndjson') as f:
+            f.write(json.dumps(self.receipt).encode())
+            f.flush()
+            out = StringIO()
+            call_command('import_receipts', f.name, '--user',
+                         self.test_user.username, workers=1, stdout=out)
+        self.assertIn('1 of 1 receipts imported', out.getvalue())
+
+
+class LedgerRebuildTestCase(DjangoTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        add_test_data(cls)
+
+    def test_rebuild_fixes_sheaves(self):
+        ledger.rebuild()
+
+        expected_sheaves, _ = ledger.calculate()
+        actual_sheaves = {(i.account_id, i.currency): i.amount
+                          for i in Sheaf.objects.all()}
+        self.assertEqual(expected_sheaves, actual_sheaves)
+
+    def test_rebuild_fixes_daily_balances(self):
+        DailyBalance.objects.filter(account=self.reserve).delete()
+        ledger.rebuild()
+
+        _, expected_daily_balances = ledger.calculate()
+        actual_daily_balances = {(i.account_id, i.currency, i.date): i.amount
+                                 for i in DailyBalance.objects.all()}
+        self.assertEqual(expected_daily_balances, actual_daily_balances)
+
+    def test_rebuild_reports_diffs(self):
+        eur_sheaf = self.wallet.sheaves.get(currency=EUR)
+        diffs = ledger.rebuild()
+
+        self.assertIn(
+            ledger.Diff(self.wallet.pk, 'EUR', eur_sheaf.amount, Decimal(0)),
+            diffs
+        )
+        self.assertEqual(ledger.rebuild(), [])
+
+    def test_dry_run(self):
+        diffs = ledger.rebuild(dry_run=True)
+
+        self.assertTrue(diffs)
+        self.assertEqual(ledger.rebuild(dry_run=True), diffs)
+
+    def test_rebuild_of_some_accounts(self):
+        diffs = ledger.rebuild(Account.objects.filter(pk=self.reserve.pk))
+
+        self.assertEqual(diffs, [])
+        self.assertTrue(self.wallet.sheaves.filter(currency=EUR).exists())
+
+    def test_command(self):
+        out = StringIO()
+        call_command('rebuild_ledger', stdout=out)
+
+        self.assertIn('{}\tEUR'.format(self.wallet.pk), out.getvalue())
+        self.assertFalse(self.wallet.sheaves.filter(currency=EUR).exists())
+
+    def test_repair_running_balances_command(self):
+        Transaction.objects.update(balance=Decimal(0))
+        out = StringIO()
+        call_command('repair_running_balances', stdout=out)
+
+        self.assertNotIn('\n0 transactions fixed', '\n' + out.getvalue())
+        self.assertEqual(Transaction.objects.repair_balances(), 0)
+
+
+class LedgerVerificationTestCase(DjangoTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        add_test_data(cls)
+
+    def test_verify_finds_wrong_sheaves(self):
+        report = ledger.verify(workers=1)
+
+        self.assertIn(('sheaf', (self.wallet.pk, 'EUR')),
+                      [(i.kind, i.key) for i in report.mismatches])
+
+    def test_verify_does_not_change_anything(self):
+        ledger.verify(workers=1)
+
+        self.assertTrue(self.wallet.sheaves.filter(currency=EUR).exists())
+
+    def test_repair(self):
+        version = VersionStamp.get(Transaction.VERSION)
+        report = ledger.verify(workers=1, repair=True)
+
+        self.assertTrue(report.mismatches)
+        self.assertNotEqual(VersionStamp.get(Transaction.VERSION), version)
+        self.assertEqual(ledger.verify(workers=1).mismatches, [])
+        self.assertFalse(self.wallet.sheaves.filter(currency=EUR).exists())
+
+    def test_edits_keep_ledger_consistent(self):
+        ledger.verify(workers=1, repair=True)
+        transaction = Transaction.objects.create(
+            date=date(2020, 1, 1), account=self.cash, amount=100,
+            currency=RUB
+        )
+        transaction.date = date(2020, 1, 2)
+        transaction.save()
+        self.assertEqual(ledger.verify(workers=1).mismatches, [])
+
+        transaction.amount = 50
+        transaction.approved = False
+        transaction.save()
+        Transaction.objects.filter(account=self.card).delete()
+        self.assertEqual(ledger.verify(workers=1).mismatches, [])
+
+        Transaction.objects.filter(account=self.cash).delete()
+        report = ledger.verify(workers=1)
+        self.assertEqual(report.mismatches, [])
+        self.assertEqual(report.running_balances, 0)
+        self.assertEqual(ledger.rebuild(), [])
+
+    def test_running_balances(self):
+        Transaction.objects.filter(account=self.reserve).update(balance=0)
+        report = ledger.verify(workers=1)
+
+        self.assertTrue(report.running_balances)
+        self.assertEqual(ledger.verify(workers=1, repair=True)
+                         .running_balances, report.running_balances)
+        self.assertEqual(ledger.verify(workers=1).running_balances, 0)
+
+    def test_command(self):
+        out = StringIO()
+        call_command('verify_ledger', workers=1, stdout=out)
+
+        self.assertIn('sheaf\t({}, \'EUR\')'.format(self.wallet.pk),
+                      out.getvalue())
+        self.assertTrue(self.wallet.sheaves.filter(currency=EUR).exists())
+
+
+class SeriesTestCase(DjangoTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        add_test_data(cls)
+
+    def test_bucket_ends(self):
+        self.assertEqual(
+            series.bucket_ends(date(2017, 10, 30), date(2017, 11, 7),
+                               series.WEEK),
+            [date(2017, 11, 5), date(2017, 11, 7)]
+        )
+        self.assertEqual(
+            series.bucket_ends(date(2016, 1, 15), date(2016, 3, 1),
+                               series.MONTH),
+            [date(2016, 1, 31), date(2016, 2, 29), date(2016, 3, 1)]
+        )
+        self.assertEqual(
+            len(series.bucket_ends(date(2017, 1, 1), date(2017, 12, 31))),
+            365
+        )
+
+    def test_unknown_granularity(self):
+        with self.assertRaises(ValueError):
+            series.bucket_ends(date(2017, 1, 1), date(2017, 2, 1), 'year')
+
+    def test_downsample(self):
+        ends = series.bucket_ends(date(2017, 1, 1), date(2017, 12, 31))
+        downsampled = series.downsample(ends, 100)
+
+        self.assertLessEqual(len(downsampled), 100)
+        self.assertEqual(downsampled[-1], date(2017, 12, 31))
+        self.assertEqual(series.downsample(ends[:10], 100), ends[:10])
+
+    def test_balance_matches_balance_history(self):
+        start, end = date(2015, 3, 1), date(2015, 8, 31)
+        cash = Account.objects.get(pk=self.cash.pk)
+        points = series.series(Account.get_tree(cash), start, end)
+
+        self.assertEqual([i for _, i in points],
+                         cash.balance_history(
+                             series.bucket_ends(start, end)))
+
+    def test_downsampled_balance(self):
+        start, end = date(2015, 3, 1), date(2015, 8, 31)
+        points = series.series(Account.get_tree(self.cash), start, end,
+                               max_points=10)
+        full = dict(series.series(Account.get_tree(self.cash), start, end))
+
+        self.assertLessEqual(len(points), 10)
+        for period_end, values in points:
+            self.assertEqual(values, full[period_end])
+
+    def test_flow(self):
+        start, end = date(2015, 4, 1), date(2015, 4, 30)
+        points = series.series(Account.get_tree(self.wallet), start, end,
+                               series.MONTH, series.FLOW)
+        expected = {
+            str(i['currency']): i['amount'] for i in Transaction.objects
+            .filter(account=self.wallet, approved=True,
+                    date__gte=start, date__lte=end)
+            .values('currency').annotate(amount=Sum('amount'))
+            .order_by('currency')
+        }
+
+        self.assertEqual(points, [(end, expected)])
+
+    def test_balance_from_checkpoint(self):
+        start, end = date(2015, 4, 1), date(2015, 8, 31)
+        cash = Account.objects.get(pk=self.cash.pk)
+        expected = series.series(Account.get_tree(cash), start, end)
+        PeriodClose.close(date(2015, 3, 31))
+        PeriodClose.close(date(2015, 4, 2))
+
+        self.assertEqual(series.series(Account.get_tree(cash), start, end),
+                         expected)
+
+    def test_one_query(self):
+        with self.assertNumQueries(1):
+            series.series(Account.get_tree(self.cash), date(2010, 1, 1),
+                          date(2017, 12, 31), series.WEEK, max_points=50)
+
+    def test_close_period_command(self):
+        out = StringIO()
+        call_command('close_period', '2015-04-30', stdout=out)
+        self.assertIn('Period till 2015-04-30 closed', out.getvalue())
+
+        call_command('close_period', '2015-04-30', reopen=True, stdout=out)
+        self.assertIsNone(PeriodClose.last_date())
+
+
+class ExchangeRatesTestCase(DjangoTestCase):
+    CBR_XML = """<?xml version="1.0" encoding="windows-1251"?>
+<ValCurs Date="14.10.2017" name="Foreign Currency Market">
+<Valute ID="R01235"><NumCode>840</NumCode><CharCode>USD</CharCode>
+<Nominal>1</Nominal><Name>Доллар США</Name><Value>57,5118</Value></Valute>
+<Valute ID="R01820"><NumCode>392</NumCode><CharCode>JPY</CharCode>
+<Nominal>100</Nominal><Name>Японских иен</Name><Value>51,2020</Value></Valute>
+</ValCurs>""".encode('windows-1251')
+
+    def tearDown(self):
+        rates.clear_cache()
+
+    def test_parse_cbr_xml(self):
+        self.assertEqual(
+            rates.parse_cbr_xml(BytesIO(self.CBR_XML)),
+            [('USD', date(2017, 10, 14), Decimal('57.5118')),
+             ('JPY', date(2017, 10, 14), Decimal('0.512020'))]
+        )
+
+    def test_parse_csv(self):
+        self.assertEqual(
+            rates.parse_csv(StringIO('USD,2017-10-14,57.5118\n\n')),
+            [('USD', date(2017, 10, 14), Decimal('57.5118'))]
+        )
+
+    def test_store_replaces_rates(self):
+        rates.store([('USD', date(2017, 10, 14), Decimal('57'))])
+        rates.store([('USD', date(2017, 10, 14), Decimal('58')),
+                     ('USD', date(2017, 10, 15), Decimal('59'))])
+
+        self.assertEqual(ExchangeRate.objects.count(), 2)
+        self.assertEqual(ExchangeRate.objects.get(date=date(2017, 10, 14))
+                         .rate, Decimal('58'))
+
+    def test_nearest_rate(self):
+        rates.store([('USD', date(2017, 10, 14), Decimal('57')),
+                     ('USD', date(2017, 10, 16), Decimal('58'))])
+        table = rates.get_table()
+
+        self.assertIsNone(table.rate('USD', date(2017, 10, 13)))
+        self.assertEqual(table.rate('USD', date(2017, 10, 15)), Decimal('57'))
+        self.assertEqual(table.rate('USD', date(2017, 10, 16)), Decimal('58'))
+        self.assertEqual(table.rate('USD'), Decimal('58'))
+        self.assertEqual(table.rate(settings.BASE_CURRENCY), Decimal(1))
+        self.assertIsNone(table.rate('EUR', date(2017, 10, 16)))
+
+    def test_total(self):
+        rates.store([('USD', date(2017, 10, 14), Decimal('57')),
+                     ('USD', date(2017, 10, 16), Decimal('58'))])
+        table = rates.get_table()
+
+        self.assertEqual(
+            table.total([('USD', Decimal(2), date(2017, 10, 15)),
+                         ('USD', Decimal(1), date(2017, 10, 16)),
+                         (settings.BASE_CURRENCY, Decimal(10), None),
+                         ('EUR', Decimal(5), date(2017, 10, 16))]),
+            (Decimal(182), {'EUR'})
+        )
+
+    def test_table_is_cached(self):
+        rates.get_table()
+        # only version stamp is checked
+        with self.assertNumQueries(1):
+            rates.get_table()
+
+        rates.store([('USD', date(2017, 10, 14), Decimal('57'))])
+        self.assertEqual(rates.get_table().rate('USD'), Decimal('57'))
+
+    def test_table_is_reloaded_after_stamp_bump(self):
+        self.assertIsNone(rates.get_table().rate('USD'))
+
+        # rates stored by another process, cache of this one isn't cleared
+        ExchangeRate.objects.create(currency='USD', date=date(2017, 10, 14),
+                                    rate=Decimal('57'))
+        VersionStamp.bump(ExchangeRate.VERSION)
+
+        self.assertEqual(rates.get_table().rate('USD'), Decimal('57'))
+
+    def test_command(self):
+        with NamedTemporaryFile(suffix='.xml') as xml_file:
+            xml_file.write(self.CBR_XML)
+            xml_file.flush()
+            out = StringIO()
+            call_command('load_exchange_rates', xml_file.name, stdout=out)
+
+        self.assertIn('2 rates loaded', out.getvalue())
+        self.assertEqual(ExchangeRate.objects.count(), 2)
+
+
+class AccountRegistryTestCase(DjangoTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        add_test_data(cls)
+
+    def test_registry_is_loaded_once(self):
+        get_registry()
+        with self.assertNumQueries(1):
+            registry = get_registry()
+
+        self.assertEqual(
+            [i.pk for i in registry.tree],
+            list(Account.objects.order_by('tree_id', 'lft')
+                 .values_list('pk', flat=True))
+        )
+        self.assertEqual(
+            {i.pk for i in registry.of_type(Account.EXPENSE)},
+            {i.pk for i in Account.get_expenses()}
+        )
+
+    def test_registry_is_reloaded_after_save(self):
+        get_registry()
+        wallet = Account.objects.get(pk=self.wallet.pk)
+        wallet.bank_title = 'VISA1234'
+        wallet.save()
+
+        self.assertEqual(get_registry().by_bank_title['VISA1234'].pk,
+                         wallet.pk)
+
+    def test_registry_is_reloaded_after_add_move_and_delete(self):
+        get_registry()
+        cash = Account.objects.get(pk=self.cash.pk)
+        child = cash.add_child(title='Сейф', type=Account.ACCOUNT)
+        self.assertIn(child.pk, get_registry().by_pk)
+
+        child.move(Account.objects.get(pk=self.bank.pk), 'last-child')
+        registry = get_registry()
+        self.assertEqual(
+            [i.pk for i in registry.ancestors(registry.get(child.pk))],
+            [self.bank.pk]
+        )
+
+        Account.objects.get(pk=child.pk).delete()
+        self.assertNotIn(child.pk, get_registry().by_pk)
+
+    def test_ranges(self):
+        registry = get_registry()
+        for account in Account.objects.all():
+            self.assertEqual(
+                [i.pk for i in registry.descendants(registry.get(account.pk))],
+                [i.pk for i in account.get_descendants()]
+            )
+            self.assertEqual(
+                [i.pk for i in registry.ancestors(registry.get(account.pk))],
+                [i.pk for i in account.get_ancestors()]
+            )
+            self.assertEqual(account.pk in registry.leaves, account.is_leaf())
+
+
+class CursorPaginatorTestCase(DjangoTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        add_test_data(cls)
+        # invoices with the same timestamp are ordered by id
+        for i in range(7):
+            Invoice.objects.create(timestamp=cls.first_invoice.timestamp)
+
+    def walk(self, paginator):
+        pages = [paginator.page()]
+        while pages[-1].has_next():
+            pages.append(paginator.page(pages[-1].next_cursor))
+        return pages
+
+    def test_pages(self):
+        expected = list(Invoice.objects.order_by('-timestamp', '-pk')
+                        .values_list('pk', flat=True))
+        paginator = CursorPaginator(Invoice.objects.all(), 3)
+        pages = self.walk(paginator)
+
+        self.assertEqual([i.pk for page in pages for i in page], expected)
+        self.assertFalse(pages[0].has_previous())
+        self.assertTrue(all(len(page) == 3 for page in pages[:-1]))
+        for previous, page in zip(pages, pages[1:]):
+            self.assertEqual(
+                [i.pk for i in paginator.page(page.previous_cursor)],
+                [i.pk for i in previous]
+            )
+        self.assertIsNone(paginator.count)
+
+    def test_ascending_ordering(self):
+        paginator = CursorPaginator(Transaction.objects.all(), 4,
+                                    ordering=('date', 'amount', 'pk'))
+        self.assertEqual(
+            [i.pk for page in self.walk(paginator) for i in page],
+            list(Transaction.objects.order_by('date', 'amount', 'pk')
+                 .values_list('pk', flat=True))
+        )
+
+    def test_approximate_count(self):
+        paginator = CursorPaginator(Invoice.objects.filter(comment=''), 3,
+                                    approximate_count=True)
+        self.assertEqual(paginator.count,
+                         Invoice.objects.filter(comment='').count())
+
+    def plan(self, queryset, ordering):
+        paginator = CursorPaginator(queryset, 3, ordering=ordering)
+        last = queryset.order_by(*ordering).last()
+        values = [getattr(last, name.lstrip('-')) for name in ordering]
+        sql, params = queryset.filter(paginator.seek(values))\
+            .order_by(*ordering)[:4].query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+            return ' '.join(str(row[-1]) for row in cursor.fetchall())
+
+    @skipUnless(connection.vendor == 'sqlite', 'plan of SQLite is checked')
+    def test_deep_pages_use_index(self):
+        # pages are read by index in order, whole table isn't sorted
+        for queryset, ordering in (
+                (Invoice.objects.all(), ('-timestamp', '-pk')),
+                (Transaction.objects.all(), ('-date', '-pk'))):
+            plan = self.plan(queryset, ordering)
+            self.assertIn('INDEX', plan)
+            self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_wrong_cursor(self):
+        paginator = CursorPaginator(Invoice.objects.all(), 3)
+        for cursor in ('nonsense', 'WyJ4IiwxXQ', 'WyJuIiwiYSIsMV0'):
+            with self.assertRaises(InvalidPage):
+                paginator.page(cursor)
+
+
+class SearchTestCase(DjangoTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        add_test_data(cls)
+        cls.shop = Invoice.objects.create(timestamp=cls.first_invoice.timestamp,
+                                          comment='Pyaterochka, Moscow')
+        cls.milk = Transaction.objects.create(
+            date=date(2017, 10, 15), amount=-89, account=cls.card,
+            invoice=cls.shop, comment='Milk 3.2%'
+        )
+        cls.bread = Transaction.objects.create(
+            date=date(2017, 10, 15), amount=-45, account=cls.card,
+            invoice=cls.shop, comment='Bread'
+        )
+
+    def found(self, query):
+        return [i.pk for i in search.search(query)]
+
+    def test_transaction_comment(self):
+        self.assertEqual(self.found('салями'),
+                         list(Transaction.objects.filter(comment='салями')
+                              .order_by('-date', '-pk')
+                              .values_list('pk', flat=True)))
+        self.assertEqual(self.found('САЛЯМИ'), self.found('салями'))
+
+    def test_invoice_comment(self):
+        self.assertEqual(set(self.found('pyaterochka')),
+                         {self.milk.pk, self.bread.pk})
+
+    def test_prefix_and_all_words(self):
+        self.assertEqual(self.found('pyat mil'), [self.milk.pk])
+        self.assertEqual(self.found('milk bread'), list())
+        self.assertEqual(self.found('  '), list())
+        self.assertEqual(self.found('"milk"* -'), [self.milk.pk])
+
+    def test_rank(self):
+        # milk matches by its own comment and by comment of invoice
+        result = list(search.search('moscow milk'))
+        self.assertEqual([i.pk for i in result], [self.milk.pk])
+        ranked = list(search.search('pyaterochka'))
+        self.assertTrue(all(i.rank > 0 for i in ranked))
+
+    def test_index_is_updated(self):
+        milk = Transaction.objects.get(pk=self.milk.pk)
+        milk.comment = 'Kefir'
+        milk.save()
+        self.assertEqual(self.found('milk'), list())
+        self.assertEqual(self.found('kefir'), [self.milk.pk])
+
+        Invoice.objects.filter(pk=self.shop.pk).update(comment='Magnit')
+        self.assertEqual(set(self.found('magnit')),
+                         {self.milk.pk, self.bread.pk})
+        Transaction.objects.get(pk=self.bread.pk).delete()
+        self.assertEqual(self.found('magnit'), [self.milk.pk])
+
+    def test_facets(self):
+        facets = search.facets(search.match('pyaterochka'))
+        self.assertEqual(facets['accounts'],
+                         [{'account': self.card.pk,
+                           'account__title': self.card.title, 'count': 2}])
+        self.assertEqual(facets['years'], [{'year': 2017, 'count': 2}])
+        self.assertEqual([(str(i['currency']), i['total'], i['count'])
+                          for i in facets['currencies']],
+                         [(settings.BASE_CURRENCY, Decimal(-134), 2)])
+        self.assertEqual(facets['amounts'], [{'amount': '0-100', 'count': 2}])
+        self.assertEqual(search.filter_amount(search.match('pyaterochka'),
+                                              '100-1000').count(), 0)
+
+
+class ExportTestCase(DjangoTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        add_test_data(cls)
+
+    def export(self, format, **filters):
+        return ''.join(export.export(format, **filters))
+
+    def test_csv(self):
+        rows = list(csv.DictReader(StringIO(self.export(export.CSV))))
+        self.assertEqual(len(rows), Transaction.objects.count())
+        self.assertEqual(tuple(rows[0].keys()), export.FIELDS)
+        self.assertEqual(sum(Decimal(i['amount']) for i in rows),
+                         Transaction.objects.aggregate(total=Sum('amount'))
+                         ['total'])
+
+    def test_filters(self):
+        cash = Account.objects.get(pk=self.cash.pk)
+        rows = list(csv.DictReader(StringIO(self.export(
+            export.CSV, account=cash, start=date(2015, 3, 2),
+            end=date(2017, 12, 31), currency=settings.BASE_CURRENCY
+        ))))
+        expected = Transaction.objects.filter(
+            account__in=Account.get_tree(cash),
+            date__range=(date(2015, 3, 2), date(2017, 12, 31)),
+            currency=settings.BASE_CURRENCY
+        )
+        self.assertEqual({int(i['pk']) for i in rows},
+                         set(expected.values_list('pk', flat=True)))
+
+    def test_ofx(self):
+        content = self.export(export.OFX,
+                              account=Account.objects.get(pk=self.wallet.pk))
+        transactions = Transaction.objects.filter(account=self.wallet)
+        self.assertTrue(content.startswith('<?xml'))
+        self.assertEqual(content.count('<STMTTRN>'), transactions.count())
+        self.assertEqual(
+            content.count('<STMTRS>'),
+            transactions.values('currency').distinct().count()
+        )
+        self.assertEqual(content.count('<STMTRS>'),
+                         content.count('</STMTRS>'))
+
+    def test_beancount(self):
+        content = self.export(export.BEANCOUNT)
+        names = export.beancount_accounts()
+        self.assertEqual(names[self.wallet.pk], 'Assets:Наличные:Кошелёк')
+        self.assertEqual(names[self.opening_balance.pk],
+                         'Income:Входящий-остаток')
+        self.assertIn('1970-01-01 open Assets:Наличные:Кошелёк\n', content)
+        entries = [i for i in content.split('\n\n')[1:]]
+        self.assertEqual(
+            len(entries),
+            Transaction.objects.filter(invoice__isnull=False)
+            .values('invoice').distinct().count() +
+            Transaction.objects.filter(invoice__isnull=True).count()
+        )
+
+    def assertEntriesBalance(self, content):
+        for entry in content.split('\n\n')[1:]:
+            weights = defaultdict(Decimal)
+            for line in entry.splitlines()[1:]:
+                posting = re.match(r'  (\S+) +(-?[\d.]+) (\w+)'
+                                   r'(?: @@ ([\d.]+) (\w+))?', line)
+                if posting is None:
+                    continue
+                _, amount, currency, total, price_currency = posting.groups()
+                if total is None:
+                    weights[currency] += Decimal(amount)
+                else:
+                    weights[price_currency] += \
+                        Decimal(total).copy_sign(Decimal(amount))
+            self.assertEqual([i for i in weights.values() if i], [], entry)
+
+    def test_beancount_entries_balance(self):
+        exchange = Invoice.objects.create(
+            timestamp=self.first_invoice.timestamp, comment='Exchange')
+        for account, amount, currency in (
+                (self.wallet, Decimal('-100'), USD),
+                (self.expenses[0], Decimal('1'), USD),
+                (self.cash, Decimal('5940'), RUB)):
+            Transaction.objects.create(date=date(2015, 4, 3), account=account,
+                                       amount=amount, currency=currency,
+                                       invoice=exchange)
+        content = self.export(export.BEANCOUNT)
+
+        self.assertRegex(content, r' -100\.0* USD @@ 6000\.0* RUB\n')
+        self.assertRegex(content, r' 1\.0* USD @@ 60\.0* RUB\n')
+        self.assertIn('1970-01-01 open {}\n'.format(
+            export.BEANCOUNT_UNBALANCED), content)
+        self.assertEntriesBalance(content)
+
+    def test_beancount_exports_whole_invoices(self):
+        content = self.export(export.BEANCOUNT,
+                              account=Account.objects.get(pk=self.cash.pk))
+        self.assertEntriesBalance(content)
+        invoices = Transaction.objects.filter(
+            account__in=Account.get_tree(Account.objects.get(pk=self.cash.pk))
+        ).exclude(invoice=None).values('invoice')
+        self.assertTrue(invoices)
+        self.assertEqual(
+            len(re.findall(r'^  (?!invoice:)\S+ +-?[\d.]+ ', content, re.M)) -
+            content.count(export.BEANCOUNT_UNBALANCED + ' '),
+            Transaction.objects.filter(invoice__in=invoices).count() +
+            Transaction.objects.filter(
+                account__in=Account.get_tree(
+                    Account.objects.get(pk=self.cash.pk)),
+                invoice=None).count()
+        )
+
+    def test_beancount_name(self):
+        self.assertEqual(export._beancount_name('_food_and drinks_'),
+                         'Food-and-drinks')
+
+    def test_command(self):
+        with NamedTemporaryFile(suffix='.csv') as output:
+            call_command('export_ledger', format=export.CSV,
+                         account=self.bank.pk, output=output.name,
+                         stderr=StringIO())
+            with open(output.name, newline='') as exported:
+                rows = list(csv.DictReader(exported))
+        self.assertEqual(
+            len(rows),
+            Transaction.objects.filter(
+                account__in=Account.get_tree(
+                    Account.objects.get(pk=self.bank.pk))).count()
+        )
+
+        out = StringIO()
+        call_command('export_ledger', format=export.BEANCOUNT, stdout=out)
+        self.assertEqual(out.getvalue(), self.export(export.BEANCOUNT))
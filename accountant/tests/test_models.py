@@ -2,12 +2,14 @@ import logging
 from datetime import date, timedelta
 
 from django.conf import settings
+from django.db.models import Sum
 from django.db.utils import IntegrityError
 from django.test import TestCase
 from moneyed import Decimal, JPY, USD, ZAR
 from typing import Iterable
 
-from accountant.models import Sheaf, Transaction, Account
+from accountant.models import Sheaf, Transaction, Account, DailyBalance, \
+    Invoice, PeriodClose, ClosedPeriodError, TreeSheaf, VersionStamp
 from frekenbok.tests.test_data import add_test_data
 
 logger = logging.getLogger(__name__)
@@ -99,8 +101,11 @@ class AccountTestCase(TestCase):
         )
 
     def test_tree_summary(self):
+        # `self.cash` keeps nested set bounds from the moment of creation,
+        # fresh instance is required to get all children
+        cash = Account.objects.get(pk=self.cash.pk)
         expected_tree_summary = dict()
-        for account in self.cash.get_children():
+        for account in cash.get_children():
             for sheaf in account.sheaves.all():
                 expected_tree_summary.setdefault(sheaf.currency, Decimal(0))
                 expected_tree_summary[sheaf.currency] += sheaf.amount
@@ -108,7 +113,35 @@ class AccountTestCase(TestCase):
                            for key, value in expected_tree_summary.items()]
         expected_result.sort(key=lambda x: x['currency'])
 
-        self.assertEqual(expected_result, list(self.cash.tree_summary()))
+        self.assertEqual(expected_result, list(cash.tree_summary()))
+
+    def assertTreeSummaryConsistent(self):
+        for account in Account.objects.all():
+            expected = dict()
+            for sheaf in Sheaf.objects.filter(
+                    account__in=Account.get_tree(account)):
+                expected.setdefault(sheaf.currency, Decimal(0))
+                expected[sheaf.currency] += sheaf.amount
+            actual = {i['currency']: i['amount']
+                      for i in account.tree_summary()}
+            self.assertEqual(expected, actual)
+
+    def test_tree_summary_after_transaction(self):
+        Transaction.objects.create(date=date.today(), amount=Decimal('10'),
+                                   currency=JPY, account=self.reserve)
+
+        self.assertTreeSummaryConsistent()
+
+    def test_tree_summary_after_move(self):
+        Account.objects.get(pk=self.reserve.pk)\
+            .move(Account.objects.get(pk=self.bank.pk), 'last-child')
+
+        self.assertTreeSummaryConsistent()
+
+    def test_tree_summary_after_delete(self):
+        Account.objects.get(pk=self.reserve.pk).delete()
+
+        self.assertTreeSummaryConsistent()
 
     @staticmethod
     def sorted_ids(accounts: Iterable[Account]):
@@ -172,6 +205,110 @@ class SheafTestCase(TestCase):
         self.assertNotEqual(some_sheaf, other_sheaf)
 
 
+class DailyBalanceTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        add_test_data(cls)
+
+    def balance_at(self, account: Account, day: date, currency=ZAR):
+        return DailyBalance.objects\
+            .filter(account=account, currency=currency, date__lte=day)\
+            .order_by('-date')\
+            .values_list('amount', flat=True)\
+            .first()
+
+    def test_new_transaction_adds_daily_balance(self):
+        Transaction.objects.create(date=date(2016, 1, 10),
+                                   account=self.wallet,
+                                   amount=Decimal('100'),
+                                   currency=ZAR)
+
+        self.assertIsNone(self.balance_at(self.wallet, date(2016, 1, 9)))
+        self.assertEqual(self.balance_at(self.wallet, date(2016, 1, 10)),
+                         Decimal('100'))
+
+    def test_backdated_transaction_shifts_later_balances(self):
+        Transaction.objects.create(date=date(2016, 1, 10),
+                                   account=self.wallet,
+                                   amount=Decimal('100'),
+                                   currency=ZAR)
+        Transaction.objects.create(date=date(2016, 1, 5),
+                                   account=self.wallet,
+                                   amount=Decimal('20'),
+                                   currency=ZAR)
+
+        self.assertEqual(self.balance_at(self.wallet, date(2016, 1, 7)),
+                         Decimal('20'))
+        self.assertEqual(self.balance_at(self.wallet, date(2016, 1, 10)),
+                         Decimal('120'))
+
+    def test_deleted_transaction_removed_from_daily_balance(self):
+        transaction = Transaction.objects.create(date=date(2016, 1, 10),
+                                                 account=self.wallet,
+                                                 amount=Decimal('100'),
+                                                 currency=ZAR)
+        transaction.delete()
+
+        self.assertIsNone(self.balance_at(self.wallet, date(2016, 1, 10)))
+        self.assertFalse(Sheaf.objects.filter(account=self.wallet,
+                                              currency=ZAR).exists())
+        self.assertFalse(TreeSheaf.objects.filter(currency=ZAR).exists())
+
+    def test_moved_transaction_leaves_no_daily_balance(self):
+        transaction = Transaction.objects.create(date=date(2016, 1, 10),
+                                                 account=self.wallet,
+                                                 amount=Decimal('100'),
+                                                 currency=ZAR)
+        Transaction.objects.create(date=date(2016, 1, 12),
+                                   account=self.wallet,
+                                   amount=Decimal('5'),
+                                   currency=ZAR)
+        transaction.date = date(2016, 1, 11)
+        transaction.save()
+
+        self.assertEqual(
+            list(DailyBalance.objects.filter(account=self.wallet, currency=ZAR)
+                 .order_by('date').values_list('date', 'amount')),
+            [(date(2016, 1, 11), Decimal('100')),
+             (date(2016, 1, 12), Decimal('105'))]
+        )
+
+    def test_recalculate_summary_keeps_daily_balances(self):
+        expected = list(self.wallet.daily_balances
+                        .order_by('currency', 'date')
+                        .values_list('currency', 'date', 'amount'))
+        self.wallet.recalculate_summary()
+        actual = list(self.wallet.daily_balances
+                      .order_by('currency', 'date')
+                      .values_list('currency', 'date', 'amount'))
+
+        self.assertEqual(expected, actual)
+
+    def test_balance_history(self):
+        dates = [date(2015, 4, 1) + timedelta(days=i) for i in range(10)]
+        history = self.cash.balance_history(dates)
+
+        self.assertEqual(len(history), len(dates))
+        for day, summary in zip(dates, history):
+            expected = {i['currency']: i['amount']
+                        for i in self.cash.summary_at(day)}
+            self.assertEqual(summary, expected)
+
+
+    def test_summary_doesnt_scan_history(self):
+        # accounts and currencies, one seek for every one of them and sum of
+        # found balances
+        keys = DailyBalance.objects\
+            .filter(account__in=Account.get_tree(self.cash))\
+            .values('account', 'currency').distinct().count()
+        for day in range(1, 30):
+            Transaction.objects.create(date=date(2015, 3, day),
+                                       account=self.wallet, amount=1)
+        with self.assertNumQueries(keys + 2):
+            summary = list(self.cash.summary_at(date(2015, 4, 10)))
+        self.assertEqual(len(summary), len({i['currency'] for i in summary}))
+
+
 class TransactionTestCase(TestCase):
     @classmethod
     def setUpTestData(cls):
@@ -243,6 +380,332 @@ class TransactionTestCase(TestCase):
         )
 
 
+class TransactionLedgerTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        add_test_data(cls)
+
+    def assertSheavesConsistent(self, *accounts: Account):
+        for account in accounts:
+            expected = {i['currency']: i['amount'] for i in
+                        Transaction.objects.filter(account=account,
+                                                   approved=True)
+                            .values('currency')
+                            .annotate(amount=Sum('amount'))
+                            .order_by()}
+            actual = {i.currency: i.amount for i in account.sheaves.all()
+                      if i.amount or i.currency in expected}
+            self.assertEqual(expected, actual)
+
+    def test_change_amount(self):
+        transaction = self.reserve.transactions.first()
+        transaction.amount += Decimal('10.5')
+        transaction.save()
+
+        self.assertSheavesConsistent(self.reserve)
+
+    def test_change_currency(self):
+        transaction = self.reserve.transactions.first()
+        transaction.currency = JPY
+        transaction.save()
+
+        self.assertSheavesConsistent(self.reserve)
+
+    def test_change_approved(self):
+        transaction = self.reserve.transactions.first()
+        transaction.approved = False
+        transaction.save()
+        self.assertSheavesConsistent(self.reserve)
+
+        transaction.approved = True
+        transaction.save()
+        self.assertSheavesConsistent(self.reserve)
+
+    def test_change_account(self):
+        transaction = self.reserve.transactions.first()
+        transaction.account = self.card
+        transaction.save()
+
+        self.assertSheavesConsistent(self.reserve, self.card)
+
+    def test_edit_doesnt_scan_history(self):
+        transaction = self.reserve.transactions.first()
+        transaction.amount += 1
+        with self.assertNumQueries(17):
+            transaction.save()
+
+        for i in range(10):
+            Transaction.objects.create(date=date(2015, 1, 1), amount=i,
+                                       currency=transaction.currency,
+                                       account=self.reserve)
+        transaction.amount += 1
+        with self.assertNumQueries(17):
+            transaction.save()
+
+    def test_bulk_create(self):
+        Transaction.objects.bulk_create([
+            Transaction(date=date(2015, 1, 1) + timedelta(days=i),
+                        amount=Decimal(i), currency=JPY, account=account,
+                        approved=bool(i % 3))
+            for i in range(20) for account in (self.reserve, self.card)
+        ])
+
+        self.assertSheavesConsistent(self.reserve, self.card)
+        self.assertEqual(Transaction.objects.repair_balances(), 0)
+
+    def test_delete(self):
+        self.reserve.transactions.first().delete()
+
+        self.assertSheavesConsistent(self.reserve)
+
+    def test_queryset_delete(self):
+        Transaction.objects.filter(account=self.reserve).delete()
+
+        self.assertSheavesConsistent(self.reserve)
+
+    def test_queryset_update(self):
+        Transaction.objects.filter(account=self.reserve)\
+            .update(account=self.card)
+
+        self.assertSheavesConsistent(self.reserve, self.card)
+
+    def test_invoice_delete(self):
+        self.internal_transfer_invoice.delete()
+
+        self.assertSheavesConsistent(self.reserve)
+
+    def test_invoice_queryset_delete(self):
+        Invoice.objects.filter(pk=self.internal_transfer_invoice.pk).delete()
+
+        self.assertSheavesConsistent(self.reserve)
+
+
+class RunningBalanceTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        add_test_data(cls)
+
+    def assertBalancesConsistent(self, *accounts: Account):
+        for account in accounts:
+            balances = dict()
+            for transaction in Transaction.objects.filter(account=account)\
+                    .order_by('date', 'pk'):
+                balance = balances.get(transaction.currency, Decimal(0))
+                if transaction.approved:
+                    balance += transaction.amount
+                balances[transaction.currency] = balance
+                self.assertEqual(transaction.balance, balance)
+
+    def create(self, day: date, amount, **kwargs):
+        kwargs.setdefault('account', self.wallet)
+        kwargs.setdefault('currency', ZAR)
+        return Transaction.objects.create(date=day, amount=Decimal(amount),
+                                          **kwargs)
+
+    def test_new_transaction(self):
+        transaction = self.create(date(2016, 1, 10), 100)
+        self.create(date(2016, 1, 10), 5)
+
+        self.assertEqual(transaction.balance, Decimal(100))
+        self.assertBalancesConsistent(self.wallet)
+
+    def test_backdated_transaction(self):
+        self.create(date(2016, 1, 10), 100)
+        self.create(date(2016, 1, 5), 20)
+        self.create(date(2016, 1, 1), 3, approved=False)
+
+        self.assertBalancesConsistent(self.wallet)
+
+    def test_edit_transaction(self):
+        first = self.create(date(2016, 1, 10), 100)
+        self.create(date(2016, 1, 12), 20)
+        self.create(date(2016, 1, 14), 3)
+
+        first.date = date(2016, 1, 13)
+        first.save()
+        self.assertBalancesConsistent(self.wallet)
+
+        first.account = self.reserve
+        first.save()
+        self.assertBalancesConsistent(self.wallet, self.reserve)
+
+    def test_delete_transaction(self):
+        first = self.create(date(2016, 1, 10), 100)
+        self.create(date(2016, 1, 12), 20)
+        first.delete()
+
+        self.assertBalancesConsistent(self.wallet)
+
+    def test_queryset_operations(self):
+        self.create(date(2016, 1, 10), 100)
+        self.create(date(2016, 1, 12), 20)
+
+        Transaction.objects\
+            .filter(account=self.wallet, date__lt=date(2016, 1, 1))\
+            .update(approved=False)
+        self.assertBalancesConsistent(self.wallet)
+
+        Transaction.objects.filter(account=self.wallet, amount__gt=0).delete()
+        self.assertBalancesConsistent(self.wallet)
+
+    def test_move_not_approved_transactions(self):
+        self.create(date(2016, 1, 10), 100)
+        pending = self.create(date(2016, 1, 12), 7, approved=False)
+        self.create(date(2016, 1, 14), 7, approved=False)
+
+        Transaction.objects.filter(pk=pending.pk).update(account=self.reserve)
+        self.assertBalancesConsistent(self.wallet, self.reserve)
+
+        pending.refresh_from_db()
+        pending.account = self.wallet
+        pending.date = date(2016, 1, 9)
+        Transaction.objects.bulk_update([pending], ['account', 'date'])
+        self.assertBalancesConsistent(self.wallet, self.reserve)
+
+    def move(self, transaction: Transaction, day: date, **kwargs):
+        transaction = Transaction.objects.get(pk=transaction.pk)
+        transaction.date = day
+        for field, value in kwargs.items():
+            setattr(transaction, field, value)
+        transaction.save()
+        self.assertEqual(Transaction.objects.filter(account=self.wallet)
+                         .repair_balances(dry_run=True), 0)
+        self.assertBalancesConsistent(self.wallet)
+        return transaction
+
+    def test_move_forward_across_same_date(self):
+        first = self.create(date(2016, 1, 1), 100)
+        second = self.create(date(2016, 1, 1), 50)
+        last = self.create(date(2016, 1, 3), 7)
+
+        self.move(second, date(2016, 1, 2))
+        first = self.move(first, date(2016, 1, 5))
+        self.assertEqual(first.balance, Decimal(157))
+        last = self.move(last, date(2016, 1, 3), approved=False)
+        self.assertEqual(Transaction.objects.get(pk=last.pk).balance,
+                         Decimal(50))
+        self.move(last, date(2015, 12, 1))
+
+    def test_move_backward_across_same_date(self):
+        first = self.create(date(2016, 1, 1), 100)
+        self.create(date(2016, 1, 1), 50)
+        last = self.create(date(2016, 1, 3), 7)
+
+        # moved row has the largest id, so it's placed after rows of the date
+        last = self.move(last, date(2016, 1, 1))
+        self.assertEqual(last.balance, Decimal(157))
+        self.move(first, date(2015, 12, 31))
+        self.move(last, date(2015, 12, 31), approved=False)
+
+    def test_balance_at(self):
+        self.create(date(2016, 1, 10), 100)
+        self.create(date(2016, 1, 12), 20)
+
+        self.assertEqual(Transaction.objects.balance_at(
+            self.wallet, ZAR, date(2016, 1, 9)), Decimal(0))
+        self.assertEqual(Transaction.objects.balance_at(
+            self.wallet, ZAR, date(2016, 1, 11)), Decimal(100))
+        self.assertEqual(Transaction.objects.balance_at(
+            self.wallet, ZAR, date(2016, 1, 12)), Decimal(120))
+
+    def test_repair_balances(self):
+        self.create(date(2016, 1, 10), 100)
+        Transaction.objects.filter(account=self.wallet)\
+            .update(balance=Decimal(0))
+
+        version = VersionStamp.get(Transaction.VERSION)
+        self.assertTrue(Transaction.objects.repair_balances())
+        self.assertBalancesConsistent(self.wallet)
+        self.assertNotEqual(VersionStamp.get(Transaction.VERSION), version)
+
+        version = VersionStamp.get(Transaction.VERSION)
+        self.assertEqual(Transaction.objects.repair_balances(), 0)
+        self.assertEqual(VersionStamp.get(Transaction.VERSION), version)
+
+
+class PeriodCloseTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        add_test_data(cls)
+
+    def assertCheckpointsConsistent(self, period):
+        expected = {
+            (i['account'], i['currency']): i['amount'] for i in
+            Transaction.objects.filter(approved=True, date__lte=period.date)
+            .values('account', 'currency')
+            .annotate(amount=Sum('amount'))
+            .order_by()
+            if i['amount']
+        }
+        actual = {(i.account_id, i.currency): i.amount
+                  for i in period.checkpoints.all() if i.amount}
+        self.assertEqual(expected, actual)
+
+    def test_close(self):
+        period = PeriodClose.close(date(2015, 4, 3))
+        self.assertCheckpointsConsistent(period)
+
+        next_period = PeriodClose.close(date(2015, 4, 30))
+        self.assertCheckpointsConsistent(next_period)
+        self.assertEqual(PeriodClose.last_date(), date(2015, 4, 30))
+
+    def test_close_before_last_close(self):
+        PeriodClose.close(date(2015, 4, 30))
+        with self.assertRaises(ValueError):
+            PeriodClose.close(date(2015, 4, 3))
+
+    def test_edit_of_closed_period_is_rejected(self):
+        PeriodClose.close(date(2015, 4, 30))
+        transaction = Transaction.objects.get(
+            pk=self.first_salary_internal_tx.pk)
+        transaction.amount += 1
+
+        with self.assertRaises(ClosedPeriodError):
+            transaction.save()
+        with self.assertRaises(ClosedPeriodError):
+            Transaction.objects.create(date=date(2015, 4, 30), amount=1,
+                                       account=self.reserve)
+        transaction.refresh_from_db()
+        self.assertEqual(transaction.amount,
+                         self.first_salary_internal_tx.amount)
+
+    def test_comment_in_closed_period_can_be_changed(self):
+        PeriodClose.close(date(2015, 4, 30))
+        transaction = Transaction.objects.get(
+            pk=self.first_salary_internal_tx.pk)
+        transaction.comment = 'salary'
+        transaction.save()
+
+    def test_edit_of_open_period(self):
+        PeriodClose.close(date(2015, 4, 30))
+        Transaction.objects.create(date=date(2015, 5, 1), amount=1,
+                                   account=self.reserve)
+
+    def test_edit_of_closed_period_recomputes_checkpoints(self):
+        first = PeriodClose.close(date(2015, 4, 3))
+        second = PeriodClose.close(date(2015, 4, 30))
+
+        with self.settings(CLOSED_PERIOD_EDITS='recompute'):
+            transaction = Transaction.objects.get(
+                pk=self.first_salary_internal_tx.pk)
+            transaction.amount += 1
+            transaction.save()
+            Transaction.objects.create(date=date(2015, 4, 10), amount=1,
+                                       currency=ZAR, account=self.reserve)
+
+        self.assertCheckpointsConsistent(first)
+        self.assertCheckpointsConsistent(second)
+
+    def test_reopen(self):
+        PeriodClose.close(date(2015, 4, 3))
+        PeriodClose.close(date(2015, 4, 30))
+        PeriodClose.reopen(date(2015, 4, 30))
+
+        self.assertEqual(PeriodClose.last_date(), date(2015, 4, 3))
+        Transaction.objects.create(date=date(2015, 4, 30), amount=1,
+                                   account=self.reserve)
+
+
 class InvoiceTestCase(TestCase):
     @classmethod
     def setUpTestData(cls):
@@ -313,6 +776,27 @@ class InvoiceTestCase(TestCase):
         )
 
 
+    def test_fetch_transactions(self):
+        self.first_salary.transactions.filter(amount__lt=0).first().delete()
+        names = ('incomes', 'expenses', 'accounts', 'income_transactions',
+                 'expense_transactions', 'internal_transactions')
+
+        def summary(invoice):
+            return (
+                invoice.is_verified,
+                [(str(i['currency']), i['amount']) for i in invoice.pnl],
+                sorted((str(i['currency']), i['amount'])
+                       for i in invoice.verify()),
+                [sorted(i.pk for i in getattr(invoice, name))
+                 for name in names]
+            )
+
+        for invoice in Invoice.objects.all():
+            expected = summary(invoice)
+            fetched = Invoice.objects.get(pk=invoice.pk).fetch_transactions()
+            with self.assertNumQueries(0):
+                self.assertEqual(summary(fetched), expected)
+
 class DocumentTestCase(TestCase):
     @classmethod
     def setUpTestData(cls):
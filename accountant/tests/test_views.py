@@ -1,17 +1,28 @@
+import csv
 import json
 import logging
-from datetime import date, datetime
+from datetime import date, datetime, timedelta
 from decimal import Decimal
+from io import StringIO
 
 import pytz
 from django.conf import settings
 from django.contrib.auth.mixins import LoginRequiredMixin
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.cache import cache
 from django.core.urlresolvers import reverse
 from django.http import JsonResponse
-from django.test import TestCase, Client
+from django.db import connection
+from django.test import TestCase, Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils.timezone import now
 from os.path import join, dirname, abspath
+from tempfile import TemporaryDirectory
 
-from accountant.models import Account, Transaction, Invoice
+from accountant.misc import ledger
+from accountant.models import Account, Transaction, Invoice, PeriodClose, \
+    Document, ImportJob, Sheaf
 from accountant.views.account_detail_view import AccountDetailView
 from accountant.views.expense_list_view import ExpenseListView
 from accountant.views.income_list_view import IncomeListView
@@ -53,6 +64,80 @@ class AccountDetailViewTestCase(TestCase):
             )
         )
 
+    def get(self, pk, **query):
+        self.client.login(username=self.test_user.username,
+                          password=self.test_user_password)
+        return self.client.get(
+            reverse('accountant:account_detail', kwargs={'pk': pk}), query)
+
+    def test_period_totals(self):
+        root = Account.objects.get(pk=self.cash.pk)
+        accounts = Account.get_tree(root)
+        response = self.get(root.pk, start='2000-01-01', end='2100-01-01')
+        self.assertEqual(response.status_code, 200)
+        periods = {i['name']: i for i in response.context['periods']}
+        self.assertEqual(list(periods)[:3],
+                         ['this_month', 'prev_month', 'year_to_date'])
+        for period in periods.values():
+            expected = dict()
+            for transaction in Transaction.objects.filter(
+                    account__in=accounts, approved=True,
+                    date__gte=period['start'], date__lte=period['end']):
+                currency = str(transaction.currency)
+                expected[currency] = \
+                    expected.get(currency, Decimal(0)) + transaction.amount
+            self.assertEqual(
+                {str(i['currency']): i['amount'] for i in period['totals']},
+                {k: v for k, v in expected.items() if v}
+            )
+        self.assertTrue(periods['custom']['totals'])
+
+    def test_wrong_custom_period(self):
+        response = self.get(self.cash.pk, start='yesterday', end='today')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('custom',
+                         [i['name'] for i in response.context['periods']])
+
+    @override_settings(ACCOUNT_HISTORY_PAGE_SIZE=2)
+    def test_history_pages(self):
+        accounts = Account.get_tree(Account.objects.get(pk=self.cash.pk))
+        expected = list(Transaction.objects.filter(account__in=accounts)
+                        .order_by('-date', '-pk').values_list('pk', flat=True))
+        self.assertGreater(len(expected), 2)
+
+        seen, query = list(), dict()
+        while True:
+            page = self.get(self.cash.pk, **query).context['page_obj']
+            seen.extend(i.pk for i in page)
+            if not page.has_next():
+                break
+            query = {'cursor': page.next_cursor}
+        self.assertEqual(seen, expected)
+
+        # walking back from the last page gives the same pages
+        back = [i.pk for i in page]
+        while page.has_previous():
+            page = self.get(self.cash.pk, cursor=page.previous_cursor)\
+                .context['page_obj']
+            back = [i.pk for i in page] + back
+        self.assertEqual(back, expected)
+
+    @override_settings(ACCOUNT_HISTORY_PAGE_SIZE=1)
+    def test_history_queries_do_not_depend_on_page(self):
+        first = self.get(self.cash.pk).context['page_obj']
+        second = self.get(self.cash.pk, cursor=first.next_cursor)\
+            .context['page_obj']
+        counts = list()
+        for query in ({}, {'cursor': second.next_cursor}):
+            with CaptureQueriesContext(connection) as queries:
+                self.get(self.cash.pk, **query)
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+
+    def test_wrong_cursor(self):
+        response = self.get(self.cash.pk, cursor='yesterday')
+        self.assertEqual(response.status_code, 404)
+
 
 class AccountListViewTestCase(TestCase):
     @classmethod
@@ -79,6 +164,31 @@ class AccountListViewTestCase(TestCase):
                 not account.closed or account.closed >= date.today()
             )
 
+    def test_number_of_queries_doesnt_depend_on_accounts(self):
+        client = Client()
+        client.login(username=self.test_user.username,
+                     password=self.test_user_password)
+        with CaptureQueriesContext(connection) as few_accounts:
+            client.get(reverse('accountant:account_list'))
+        card = Account.objects.get(pk=self.card.pk)
+        for i in range(10):
+            child = card.add_child(title='Card #{}'.format(i),
+                                   type=Account.ACCOUNT)
+            Transaction.objects.create(date=date(2015, 4, 3), amount=i,
+                                       currency='USD', account=child)
+        with CaptureQueriesContext(connection) as many_accounts:
+            response = client.get(reverse('accountant:account_list'))
+
+        self.assertEqual(len(few_accounts), len(many_accounts))
+        self.assertContains(response, 'Card #9')
+
+    def test_sheaves_are_sorted(self):
+        for account in self.query_set:
+            currencies = [str(i.currency) for i in account.sorted_sheaves]
+            expected = sorted(currencies, key=lambda i: (
+                i != settings.BASE_CURRENCY, i))
+            self.assertEqual(currencies, expected)
+
     def test_login_less_request(self):
         client = Client()
         response = client.get(reverse('accountant:account_list'))
@@ -169,6 +279,80 @@ class ExpenseListViewTestCase(TestCase):
 
 
 class InvoiceListViewTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        add_test_data(cls)
+
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.client.login(username=self.test_user.username,
+                          password=self.test_user_password)
+
+    def tearDown(self):
+        del self.client
+
+    def test_summary(self):
+        response = self.client.get(reverse('accountant:invoice_list'))
+        self.assertEqual(response.status_code, 200)
+
+        for invoice in response.context['invoice_list']:
+            with self.assertNumQueries(0):
+                summary = (invoice.is_verified,
+                           [(str(i['currency']), i['amount'])
+                            for i in invoice.pnl])
+            fresh = Invoice.objects.get(pk=invoice.pk)
+            self.assertEqual(
+                summary,
+                (fresh.is_verified,
+                 [(str(i['currency']), i['amount']) for i in fresh.pnl])
+            )
+
+    def test_number_of_queries_doesnt_depend_on_page_size(self):
+        with CaptureQueriesContext(connection) as small_page:
+            self.client.get(reverse('accountant:invoice_list'))
+        for i in range(30):
+            invoice = Invoice.objects.create(timestamp=self.first_invoice
+                                             .timestamp)
+            Transaction.objects.create(date=date(2015, 4, 3), amount=i,
+                                       account=self.card, invoice=invoice)
+        with CaptureQueriesContext(connection) as full_page:
+            response = self.client.get(reverse('accountant:invoice_list'))
+
+        self.assertEqual(len(response.context['invoice_list']), 20)
+        self.assertEqual(len(small_page), len(full_page))
+        self.assertFalse([i for i in full_page.captured_queries
+                          if 'COUNT(' in i['sql']])
+
+    def test_pages(self):
+        for i in range(30):
+            Invoice.objects.create(timestamp=self.first_invoice.timestamp)
+        first = self.client.get(reverse('accountant:invoice_list'))\
+            .context['page_obj']
+        response = self.client.get(reverse('accountant:invoice_list'),
+                                   {'cursor': first.next_cursor})
+
+        page = response.context['page_obj']
+        self.assertTrue(page.has_previous())
+        self.assertFalse(set(i.pk for i in first) & set(i.pk for i in page))
+        self.assertEqual(
+            self.client.get(reverse('accountant:invoice_list'),
+                            {'cursor': 'page100'}).status_code,
+            404
+        )
+
+    def test_number_of_queries_doesnt_depend_on_depth(self):
+        for i in range(50):
+            Invoice.objects.create(timestamp=self.first_invoice.timestamp)
+        cursor, counts = None, list()
+        for i in range(3):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(reverse('accountant:invoice_list'),
+                                           {'cursor': cursor} if cursor else {})
+            counts.append(len(queries))
+            cursor = response.context['page_obj'].next_cursor
+        self.assertEqual(len(set(counts[1:])), 1)
+
     def test_login_less_request(self):
         client = Client()
         response = client.get(reverse('accountant:invoice_list'))
@@ -182,7 +366,306 @@ class InvoiceListViewTestCase(TestCase):
         )
 
 
+class TransactionListViewTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        add_test_data(cls)
+
+    def setUp(self):
+        self.client = Client()
+        self.client.login(username=self.test_user.username,
+                          password=self.test_user_password)
+
+    def tearDown(self):
+        del self.client
+
+    def test_list(self):
+        response = self.client.get(reverse('accountant:transaction_list'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [i.pk for i in response.context['transaction_list']],
+            list(Transaction.objects.order_by('-date', '-pk')
+                 .values_list('pk', flat=True)[:50])
+        )
+        self.assertEqual(response.context['paginator'].count,
+                         Transaction.objects.count())
+
+    def test_login_less_request(self):
+        client = Client()
+        response = client.get(reverse('accountant:transaction_list'))
+        self.assertEqual(response.status_code, 302)
+
+
+class SearchViewTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        add_test_data(cls)
+
+    def setUp(self):
+        self.client = Client()
+        self.client.login(username=self.test_user.username,
+                          password=self.test_user_password)
+
+    def tearDown(self):
+        del self.client
+
+    def test_search(self):
+        response = self.client.get(reverse('accountant:search'),
+                                   {'q': 'салями'})
+        self.assertEqual(response.status_code, 200)
+        expected = Transaction.objects.filter(comment='салями')
+        self.assertEqual(set(i.pk for i in response.context['transaction_list']),
+                         set(expected.values_list('pk', flat=True)))
+        self.assertEqual(response.context['paginator'].count, expected.count())
+
+        account = response.context['facets']['accounts'][0]
+        response = self.client.get(reverse('accountant:search') + account['url'])
+        self.assertEqual(
+            set(i.pk for i in response.context['transaction_list']),
+            set(expected.filter(account=account['account'])
+                .values_list('pk', flat=True))
+        )
+        self.assertTrue(response.context['facets']['accounts'][0]['active'])
+
+    def test_empty_query(self):
+        response = self.client.get(reverse('accountant:search'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(response.context['transaction_list']), list())
+
+    def test_wrong_filter(self):
+        response = self.client.get(reverse('accountant:search'),
+                                   {'q': 'салями', 'year': 'last'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(response.context['transaction_list']), list())
+
+    def test_login_less_request(self):
+        response = Client().get(reverse('accountant:search'), {'q': 'салями'})
+        self.assertEqual(response.status_code, 302)
+
+
+class LedgerCacheTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        add_test_data(cls)
+
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.client.login(username=self.test_user.username,
+                          password=self.test_user_password)
+
+    def tearDown(self):
+        del self.client
+
+    @staticmethod
+    def ledger_queries(queries):
+        # session and user are loaded by every request, other queries are
+        # made by the view
+        return [i['sql'] for i in queries.captured_queries
+                if 'accountant_' in i['sql']]
+
+    def test_not_modified(self):
+        url = reverse('accountant:account_list')
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('ETag', response)
+        self.assertIn('Last-Modified', response)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(
+                url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(len(self.ledger_queries(queries)), 1)
+
+    def test_cached_page(self):
+        url = reverse('accountant:invoice_list')
+        first = self.client.get(url)
+        with CaptureQueriesContext(connection) as queries:
+            second = self.client.get(url)
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(first.content, second.content)
+        self.assertEqual(first['ETag'], second['ETag'])
+        self.assertEqual(len(self.ledger_queries(queries)), 1)
+
+    def test_write_changes_version(self):
+        url = reverse('accountant:invoice_list')
+        etag = self.client.get(url)['ETag']
+
+        Invoice.objects.create(timestamp=self.first_invoice.timestamp,
+                               comment='Brand new invoice')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertIn('Brand new invoice', response.content.decode())
+
+        etag = response['ETag']
+        Transaction.objects.filter(pk=self.first_salary_income_tx.pk)\
+            .update(comment='Changed')
+        self.assertNotEqual(self.client.get(url)['ETag'], etag)
+
+    def test_recalculation_changes_version(self):
+        url = reverse('accountant:account_list')
+        Sheaf.objects.filter(account=self.wallet)\
+            .update(amount=Decimal('123456.78'))
+        first = self.client.get(url)
+        self.assertIn('123', first.content.decode())
+
+        self.client.get(reverse('accountant:recalculate'))
+        second = self.client.get(url)
+        self.assertNotEqual(first['ETag'], second['ETag'])
+        self.assertNotEqual(first.content, second.content)
+
+    def test_pages_of_users_differ(self):
+        url = reverse('accountant:account_list')
+        etag = self.client.get(url)['ETag']
+        User.objects.create_user(username='jane_dow', password='password')
+        client = Client()
+        client.login(username='jane_dow', password='password')
+        self.assertNotEqual(client.get(url)['ETag'], etag)
+
+
+class InvoiceCreateOrEditViewTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        add_test_data(cls)
+
+    def setUp(self):
+        self.client = Client()
+        self.client.login(username=self.test_user.username,
+                          password=self.test_user_password)
+
+    def tearDown(self):
+        del self.client
+
+    def __post(self, lines, invoice: Invoice = None):
+        data = {'invoice-timestamp': '2015-04-03 12:00:00',
+                'invoice-comment': 'Supermarket'}
+        for field in ('transaction-id', 'date', 'amount', 'currency',
+                      'quantity', 'unit', 'comment', 'account'):
+            data[field] = [str(line.get(field, '')) for line in lines]
+        if invoice is None:
+            url = reverse('accountant:invoice_create')
+        else:
+            url = reverse('accountant:invoice_edit', args=(invoice.pk,))
+        return self.client.post(url, data)
+
+    @staticmethod
+    def __line(tx: Transaction):
+        return {'transaction-id': tx.pk, 'date': tx.date.isoformat(),
+                'amount': tx.amount, 'currency': tx.currency,
+                'comment': tx.comment, 'account': tx.account_id}
+
+    def assertLedgerConsistent(self):
+        sheaves, _ = ledger.calculate(Account.objects.filter(
+            type__in=(Account.EXPENSE, Account.INCOME)))
+        for (account_id, currency), amount in sheaves.items():
+            self.assertEqual(
+                Account.objects.get(pk=account_id).sheaves
+                    .get(currency=currency).amount,
+                amount
+            )
+        self.assertEqual(Transaction.objects.filter(account=self.wallet)
+                         .repair_balances(dry_run=True), 0)
+
+    def test_create(self):
+        response = self.__post([
+            {'date': '2015-04-03', 'amount': '-30', 'currency': 'RUB',
+             'account': self.wallet.pk},
+            {'date': '2015-04-03', 'amount': '30', 'currency': 'RUB',
+             'account': self.expenses[0].pk, 'comment': 'bread'},
+        ])
+        self.assertEqual(response.status_code, 302)
+
+        invoice = Invoice.objects.get(comment='Supermarket')
+        self.assertEqual(invoice.transactions.count(), 2)
+        self.assertTrue(invoice.is_verified)
+        self.assertLedgerConsistent()
+
+    def test_edit(self):
+        transactions = list(self.first_invoice.transactions.order_by('pk'))
+        lines = [self.__line(i) for i in transactions]
+        lines[0]['amount'] += 10
+        lines[-1]['amount'] -= 15
+        removed = lines.pop(1)
+        lines.append({'date': '2015-04-03', 'amount': '5', 'currency': 'RUB',
+                      'account': self.expenses[0].pk, 'comment': 'new'})
+
+        self.assertEqual(self.__post(lines, self.first_invoice).status_code,
+                         302)
+        self.assertFalse(Transaction.objects
+                         .filter(pk=removed['transaction-id']).exists())
+        changed = Transaction.objects.get(pk=transactions[0].pk)
+        self.assertEqual(changed.amount, transactions[0].amount + 10)
+        self.assertEqual(changed.currency, 'RUB')
+        self.assertTrue(self.first_invoice.transactions
+                        .filter(comment='new').exists())
+        self.assertLedgerConsistent()
+
+    def test_number_of_queries_doesnt_depend_on_lines(self):
+        def post_lines(count):
+            lines = [self.__line(i) for i in self.first_invoice.transactions
+                     .order_by('pk')]
+            for line in lines:
+                line['amount'] += 1
+            lines.extend(
+                {'date': '2015-04-03', 'amount': '1', 'currency': 'RUB',
+                 'account': self.expenses[0].pk}
+                for _ in range(count)
+            )
+            with CaptureQueriesContext(connection) as queries:
+                self.__post(lines, self.first_invoice)
+            return len(queries)
+
+        post_lines(1)
+        self.assertEqual(post_lines(3), post_lines(30))
+
+    def test_closed_period(self):
+        PeriodClose.close(date(2015, 4, 30))
+        invoices_count = Invoice.objects.count()
+        response = self.__post([
+            {'date': '2015-04-03', 'amount': '-30', 'currency': 'RUB',
+             'account': self.wallet.pk},
+            {'date': '2015-04-03', 'amount': '30', 'currency': 'RUB',
+             'account': self.expenses[0].pk, 'comment': 'bread'},
+        ])
+        self.assertContains(response, 'Period till 2015-04-30 is closed',
+                            status_code=400)
+        self.assertEqual(Invoice.objects.count(), invoices_count)
+
+        transactions = list(self.first_invoice.transactions.order_by('pk'))
+        lines = [self.__line(i) for i in transactions]
+        lines[0]['amount'] += 10
+        response = self.__post(lines, self.first_invoice)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.context['invoice'], self.first_invoice)
+        self.assertEqual(Transaction.objects.get(pk=transactions[0].pk).amount,
+                         transactions[0].amount)
+
+
 class InvoiceDetailViewTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        add_test_data(cls)
+
+    def test_number_of_queries_doesnt_depend_on_transactions(self):
+        client = Client()
+        client.login(username=self.test_user.username,
+                     password=self.test_user_password)
+        url = reverse('accountant:invoice_detail',
+                      kwargs={'pk': self.first_invoice.pk})
+        with CaptureQueriesContext(connection) as few:
+            response = client.get(url)
+        self.assertEqual(response.status_code, 200)
+        for i in range(10):
+            Transaction.objects.create(date=date(2015, 4, 3), amount=i,
+                                       account=self.expenses[i % 3],
+                                       invoice=self.first_invoice)
+        with CaptureQueriesContext(connection) as many:
+            response = client.get(url)
+        self.assertEqual(len(few), len(many))
+        self.assertEqual(len(response.context['invoice'].expense_transactions),
+                         self.first_invoice.expense_transactions.count())
+
     def test_login_less_request(self):
         invoice_url = reverse('accountant:invoice_detail', kwargs={'pk': 3})
         client = Client()
@@ -281,3 +764,406 @@ class SmsTestCase(TestCase):
         self.assertEqual(created_transaction.account, self.card)
         self.assertEqual(created_transaction.invoice, created_invoice)
         self.assertEqual(created_transaction.comment, self.receiver)
+
+    def test_closed_period(self):
+        PeriodClose.close(self.datetime.date())
+        invoices_count = Invoice.objects.count()
+
+        response = self.__get_response()
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('is closed',
+                      json.loads(response.content.decode())['message'])
+        self.assertEqual(Invoice.objects.count(), invoices_count)
+
+
+class StatementImportViewTestCase(TestCase):
+    invoice_path = join(dirname(abspath(__file__)), 'test_fns_invoice.json')
+
+    @classmethod
+    def setUpTestData(cls):
+        add_test_data(cls)
+
+    def setUp(self):
+        self.client = Client()
+        self.client.login(username=self.test_user.username,
+                          password=self.test_user_password)
+        self.media = TemporaryDirectory()
+        self.settings = override_settings(
+            MEDIA_ROOT=self.media.name,
+            DEFAULT_EXPENSE=self.expenses[0].pk,
+            DEFAULT_ACCOUNT=self.card.pk
+        )
+        self.settings.enable()
+
+    def tearDown(self):
+        self.settings.disable()
+        self.media.cleanup()
+        del self.client
+
+    def __get_response(self, name: str, content: bytes):
+        return self.client.post(
+            reverse('accountant:statement_import'),
+            {'statement': SimpleUploadedFile(name, content)}
+        )
+
+    def test_receipt(self):
+        with open(self.invoice_path, 'rb') as f:
+            content = f.read()
+        response = self.__get_response('receipt.json', content)
+        self.assertEqual(response.status_code, 200)
+        result = json.loads(response.content.decode())
+        invoice = Invoice.objects.get(pk=result['id'])
+        self.assertEqual(result['url'], reverse('accountant:invoice_edit',
+                                                kwargs={'pk': invoice.pk}))
+        self.assertEqual(invoice.documents.count(), 1)
+        self.assertTrue(invoice.transactions.filter(account=self.card)
+                        .exists())
+
+        self.assertEqual(result['fiscal_id'],
+                         ['8710000101057618', 35054, 2223338679])
+
+        response = self.__get_response('receipt.json', content)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(json.loads(response.content.decode())['duplicates'],
+                         [{'id': invoice.pk, 'url': invoice.get_absolute_url()}])
+
+        receipt = json.loads(content.decode())
+        receipts = [dict(receipt, fiscalDocumentNumber=number)
+                    for number in (1, 2)]
+        response = self.__get_response(
+            'receipts.json', json.dumps(receipts + [receipt]).encode()
+        )
+        self.assertEqual(response.status_code, 200)
+        result = json.loads(response.content.decode())
+        self.assertEqual(len(result['invoices']), 2)
+        self.assertEqual([i['id'] for i in result['duplicates']], [invoice.pk])
+
+    def test_closed_period(self):
+        PeriodClose.close(date(2017, 10, 31))
+        invoices_count = Invoice.objects.count()
+        documents_count = Document.objects.count()
+        with open(self.invoice_path, 'rb') as f:
+            response = self.__get_response('receipt.json', f.read())
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('is closed',
+                      json.loads(response.content.decode())['message'])
+        self.assertEqual(Invoice.objects.count(), invoices_count)
+        self.assertEqual(Document.objects.count(), documents_count)
+
+    def test_not_receipt(self):
+        response = self.__get_response('photo.jpg', b'\xff\xd8\xff\xe0')
+        self.assertEqual(response.status_code, 400)
+        result = json.loads(response.content.decode())
+        self.assertIsNone(result['document']['invoice'])
+
+
+class ReceiptImportViewTestCase(TestCase):
+    invoice_path = join(dirname(abspath(__file__)), 'test_fns_invoice.json')
+
+    @classmethod
+    def setUpTestData(cls):
+        add_test_data(cls)
+
+    def setUp(self):
+        self.client = Client()
+        self.client.login(username=self.test_user.username,
+                          password=self.test_user_password)
+        self.media = TemporaryDirectory()
+        self.settings = override_settings(
+            MEDIA_ROOT=self.media.name,
+            DEFAULT_EXPENSE=self.expenses[0].pk,
+            DEFAULT_ACCOUNT=self.card.pk,
+            RECEIPT_IMPORT_BACKGROUND=False,
+            RECEIPT_IMPORT_WORKERS=1
+        )
+        self.settings.enable()
+
+    def tearDown(self):
+        self.settings.disable()
+        self.media.cleanup()
+        del self.client
+
+    def test_import(self):
+        with open(self.invoice_path, 'rb') as f:
+            content = f.read()
+        response = self.client.post(
+            reverse('accountant:receipt_import'),
+            {'archive': SimpleUploadedFile(
+                'receipts.ndjson', content.replace(b'\n', b'') + b'\n{]')}
+        )
+        self.assertEqual(response.status_code, 202)
+        result = json.loads(response.content.decode())
+        self.assertEqual(result['status'], ImportJob.DONE)
+        self.assertEqual((result['imported'], result['failed']), (1, 1))
+
+        response = self.client.get(result['url'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content.decode())['errors'],
+                         result['errors'])
+
+        response = self.client.get(reverse('accountant:receipt_import'))
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'receipts')
+
+    def test_foreign_job(self):
+        job = ImportJob.objects.create(
+            user=User.objects.create_user('spock', password='vulcan'),
+            document=Document.objects.create(file=None, description='')
+        )
+        response = self.client.get(reverse('accountant:import_job',
+                                           kwargs={'pk': job.pk}))
+        self.assertEqual(response.status_code, 404)
+
+    def test_stale_job(self):
+        job = ImportJob.objects.create(
+            user=self.test_user, status=ImportJob.RUNNING,
+            document=Document.objects.create(file=None, description='')
+        )
+        url = reverse('accountant:import_job', kwargs={'pk': job.pk})
+        response = self.client.get(url)
+        self.assertEqual(json.loads(response.content.decode())['status'],
+                         ImportJob.RUNNING)
+
+        ImportJob.objects.filter(pk=job.pk)\
+            .update(updated=now() - timedelta(hours=1))
+        response = self.client.get(url)
+        self.assertEqual(json.loads(response.content.decode())['status'],
+                         ImportJob.FAILED)
+
+    def test_no_archive(self):
+        response = self.client.post(reverse('accountant:receipt_import'))
+        self.assertEqual(response.status_code, 400)
+
+
+class TransactionImportViewTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        add_test_data(cls)
+
+    def setUp(self):
+        self.client = Client()
+        self.client.login(username=self.test_user.username,
+                          password=self.test_user_password)
+        self.payload = {'invoices': [
+            {
+                'timestamp': '2017-10-15 22:38:00',
+                'comment': 'Supermarket',
+                'transactions': [
+                    {'date': '2017-10-15', 'account': self.card.pk,
+                     'amount': '-100.50', 'currency': 'RUB'},
+                    {'date': '2017-10-15', 'account': self.expenses[0].pk,
+                     'amount': '60.50', 'currency': 'RUB',
+                     'quantity': '2', 'unit': 'l', 'comment': 'АИ-95'},
+                    {'date': '2017-10-15', 'account': self.expenses[1].pk,
+                     'amount': '40', 'currency': 'RUB'},
+                ]
+            },
+            {
+                'timestamp': '2017-10-16 10:00:00',
+                'transactions': [
+                    {'date': '2017-10-16', 'account': self.card.pk,
+                     'amount': '-10', 'currency': 'RUB'},
+                    {'date': '2017-10-16', 'account': self.expenses[1].pk,
+                     'amount': '10', 'currency': 'RUB'},
+                ]
+            }
+        ]}
+
+    def tearDown(self):
+        del self.client
+        del self.payload
+
+    def __get_response(self):
+        return self.client.post(reverse('accountant:transaction_import'),
+                                data=json.dumps(self.payload),
+                                content_type='application/json')
+
+    def test_import(self):
+        response = self.__get_response()
+        self.assertEqual(response.status_code, 200)
+
+        response_json = json.loads(response.content.decode())
+        self.assertEqual(response_json['transactions'], 5)
+        invoices = Invoice.objects.filter(pk__in=response_json['invoices'])
+        self.assertEqual(len(invoices), 2)
+        for invoice in invoices:
+            self.assertTrue(invoice.is_verified)
+            self.assertEqual(invoice.user, self.test_user)
+        self.assertEqual(self.card.sheaves.get(currency='RUB').amount,
+                         Decimal('-110.50'))
+
+    def test_import_with_unknown_account(self):
+        self.payload['invoices'][1]['transactions'][0]['account'] = 100500
+        invoices_count = Invoice.objects.count()
+        response = self.__get_response()
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Invoice.objects.count(), invoices_count)
+
+    def test_import_to_closed_period(self):
+        PeriodClose.close(date(2017, 10, 15))
+        invoices_count = Invoice.objects.count()
+
+        self.assertEqual(self.__get_response().status_code, 400)
+        self.assertEqual(Invoice.objects.count(), invoices_count)
+
+    def test_import_with_wrong_currency(self):
+        self.payload['invoices'][0]['transactions'][0]['currency'] = 'QQQ'
+
+        self.assertEqual(self.__get_response().status_code, 400)
+
+    def test_login_less_request(self):
+        client = Client()
+        response = client.post(reverse('accountant:transaction_import'))
+        self.assertEqual(response.status_code, 302)
+
+
+@override_settings(LEDGER_VERIFICATION_WORKERS=1)
+class LedgerVerificationViewTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        add_test_data(cls)
+
+    def setUp(self):
+        self.client = Client()
+        self.client.login(username=self.test_user.username,
+                          password=self.test_user_password)
+
+    def tearDown(self):
+        del self.client
+
+    def test_not_staff_request(self):
+        response = self.client.get(reverse('accountant:ledger_verification'))
+        self.assertEqual(response.status_code, 302)
+        self.assertNotIn('report', response.context or {})
+
+    def test_report(self):
+        self.test_user.is_staff = True
+        self.test_user.save()
+        response = self.client.get(reverse('accountant:ledger_verification'))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.context['report'].mismatches)
+
+    def test_repair(self):
+        self.test_user.is_staff = True
+        self.test_user.save()
+        response = self.client.post(reverse('accountant:ledger_verification'))
+
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse(self.wallet.sheaves.filter(currency='EUR').exists())
+
+
+class ExportViewTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        add_test_data(cls)
+
+    def setUp(self):
+        self.client = Client()
+        self.client.login(username=self.test_user.username,
+                          password=self.test_user_password)
+
+    def tearDown(self):
+        del self.client
+
+    def __get_response(self, **parameters):
+        return self.client.get(reverse('accountant:export'), parameters)
+
+    def test_csv(self):
+        response = self.__get_response(account=self.cash.pk,
+                                       start='2015-03-01')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Disposition'],
+                         'attachment; filename="frekenbok.csv"')
+        rows = list(csv.DictReader(StringIO(
+            b''.join(response.streaming_content).decode()
+        )))
+        self.assertEqual(
+            len(rows),
+            Transaction.objects.filter(
+                account__in=Account.get_tree(Account.objects.get(pk=self.cash.pk)),
+                date__gte=date(2015, 3, 1)
+            ).count()
+        )
+
+    def test_formats(self):
+        for format, content_type in (('ofx', 'application/x-ofx'),
+                                     ('beancount', 'text/plain')):
+            response = self.__get_response(format=format)
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(response['Content-Type'].startswith(content_type))
+            self.assertTrue(b''.join(response.streaming_content))
+
+    def test_bad_request(self):
+        self.assertEqual(self.__get_response(format='xls').status_code, 400)
+        self.assertEqual(self.__get_response(end='2015-13-01').status_code,
+                         400)
+        self.assertEqual(self.__get_response(account='cash').status_code, 400)
+        self.assertEqual(self.__get_response(account=0).status_code, 404)
+
+    def test_login_less_request(self):
+        response = Client().get(reverse('accountant:export'))
+        self.assertEqual(response.status_code, 302)
+
+
+class AccountSeriesViewTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        add_test_data(cls)
+
+    def setUp(self):
+        self.client = Client()
+        self.client.login(username=self.test_user.username,
+                          password=self.test_user_password)
+
+    def tearDown(self):
+        del self.client
+
+    def __get_response(self, **parameters):
+        return self.client.get(
+            reverse('accountant:account_series', args=(self.cash.pk,)),
+            parameters
+        )
+
+    def test_balance(self):
+        response = self.__get_response(start='2015-03-01', end='2015-08-31',
+                                       granularity='month')
+        self.assertEqual(response.status_code, 200)
+
+        response_json = json.loads(response.content.decode())
+        self.assertEqual(len(response_json['series']), 6)
+        self.assertEqual(response_json['series'][-1]['date'], '2015-08-31')
+        self.assertEqual(
+            {currency: Decimal(amount) for currency, amount
+             in response_json['series'][-1]['values'].items()},
+            Account.objects.get(pk=self.cash.pk)
+                .balance_history([date(2015, 8, 31)])[0]
+        )
+
+    @override_settings(SERIES_MAX_POINTS=20)
+    def test_downsampling(self):
+        response = self.__get_response(start='2015-03-01', points=100)
+        response_json = json.loads(response.content.decode())
+
+        self.assertLessEqual(len(response_json['series']), 20)
+        self.assertEqual(response_json['series'][-1]['date'],
+                         date.today().isoformat())
+
+    def test_bad_request(self):
+        self.assertEqual(self.__get_response(kind='total').status_code, 400)
+        self.assertEqual(self.__get_response(start='2015-13-01').status_code,
+                         400)
+        self.assertEqual(
+            self.__get_response(start='2016-01-01', end='2015-01-01')
+                .status_code,
+            400
+        )
+
+    def test_login_less_request(self):
+        client = Client()
+        response = client.get(reverse('accountant:account_series',
+                                      args=(self.cash.pk,)))
+        self.assertEqual(response.status_code, 302)
@@ -6,13 +6,22 @@ from accountant.views.invoice_create_or_edit_view import InvoiceCreateOrEditView
 from accountant.views.invoice_detail_view import InvoiceDetailView
 from accountant.views.invoice_list_view import InvoiceListView
 from accountant.views.account_detail_view import AccountDetailView
+from accountant.views.account_series_view import AccountSeriesView
 from accountant.views.income_list_view import IncomeListView
 from accountant.views.expense_list_view import ExpenseListView
+from accountant.views.export_view import ExportView
 from accountant.views.account_list_view import AccountListView
+from accountant.views.search_view import SearchView
+from accountant.views.receipt_import_view import ReceiptImportView, \
+    ImportJobView
 from accountant.views.statement_import_view import StatementImportView
+from accountant.views.transaction_import_view import TransactionImportView
+from accountant.views.transaction_list_view import TransactionListView
+from accountant.views.ledger_verification_view import LedgerVerificationView
 
 urlpatterns = [
     url(r'^incomes/', IncomeListView.as_view(), name='income_list'),
+    url(r'^accounts/(?P<pk>[0-9]+)/series/', AccountSeriesView.as_view(), name='account_series'),
     url(r'^accounts/(?P<pk>[0-9]+)/', AccountDetailView.as_view(), name='account_detail'),
     url(r'^accounts/', AccountListView.as_view(), name='account_list'),
     url(r'^incomes/', IncomeListView.as_view(), name='income_list'),
@@ -21,10 +30,17 @@ urlpatterns = [
     url(r'^invoices/(?P<pk>[0-9]+)/edit/', InvoiceCreateOrEditView.as_view(), name='invoice_edit'),
     url(r'^invoices/(?P<pk>[0-9]+)/', InvoiceDetailView.as_view(), name='invoice_detail'),
     url(r'^invoices/', InvoiceListView.as_view(), name='invoice_list'),
+    url(r'^export/', ExportView.as_view(), name='export'),
+    url(r'^search/', SearchView.as_view(), name='search'),
     url(r'^sms/', sms, name='sms'),
     url(r'^recalculate/', recalculate_request, name='recalculate'),
+    url(r'^verify/', LedgerVerificationView.as_view(), name='ledger_verification'),
     url(r'^document/upload', document_upload, name='document_upload'),
     url(r'^document/(?P<pk>[0-9]+)/delete', document_delete, name='document_delete'),
+    url(r'^receipts/import/(?P<pk>[0-9]+)/', ImportJobView.as_view(), name='import_job'),
+    url(r'^receipts/import/', ReceiptImportView.as_view(), name='receipt_import'),
     url(r'^statement_import/', StatementImportView.as_view(), name='statement_import'),
+    url(r'^transactions/import/', TransactionImportView.as_view(), name='transaction_import'),
+    url(r'^transactions/', TransactionListView.as_view(), name='transaction_list'),
     url(r'^bot', include('django_telegrambot.urls')),
 ]
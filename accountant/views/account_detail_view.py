@@ -1,10 +1,17 @@
 import logging
-from datetime import date, timedelta
+from collections import OrderedDict
+from datetime import date, datetime, timedelta
+from decimal import Decimal
 
+from django.conf import settings
 from django.contrib.auth.mixins import LoginRequiredMixin
-from django.db.models import Sum
+from django.core.paginator import InvalidPage
+from django.db.models import Sum, Case, When, F, Value, DecimalField
+from django.http import Http404
+from django.utils.translation import ugettext_lazy as _
 from django.views.generic import DetailView
 
+from accountant.misc.paginator import CursorPaginator
 from accountant.models import Account, Transaction
 
 logger = logging.getLogger(__name__)
@@ -14,42 +21,115 @@ class AccountDetailView(LoginRequiredMixin, DetailView):
     model = Account
     context_object_name = 'account'
     template_name = 'accountant/account_detail.html'
+    DATE_FORMAT = '%Y-%m-%d'
 
-    def get_context_data(self, **kwargs):
-        today = date.today()
+    @property
+    def paginate_by(self):
+        return getattr(settings, 'ACCOUNT_HISTORY_PAGE_SIZE', 20)
+
+    def get_periods(self, today: date):
+        """
+        Method returns ordered dictionary with periods shown on the page,
+        custom period is taken from `start` and `end` GET parameters.
+        :return: OrderedDict with names as keys and (title, first date, last
+         date) tuples as values
+        """
         start_of_month = today.replace(day=1)
+        next_month = (start_of_month + timedelta(days=32)).replace(day=1)
         prev_month_end = start_of_month - timedelta(days=1)
-        prev_month_start = prev_month_end.replace(day=1)
+        periods = OrderedDict((
+            ('this_month', (_('This month'), start_of_month,
+                            next_month - timedelta(days=1))),
+            ('prev_month', (_('Previous month'), prev_month_end.replace(day=1),
+                            prev_month_end)),
+            ('year_to_date', (_('Year to date'), today.replace(month=1, day=1),
+                              today)),
+        ))
+        try:
+            if 'start' in self.request.GET and 'end' in self.request.GET:
+                periods['custom'] = (
+                    _('Custom period'),
+                    datetime.strptime(self.request.GET['start'],
+                                      self.DATE_FORMAT).date(),
+                    datetime.strptime(self.request.GET['end'],
+                                      self.DATE_FORMAT).date()
+                )
+        except ValueError:
+            logger.warning('Wrong custom period {}'.format(self.request.GET))
+        return periods
+
+    @staticmethod
+    def get_period_totals(accounts, periods: OrderedDict):
+        """
+        Method calculates sums of approved transactions of accounts for every
+        period with one query using conditional aggregation.
+        :return: dictionary with names of periods as keys and lists of
+         dictionaries with currency and amount as values
+        """
+        rows = Transaction.objects\
+            .filter(account__in=accounts, approved=True)\
+            .filter(date__gte=min(i[1] for i in periods.values()),
+                    date__lte=max(i[2] for i in periods.values()))\
+            .values('currency')\
+            .annotate(**{
+                name: Sum(Case(When(date__gte=start, date__lte=end,
+                                    then=F('amount')),
+                               default=Value(Decimal(0)),
+                               output_field=DecimalField()))
+                for name, (title, start, end) in periods.items()
+            })\
+            .order_by('currency')
+        result = {name: list() for name in periods}
+        for row in rows:
+            for name in periods:
+                if row[name]:
+                    result[name].append({'currency': row['currency'],
+                                         'amount': row[name]})
+        return result
+
+    def get_history(self, accounts):
+        """
+        Method returns page of transactions of accounts, latest first. Pages
+        are addressed by (date, id) cursors, so any page is found by index
+        seek instead of OFFSET scan.
+        """
+        paginator = CursorPaginator(
+            Transaction.objects
+                .filter(account__in=accounts)
+                .select_related('account', 'invoice')
+                .prefetch_related('invoice__transactions__account'),
+            self.paginate_by,
+            ordering=('-date', '-pk')
+        )
+        try:
+            return paginator.page(self.request.GET.get('cursor'))
+        except InvalidPage as e:
+            raise Http404(str(e))
 
+    def get_context_data(self, **kwargs):
+        today = date.today()
         context = super(AccountDetailView, self).get_context_data(**kwargs)
-        context['transaction_list'] = \
-            Transaction.objects.filter(account=self.object)\
-                .order_by('-date')[:10]
+        accounts = Account.get_tree(self.object)
+
+        context['page_obj'] = self.get_history(accounts)
+        context['transaction_list'] = context['page_obj'].object_list
 
         context['total_quantity'] = \
-            Transaction.objects.filter(account=self.object)\
+            Transaction.objects.filter(account__in=accounts)\
                 .values('unit')\
                 .annotate(quantity=Sum('quantity'))\
                 .filter(quantity__isnull=False)\
                 .order_by('quantity')
 
-        context['this_month'] = \
-            Transaction.objects.filter(account=self.object) \
-                .filter(approved=True, date__gte=start_of_month) \
-                .values('currency') \
-                .annotate(amount=Sum('amount')) \
-                .order_by('currency')
-
-        context['prev_month'] = \
-            Transaction.objects.filter(account=self.object) \
-                .filter(approved=True) \
-                .filter(date__gte=prev_month_start, date__lt=start_of_month) \
-                .values('currency') \
-                .annotate(amount=Sum('amount')) \
-                .order_by('currency')
-
-        context['start_of_month'] = start_of_month
-        context['prev_month_start'] = prev_month_start
-        context['prev_month_end'] = prev_month_end
+        periods = self.get_periods(today)
+        totals = self.get_period_totals(accounts, periods)
+        context['periods'] = [
+            {'name': name, 'title': title, 'start': start, 'end': end,
+             'totals': totals[name]}
+            for name, (title, start, end) in periods.items()
+        ]
+
+        context['series_start'] = today.replace(day=1, year=today.year - 3)
+        context['base_currency'] = settings.BASE_CURRENCY
 
         return context
@@ -5,16 +5,18 @@ from django.contrib.auth.mixins import LoginRequiredMixin
 from django.db.models import Q
 from django.views.generic import ListView
 
+from accountant.misc.caching import LedgerCacheMixin
 from accountant.models import Account
 
 logger = logging.getLogger(__name__)
 
 
-class AccountListView(LoginRequiredMixin, ListView):
+class AccountListView(LoginRequiredMixin, LedgerCacheMixin, ListView):
     model = Account
     context_object_name = 'account_list'
     template_name = 'accountant/account_list.html'
 
     def get_queryset(self):
         return self.model.objects.filter(type=Account.ACCOUNT) \
-            .filter(Q(closed__gte=date.today()) | Q(closed=None))
\ No newline at end of file
+            .filter(Q(closed__gte=date.today()) | Q(closed=None)) \
+            .with_sheaves()
\ No newline at end of file
@@ -0,0 +1,79 @@
+import logging
+from datetime import date, datetime, timedelta
+
+from django.conf import settings
+from django.contrib.auth.mixins import LoginRequiredMixin
+from django.http import HttpRequest, JsonResponse
+from django.shortcuts import get_object_or_404
+from django.views.generic import View
+
+from accountant.misc import series
+from accountant.models import Account
+
+logger = logging.getLogger(__name__)
+
+
+class AccountSeriesView(LoginRequiredMixin, View):
+    """
+    JSON API with balance or flow time series of account and all its child
+    accounts. Query parameters:
+
+    * start and end — dates like 2017-10-15, last 30 days by default;
+    * granularity — day, week or month;
+    * kind — balance (at the end of every period) or flow (sum of
+      transactions inside of period);
+    * points — maximum number of points, longer series are downsampled, it
+      can't exceed SERIES_MAX_POINTS setting.
+
+    Response looks like this one:
+
+    {"account": 1, "granularity": "day", "kind": "balance",
+     "series": [{"date": "2017-10-15", "values": {"RUB": "618.89"}}]}
+    """
+    DATE_FORMAT = '%Y-%m-%d'
+
+    @property
+    def max_points(self):
+        return getattr(settings, 'SERIES_MAX_POINTS', 500)
+
+    def get_parameters(self, query):
+        end = datetime.strptime(query['end'], self.DATE_FORMAT).date() \
+            if 'end' in query else date.today()
+        start = datetime.strptime(query['start'], self.DATE_FORMAT).date() \
+            if 'start' in query else end - timedelta(days=29)
+        if start > end:
+            raise ValueError('start {} is after end {}'.format(start, end))
+        points = min(int(query.get('points', self.max_points)),
+                     self.max_points)
+        if points < 1:
+            raise ValueError('points should be positive')
+        return {
+            'start': start,
+            'end': end,
+            'granularity': query.get('granularity', series.DAY),
+            'kind': query.get('kind', series.BALANCE),
+            'max_points': points
+        }
+
+    def get(self, request: HttpRequest, pk, *args, **kwargs):
+        account = get_object_or_404(Account, pk=pk)
+        try:
+            parameters = self.get_parameters(request.GET)
+            points = series.series(Account.get_tree(account), **parameters)
+        except ValueError as e:
+            logger.warning('Bad series request for account {}: {}'
+                           .format(pk, e))
+            return JsonResponse({'status': 'error', 'message': str(e)},
+                                status=400)
+
+        return JsonResponse({
+            'account': account.pk,
+            'granularity': parameters['granularity'],
+            'kind': parameters['kind'],
+            'series': [
+                {'date': period_end.isoformat(),
+                 'values': {currency: str(amount)
+                            for currency, amount in values.items()}}
+                for period_end, values in points
+            ]
+        })
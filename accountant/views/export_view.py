@@ -0,0 +1,64 @@
+import logging
+from datetime import datetime
+
+from django.contrib.auth.mixins import LoginRequiredMixin
+from django.http import HttpRequest, JsonResponse, StreamingHttpResponse
+from django.shortcuts import get_object_or_404
+from django.views.generic import View
+
+from accountant.misc import export
+from accountant.models import Account
+
+logger = logging.getLogger(__name__)
+
+
+class ExportView(LoginRequiredMixin, View):
+    """
+    Streaming export of transactions to file. Query parameters:
+
+    * format — csv (default), ofx or beancount;
+    * account — primary key of account which subtree is exported;
+    * start and end — dates like 2017-10-15;
+    * currency — code of currency like RUB.
+
+    Beancount entries are whole invoices, filters select invoices then.
+
+    Rows are read from database with chunked cursor and written to response
+    one by one, so big ledgers are exported with constant memory.
+    """
+    DATE_FORMAT = '%Y-%m-%d'
+    EXTENSIONS = {export.CSV: 'csv', export.OFX: 'ofx',
+                  export.BEANCOUNT: 'beancount'}
+
+    def get_filters(self, query):
+        filters = dict()
+        if query.get('account'):
+            filters['account'] = get_object_or_404(Account,
+                                                   pk=int(query['account']))
+        for name in ('start', 'end'):
+            if query.get(name):
+                filters[name] = datetime.strptime(query[name],
+                                                  self.DATE_FORMAT).date()
+        if query.get('currency'):
+            filters['currency'] = query['currency'].upper()
+        return filters
+
+    def get(self, request: HttpRequest, *args, **kwargs):
+        format = request.GET.get('format', export.CSV)
+        try:
+            if format not in export.FORMATS:
+                raise ValueError('unknown format {}'.format(format))
+            filters = self.get_filters(request.GET)
+        except ValueError as e:
+            logger.warning('Bad export request {}: {}'
+                           .format(request.GET.dict(), e))
+            return JsonResponse({'status': 'error', 'message': str(e)},
+                                status=400)
+
+        response = StreamingHttpResponse(
+            export.export(format, **filters),
+            content_type=export.CONTENT_TYPES[format]
+        )
+        response['Content-Disposition'] = \
+            'attachment; filename="frekenbok.{}"'.format(self.EXTENSIONS[format])
+        return response
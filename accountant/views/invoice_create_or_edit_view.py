@@ -13,17 +13,21 @@ from django.db import transaction
 from django.http import HttpRequest
 from django.views.generic.base import TemplateView
 
-from accountant.models import Invoice, Account, Transaction, Document
+from accountant.misc.registry import get_registry
+from accountant.models import Invoice, Transaction, Document, \
+    ClosedPeriodError
 
 logger = logging.getLogger(__name__)
 
 
 class InvoiceCreateOrEditView(LoginRequiredMixin, TemplateView):
     template_name = 'accountant/invoice_create_or_edit.html'
+    TRANSACTION_FIELDS = ('date', 'amount', 'currency', 'quantity', 'unit',
+                          'comment', 'account')
 
     def __init__(self, **kwargs):
         super(InvoiceCreateOrEditView, self).__init__(**kwargs)
-        self.accounts = {i.pk: i for i in Account.objects.all()}
+        self.accounts = get_registry().by_pk
 
     def get_context_data(self, pk: int = None, **kwargs):
         if pk is not None:
@@ -39,8 +43,7 @@ class InvoiceCreateOrEditView(LoginRequiredMixin, TemplateView):
                 'transactions': tuple(),
                 'documents': tuple()
             }
-        # TODO There should be another way to get sorted tree
-        context['accounts'] = Account.objects.order_by('tree_id', 'lft').all()
+        context['accounts'] = get_registry().tree
         context['base_currency'] = settings.BASE_CURRENCY
         return context
 
@@ -80,7 +83,7 @@ class InvoiceCreateOrEditView(LoginRequiredMixin, TemplateView):
         :param request: HttpRequest with proper formed POST
         :return: generator with tuples
         """
-        self.accounts = {i.pk: i for i in Account.objects.all()}
+        self.accounts = get_registry().by_pk
         return map(
             partial(self.transaction_data_to_dict, invoice=invoice),
             filter(
@@ -98,38 +101,87 @@ class InvoiceCreateOrEditView(LoginRequiredMixin, TemplateView):
             )
         )
 
+    @staticmethod
+    def get_state(tx: Transaction):
+        return (tx.date, Decimal(tx.amount), str(tx.currency), tx.quantity,
+                tx.unit or None, tx.comment, tx.account_id)
+
+    @staticmethod
+    def save_transactions(invoice: Invoice, lines):
+        """
+        Method compares submitted lines with existing transactions of the
+         invoice and saves them with one bulk insert, one bulk update and one
+         bulk delete. Transactions without line in the form are deleted.
+        :param invoice: saved invoice
+        :param lines: iterable with tuples like `transaction_data_to_dict`
+         returns
+        """
+        existing = {i.pk: i for i in Transaction.objects.filter(invoice=invoice)}
+        new = list()
+        changed = list()
+        for pk, data in lines:
+            tx = existing.pop(pk, None)
+            if tx is None:
+                new.append(Transaction(**data))
+                continue
+            old_state = InvoiceCreateOrEditView.get_state(tx)
+            for field, value in data.items():
+                setattr(tx, field, value)
+            if InvoiceCreateOrEditView.get_state(tx) != old_state:
+                changed.append(tx)
+
+        Transaction.objects.filter(pk__in=list(existing)).delete()
+        Transaction.objects.bulk_update(
+            changed, InvoiceCreateOrEditView.TRANSACTION_FIELDS)
+        Transaction.objects.bulk_create(new)
+        logger.info('{} transactions of invoice {} created, {} changed and {} '
+                    'deleted'.format(len(new), invoice, len(changed),
+                                     len(existing)))
+
     # noinspection PyCallByClass,PyArgumentList
-    @transaction.atomic
     def post(self, request: HttpRequest, pk: int=None, *args, **kwargs):
         logger.debug('Trying to create or update invoice with pk {}'.format(pk))
         if request.POST.get('invoice-timestamp'):
-            timestamp = settings.DEFAULT_TZ\
-                .localize(parse(request.POST['invoice-timestamp']))
-            invoice, created = Invoice.objects.update_or_create(
-                pk=int(pk) if pk else None,
-                defaults={
-                    'timestamp': timestamp,
-                    'comment': request.POST['invoice-comment'],
-                    'user': request.user
-                }
-            )
-            logger.info('Invoice {} was {}'.format(
-                invoice, 'created' if created else 'found'))
-
-            for pk, defaults in self.get_transactions_data(request, invoice):
-                tx, created = Transaction.objects.update_or_create(
-                    pk=pk, defaults=defaults
-                )
-                logger.info('Transaction {} was {}'.format(
-                    tx, 'created' if created else 'found'))
-
-            counter = Document.objects\
-                .filter(pk__in=request.POST.getlist('document'))\
-                .update(invoice=invoice)
-            logger.info('{} documents attached to invoice {}'.format(
-                counter, invoice
-            ))
-
+            try:
+                with transaction.atomic():
+                    invoice = self.save_invoice(request, pk)
+            except ClosedPeriodError as e:
+                # nothing is saved, the form is shown again with the reason
+                logger.error('Invoice {} is not saved: {}'.format(pk, e))
+                context = self.get_context_data(pk=pk, **kwargs)
+                context['errors'] = e.messages
+                return self.render_to_response(context, status=400)
             return redirect(invoice.get_absolute_url())
         else:
             return self.get(request, *args, **kwargs)
+
+    def save_invoice(self, request: HttpRequest, pk: int=None):
+        """
+        Method saves submitted invoice with its transactions and attaches
+         submitted documents to it.
+        :raise ClosedPeriodError: if transactions are dated by closed period
+        :return: saved invoice
+        """
+        timestamp = settings.DEFAULT_TZ\
+            .localize(parse(request.POST['invoice-timestamp']))
+        invoice, created = Invoice.objects.update_or_create(
+            pk=int(pk) if pk else None,
+            defaults={
+                'timestamp': timestamp,
+                'comment': request.POST['invoice-comment'],
+                'user': request.user
+            }
+        )
+        logger.info('Invoice {} was {}'.format(
+            invoice, 'created' if created else 'found'))
+
+        self.save_transactions(
+            invoice, self.get_transactions_data(request, invoice))
+
+        counter = Document.objects\
+            .filter(pk__in=request.POST.getlist('document'))\
+            .update(invoice=invoice)
+        logger.info('{} documents attached to invoice {}'.format(
+            counter, invoice
+        ))
+        return invoice
@@ -11,4 +11,16 @@ logger = logging.getLogger(__name__)
 class InvoiceDetailView(LoginRequiredMixin, DetailView):
     model = Invoice
     context_object_name = 'invoice'
-    template_name = 'accountant/invoice_detail.html'
\ No newline at end of file
+    template_name = 'accountant/invoice_detail.html'
+
+    def get_queryset(self):
+        return Invoice.objects\
+            .select_related('user')\
+            .prefetch_related('documents')
+
+    def get_object(self, queryset=None):
+        # groups of transactions, P&L and imbalance shown on the page are
+        # calculated in memory from one fetch of transactions
+        return super(InvoiceDetailView, self)\
+            .get_object(queryset)\
+            .fetch_transactions()
@@ -1,15 +1,32 @@
 import logging
 
 from django.contrib.auth.mixins import LoginRequiredMixin
+from django.db.models import Prefetch
 from django.views.generic import ListView
 
-from accountant.models import Invoice
+from accountant.misc.caching import LedgerCacheMixin
+from accountant.misc.paginator import CursorPaginationMixin
+from accountant.models import Invoice, Transaction
 
 logger = logging.getLogger(__name__)
 
 
-class InvoiceListView(LoginRequiredMixin, ListView):
+class InvoiceListView(LoginRequiredMixin, LedgerCacheMixin,
+                      CursorPaginationMixin, ListView):
     model = Invoice
     context_object_name = 'invoice_list'
     template_name = 'accountant/invoice_list.html'
-    paginate_by = 20
\ No newline at end of file
+    paginate_by = 20
+    ordering = ('-timestamp', '-pk')
+
+    def get_queryset(self):
+        # transactions of the whole page are fetched with one query, so
+        # P&L and verification status are calculated in memory
+        transactions = Transaction.objects\
+            .select_related('account')\
+            .order_by('date', 'pk')
+        return Invoice.objects\
+            .select_related('user')\
+            .prefetch_related(Prefetch('transactions',
+                                       queryset=transactions,
+                                       to_attr='_transactions'))
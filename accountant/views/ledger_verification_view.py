@@ -0,0 +1,36 @@
+import logging
+
+from django.conf import settings
+from django.contrib.auth.mixins import LoginRequiredMixin, \
+    UserPassesTestMixin
+from django.http import HttpRequest
+from django.shortcuts import redirect
+from django.urls import reverse
+from django.views.generic import TemplateView
+
+from accountant.misc import ledger
+
+logger = logging.getLogger(__name__)
+
+
+class LedgerVerificationView(LoginRequiredMixin, UserPassesTestMixin,
+                             TemplateView):
+    template_name = 'accountant/ledger_verification.html'
+
+    @property
+    def workers(self):
+        return getattr(settings, 'LEDGER_VERIFICATION_WORKERS', 4)
+
+    def test_func(self):
+        return self.request.user.is_staff
+
+    def get_context_data(self, **kwargs):
+        context = super(LedgerVerificationView, self).get_context_data(**kwargs)
+        context['report'] = ledger.verify(workers=self.workers)
+        return context
+
+    def post(self, request: HttpRequest, *args, **kwargs):
+        report = ledger.verify(workers=self.workers, repair=True)
+        logger.info('Ledger repaired by {}, {} wrong balances found'
+                    .format(request.user, len(report.mismatches)))
+        return redirect(reverse('accountant:ledger_verification'))
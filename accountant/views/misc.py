@@ -9,7 +9,10 @@ from django.shortcuts import redirect
 from django.urls import reverse
 from django.views.decorators.csrf import csrf_exempt
 
-from accountant.models import Account, Invoice, Transaction, Document
+from accountant.misc import ledger
+from accountant.misc.registry import get_registry
+from accountant.models import Invoice, Transaction, Document, \
+    ClosedPeriodError
 
 logger = logging.getLogger(__name__)
 
@@ -35,7 +38,7 @@ def sms(request: HttpRequest):
     regexp = parser['regexp']
     parsed_message = regexp.search(message['text']).groupdict()
 
-    account = Account.objects.filter(bank_title=parsed_message['account']).first()
+    account = get_registry().by_bank_title.get(parsed_message['account'])
     if account is None:
         logger.error('Account with bank_title {} not found'
                      .format(parsed_message['account']))
@@ -52,31 +55,43 @@ def sms(request: HttpRequest):
         )
     )
 
-    with transaction.atomic():
-        invoice = Invoice.objects.create(
-            timestamp=timestamp,
-            comment=message['text']
-        )
-        new_transaction = Transaction.objects.create(
-            invoice=invoice,
-            date=timestamp.date(),
-            account=account,
-            amount=amount,
-            currency=parsed_message['currency'],
-            comment=parsed_message['receiver']
-        )
+    try:
+        with transaction.atomic():
+            invoice = Invoice.objects.create(
+                timestamp=timestamp,
+                comment=message['text']
+            )
+            new_transaction = Transaction.objects.create(
+                invoice=invoice,
+                date=timestamp.date(),
+                account=account,
+                amount=amount,
+                currency=parsed_message['currency'],
+                comment=parsed_message['receiver']
+            )
+    except ClosedPeriodError as e:
+        logger.error('SMS {} is not saved: {}'.format(message, e))
+        return JsonResponse({'status': 'error',
+                             'message': '; '.join(e.messages)},
+                            status=400)
 
     logger.info('Added invoice {} and transaction {}'
                 .format(invoice, new_transaction))
+    if parsed_message.get('rest_amount') and \
+            parsed_message.get('rest_currency') == parsed_message['currency']:
+        rest_amount = Decimal(parsed_message['rest_amount'])
+        if rest_amount != new_transaction.balance:
+            logger.warning('Balance of {} is {} {}, but bank reports {}'
+                           .format(account, new_transaction.balance,
+                                   parsed_message['currency'], rest_amount))
     return JsonResponse({'status': 'ok',
                          'invoice': invoice.pk,
                          'transaction': new_transaction.pk})
 
 
-@transaction.atomic
 def recalculate_request(request: HttpRequest):
-    for account in Account.objects.all():
-        account.recalculate_summary(atomic=False)
+    diffs = ledger.rebuild()
+    logger.info('Ledger rebuilt, {} sheaves fixed'.format(len(diffs)))
     return redirect_to_referer(request, reverse('accountant:account_list'))
 
 
@@ -0,0 +1,53 @@
+import logging
+
+from django.contrib.auth.mixins import LoginRequiredMixin
+from django.http import HttpRequest, JsonResponse
+from django.shortcuts import get_object_or_404
+from django.urls import reverse
+from django.views.generic import TemplateView, View
+
+from accountant.misc import receipt_import
+from accountant.models import ImportJob
+
+logger = logging.getLogger(__name__)
+
+
+class ReceiptImportView(LoginRequiredMixin, TemplateView):
+    """
+    Bulk import of receipts from zip archive, JSON array or NDJSON file.
+    Import is run in background, response contains url of the job that can
+    be polled for progress and errors of separate receipts.
+    """
+    template_name = 'accountant/receipt_import.html'
+    JOBS = 20
+
+    def get_context_data(self, **kwargs):
+        context = super(ReceiptImportView, self).get_context_data(**kwargs)
+        receipt_import.fail_stale()
+        context['jobs'] = ImportJob.objects\
+            .filter(user=self.request.user)\
+            .select_related('document')[:self.JOBS]
+        return context
+
+    def post(self, request: HttpRequest, *args, **kwargs):
+        archive = request.FILES.get('archive')
+        if not archive:
+            return JsonResponse({'status': 'error', 'message': 'no archive'},
+                                status=400)
+        job = receipt_import.create(archive, request.user)
+        logger.info('Import of receipts from {} started by {}'
+                    .format(job.document, request.user))
+        receipt_import.start(job)
+        job.refresh_from_db()
+
+        result = job.json()
+        result['url'] = reverse('accountant:import_job',
+                                kwargs={'pk': job.pk})
+        return JsonResponse(result, status=202)
+
+
+class ImportJobView(LoginRequiredMixin, View):
+    def get(self, request: HttpRequest, pk: int, *args, **kwargs):
+        receipt_import.fail_stale()
+        job = get_object_or_404(ImportJob, pk=pk, user=request.user)
+        return JsonResponse(job.json())
@@ -0,0 +1,83 @@
+import logging
+
+from django.contrib.auth.mixins import LoginRequiredMixin
+from django.views.generic import ListView
+
+from accountant.misc import search
+from accountant.models import Transaction
+
+logger = logging.getLogger(__name__)
+
+
+class SearchView(LoginRequiredMixin, ListView):
+    """
+    Full-text search of transactions by their comments and comments of their
+    invoices. Query is taken from `q` GET parameter, found transactions can
+    be narrowed by `account`, `year`, `currency` and `amount` facets.
+    """
+    model = Transaction
+    context_object_name = 'transaction_list'
+    template_name = 'accountant/search.html'
+    paginate_by = 50
+    # GET parameters and names of facets they are chosen from
+    FACETS = (('account', 'accounts'), ('year', 'years'),
+              ('currency', 'currencies'), ('amount', 'amounts'))
+
+    def get_filters(self):
+        return {name: self.request.GET[name] for name, _ in self.FACETS
+                if self.request.GET.get(name)}
+
+    def filter(self, queryset, filters: dict):
+        try:
+            if 'account' in filters:
+                queryset = queryset.filter(account=int(filters['account']))
+            if 'year' in filters:
+                queryset = queryset.filter(date__year=int(filters['year']))
+            if 'currency' in filters:
+                queryset = queryset.filter(currency=filters['currency'])
+            if 'amount' in filters:
+                queryset = search.filter_amount(queryset, filters['amount'])
+        except ValueError as e:
+            logger.warning('Wrong search filter {}: {}'.format(filters, e))
+            return queryset.none()
+        return queryset
+
+    def get_queryset(self):
+        self.query = self.request.GET.get('q', '')
+        self.filters = self.get_filters()
+        queryset = self.filter(Transaction.objects.all(), self.filters)
+        self.facets = search.facets(search.match(self.query, queryset))
+        return search.search(self.query, queryset)\
+            .select_related('account', 'invoice')
+
+    def get_paginator(self, *args, **kwargs):
+        paginator = super(SearchView, self).get_paginator(*args, **kwargs)
+        # every found transaction falls into one year, so the year facet
+        # gives number of them without one more scan of the index
+        paginator.count = sum(i['count'] for i in self.facets['years'])
+        return paginator
+
+    def get_facet_url(self, name: str, value):
+        parameters = self.request.GET.copy()
+        parameters.pop('page', None)
+        if value is None:
+            parameters.pop(name, None)
+        else:
+            parameters[name] = value
+        return '?{}'.format(parameters.urlencode())
+
+    def get_context_data(self, **kwargs):
+        context = super(SearchView, self).get_context_data(**kwargs)
+        context['query'] = self.query
+        context['page_url'] = self.get_facet_url('page', None)
+        for key, name in self.FACETS:
+            for item in self.facets[name]:
+                item['url'] = self.get_facet_url(key, item[key])
+                item['active'] = str(item[key]) == self.filters.get(key)
+        context['facets'] = self.facets
+        context['filters'] = [
+            {'name': name, 'value': value,
+             'url': self.get_facet_url(name, None)}
+            for name, value in self.filters.items()
+        ]
+        return context
@@ -1,14 +1,12 @@
 import logging
 
-from django.conf import settings
 from django.contrib.auth.mixins import LoginRequiredMixin
-from django.db import transaction
 from django.http import HttpRequest, JsonResponse
 from django.urls import reverse
 from django.views.generic import TemplateView
 
 from accountant.misc import fns_parser
-from accountant.models import Document, Account
+from accountant.models import ClosedPeriodError
 
 logger = logging.getLogger(__name__)
 
@@ -16,29 +14,45 @@ logger = logging.getLogger(__name__)
 class StatementImportView(LoginRequiredMixin, TemplateView):
     template_name = 'accountant/statement_import.html'
 
-    @transaction.atomic
     def post(self, request: HttpRequest, *args, **kwargs):
         statement = request.FILES.get('statement')
         if statement:
-            doc = Document.objects.create(
-                file=statement,
-                invoice=None,
-                description=""
-            )
-
-            default_expense = getattr(settings, 'DEFAULT_EXPENSE', 10)
-            default_account = getattr(settings, 'DEFAULT_ACCOUNT', 2)
-
-            invoice = fns_parser.parse(
-                doc.file.read().decode(),
-                request.user,
-                Account.objects.get(pk=default_expense),
-                Account.objects.get(pk=default_account)
-            )
-            doc.invoice = invoice
-            doc.save()
-
-            result = invoice.json()
-            result['url'] = reverse('accountant:invoice_edit',
-                                    kwargs={'pk': invoice.pk})
-            return JsonResponse(result)
+            try:
+                document, invoices, duplicates = fns_parser.ingest(
+                    statement, request.user)
+            except ClosedPeriodError as e:
+                logger.error('Import of {} failed: {}'.format(statement, e))
+                return JsonResponse({'status': 'error',
+                                     'message': '; '.join(e.messages)},
+                                    status=400)
+            duplicates = [
+                {'id': pk, 'url': reverse('accountant:invoice_detail',
+                                          kwargs={'pk': pk})}
+                for pk in duplicates
+            ]
+            if not invoices and duplicates:
+                return JsonResponse(
+                    {'status': 'error', 'duplicates': duplicates,
+                     'message': 'receipts are imported already'},
+                    status=409
+                )
+            if not invoices:
+                return JsonResponse(
+                    {'status': 'error', 'document': document.json(),
+                     'message': 'no receipts found in {}'.format(document)},
+                    status=400
+                )
+
+            results = list()
+            for invoice in invoices:
+                result = invoice.json()
+                result['url'] = reverse('accountant:invoice_edit',
+                                        kwargs={'pk': invoice.pk})
+                results.append(result)
+            if len(results) == 1 and not duplicates:
+                return JsonResponse(results[0])
+            return JsonResponse({'invoices': results,
+                                 'duplicates': duplicates,
+                                 'document': document.json()})
+        return JsonResponse({'status': 'error', 'message': 'no statement'},
+                            status=400)
@@ -0,0 +1,91 @@
+import json
+import logging
+from decimal import Decimal
+
+from django.conf import settings
+from django.contrib.auth.mixins import LoginRequiredMixin
+from django.core.exceptions import ValidationError
+from django.http import HttpRequest, JsonResponse
+from django.utils import timezone
+from django.views.generic import View
+from moneyed import get_currency, CurrencyDoesNotExist
+
+from accountant.misc.registry import get_registry
+from accountant.models import Invoice, Transaction
+
+logger = logging.getLogger(__name__)
+
+
+class TransactionImportView(LoginRequiredMixin, View):
+    """
+    Batched JSON API for import of invoices with transactions. It expects
+    request body like this one:
+
+    {"invoices": [{"timestamp": "2017-10-15 22:38:00",
+                   "comment": "Supermarket",
+                   "transactions": [{"date": "2017-10-15",
+                                     "account": 2,
+                                     "amount": "-618.89",
+                                     "currency": "RUB",
+                                     "quantity": null,
+                                     "unit": null,
+                                     "comment": "",
+                                     "approved": true}]}]}
+
+    All invoices are validated first and then saved with bulk queries
+    (see `InvoiceQuerySet.ingest`), so a batch is saved completely or not at
+    all.
+    """
+    TRANSACTION_FIELDS = ('date', 'amount', 'currency', 'quantity', 'unit',
+                          'comment', 'approved')
+
+    def get_invoices(self, data: list, user):
+        accounts = get_registry().by_pk
+        result = list()
+        for number, item in enumerate(data):
+            try:
+                invoice = Invoice(timestamp=item['timestamp'],
+                                  comment=item.get('comment', ''),
+                                  user=user)
+                invoice.full_clean(exclude=['user'])
+                if timezone.is_naive(invoice.timestamp):
+                    invoice.timestamp = timezone.make_aware(
+                        invoice.timestamp, settings.DEFAULT_TZ)
+
+                transactions = list()
+                for tx_data in item['transactions']:
+                    if tx_data['account'] not in accounts:
+                        raise ValidationError('unknown account {}'
+                                              .format(tx_data['account']))
+                    transaction = Transaction(
+                        account=accounts[tx_data['account']],
+                        **{key: tx_data[key] for key in self.TRANSACTION_FIELDS
+                           if key in tx_data}
+                    )
+                    transaction.full_clean(exclude=['account', 'invoice'])
+                    transaction.currency = get_currency(
+                        str(transaction.currency))
+                    transactions.append(transaction)
+            except (KeyError, TypeError, ValidationError,
+                    CurrencyDoesNotExist) as e:
+                raise ValidationError('invoice #{}: {}'.format(number, e))
+            result.append((invoice, transactions))
+        return result
+
+    def post(self, request: HttpRequest, *args, **kwargs):
+        try:
+            data = json.loads(request.body.decode(), parse_float=Decimal)
+            invoices = self.get_invoices(data['invoices'], request.user)
+            # Transactions dated by closed period are rejected here
+            saved = Invoice.objects.ingest(invoices)
+        except (ValueError, KeyError, TypeError, ValidationError) as e:
+            logger.error('Import of transactions failed: {}'.format(e))
+            return JsonResponse({'status': 'error', 'message': str(e)},
+                                status=400)
+
+        count = sum(len(transactions) for _, transactions in invoices)
+        logger.info('{} invoices with {} transactions imported'
+                    .format(len(saved), count))
+        return JsonResponse({'status': 'ok',
+                             'invoices': [i.pk for i in saved],
+                             'transactions': count})
@@ -3,11 +3,19 @@ import logging
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.views.generic import ListView
 
+from accountant.misc.paginator import CursorPaginationMixin
 from accountant.models import Transaction
 
 logger = logging.getLogger(__name__)
 
 
-class TransactionListView(LoginRequiredMixin, ListView):
+class TransactionListView(LoginRequiredMixin, CursorPaginationMixin, ListView):
     model = Transaction
-    context_object_name = 'transaction'
\ No newline at end of file
+    context_object_name = 'transaction_list'
+    template_name = 'accountant/transaction_list.html'
+    paginate_by = 50
+    ordering = ('-date', '-pk')
+    approximate_count = True
+
+    def get_queryset(self):
+        return Transaction.objects.select_related('account', 'invoice')
@@ -1,9 +1,12 @@
 from datetime import date
+from decimal import Decimal
 
 from django.conf import settings
+from django.core.cache import cache
 from django.test import TestCase, Client
 from django.urls import reverse
 
+from accountant.misc import rates
 from accountant.models import Account
 from frekenbok.tests.test_data import add_test_data
 from frekenbok.views import DashboardView
@@ -15,6 +18,9 @@ class DashboardViewTestCase(TestCase):
         add_test_data(cls)
 
     def setUp(self):
+        # rendered pages are cached under the ledger version, which is the
+        # same for all tests of the case
+        cache.clear()
         self.client = Client()
         self.client.login(username=self.test_user.username,
                           password=self.test_user_password)
@@ -23,6 +29,7 @@ class DashboardViewTestCase(TestCase):
         self.view = DashboardView()
 
     def tearDown(self):
+        rates.clear_cache()
         del self.view
         del self.client
         del self.context
@@ -69,9 +76,53 @@ class DashboardViewTestCase(TestCase):
         overview = self.context['overview']
 
         self.assertEqual(len(expected_overview), len(overview))
+        table = rates.get_table()
         for account in overview:
-            self.assertEqual(account['weight'],
-                             sum(i['amount'] for i in account['report']))
+            self.assertEqual(
+                account['weight'],
+                table.total((i['currency'], i['amount'], date.today())
+                            for i in account['report'])[0]
+            )
+
+    def test_context_overview_historical(self):
+        table = rates.get_table()
+        for account in self.context['overview']:
+            summary = Account.objects.get(title=account['account'])\
+                .summary_at(date.today())
+            self.assertEqual(len(account['historical']), 29)
+            self.assertEqual(
+                account['historical'][-1],
+                table.total((i['currency'], i['amount'], date.today())
+                            for i in summary)[0]
+            )
+
+    def test_context_net_worth(self):
+        rates.store([('USD', date(2015, 1, 1), Decimal('60')),
+                     ('EUR', date(2015, 1, 1), Decimal('70'))])
+        context = self.client.get(reverse('dashboard')).context
+
+        expected = sum(
+            i['amount'] * {'RUB': 1, 'USD': 60, 'EUR': 70}[i['currency']]
+            for i in context['total']
+            if i['currency'] in ('RUB', 'USD', 'EUR')
+        )
+        self.assertEqual(context['net_worth'], expected)
+        self.assertNotIn('USD', context['net_worth_missing'])
+
+    def test_context_rates_missing(self):
+        currencies = {i['currency'] for i in self.context['total']} - \
+            {settings.BASE_CURRENCY}
+        self.assertTrue(currencies)
+        self.assertEqual(self.context['rates_missing'], sorted(currencies))
+        for account in self.context['overview']:
+            self.assertEqual(
+                account['missing'],
+                sorted({i['currency'] for i in account['report']} -
+                       {settings.BASE_CURRENCY})
+            )
+        self.assertContains(self.client.get(reverse('dashboard')),
+                            'No rate for {}'.format(', '.join(
+                                sorted(currencies))))
 
     def test_login_less_request(self):
         client = Client()
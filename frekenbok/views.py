@@ -6,10 +6,12 @@ from django.contrib.auth.mixins import LoginRequiredMixin
 from django.db.models import F, Q
 from django.views.generic import ListView
 
+from accountant.misc import rates
+from accountant.misc.caching import LedgerCacheMixin
 from accountant.models import Account
 
 
-class DashboardView(LoginRequiredMixin, ListView):
+class DashboardView(LoginRequiredMixin, LedgerCacheMixin, ListView):
     model = Account
     context_object_name = 'account_list'
     template_name = 'dashboard.html'
@@ -22,7 +24,8 @@ class DashboardView(LoginRequiredMixin, ListView):
         '''
         return self.model.objects\
             .filter(type=Account.ACCOUNT, lft__exact=F('rgt') - 1)\
-            .filter(Q(closed__gte=date.today()) | Q(closed=None))
+            .filter(Q(closed__gte=date.today()) | Q(closed=None))\
+            .with_sheaves()
 
     def get_context_data(self, **kwargs):
         context = super(DashboardView, self).get_context_data(**kwargs)
@@ -44,25 +47,42 @@ class DashboardView(LoginRequiredMixin, ListView):
                 total_report.append(report_line)
 
         today = date.today()
+        rate_table = rates.get_table()
+        net_worth, net_worth_missing = rate_table.total(
+            (i['currency'], i['amount'], today) for i in total_report)
+        # Currencies without rates aren't included to totals, they're shown
+        # instead of silently understated totals
+        missing = set(net_worth_missing)
+
         overview_dates = [today - timedelta(days=i) for i in range(28, -1, -1)]
         overview = list()
         for account in self.model.objects.filter(type=Account.ACCOUNT, dashboard=True):
             report = account.tree_summary()
-            item = {
+            weight, weight_missing = rate_table.total(
+                (i['currency'], i['amount'], today) for i in report)
+            historical = list()
+            for day, summary in zip(overview_dates,
+                                    account.balance_history(overview_dates)):
+                amount, day_missing = rate_table.total(
+                    (currency, amount, day)
+                    for currency, amount in summary.items())
+                historical.append(amount)
+                weight_missing |= day_missing
+            missing |= weight_missing
+            overview.append({
                 'account': account.title,
                 'report': report,
-                'weight': sum(i['amount'] for i in report),
-                # TODO We should try to guess currency here
+                'weight': weight,
                 'weight_currency': settings.BASE_CURRENCY,
-                'historical': []
-            }
-            for summary in [account.summary_at(i) for i in overview_dates]:
-                for i in summary:
-                    if i['currency'] == settings.BASE_CURRENCY:
-                        item['historical'].append(i['amount'])
-            overview.append(item)
+                'historical': historical,
+                'missing': sorted(weight_missing)
+            })
 
         context['overview'] = overview
         context['total'] = total_report
+        context['net_worth'] = net_worth
+        context['net_worth_missing'] = sorted(net_worth_missing)
+        context['rates_missing'] = sorted(missing)
+        context['base_currency'] = settings.BASE_CURRENCY
         context['menu_dashboard'] = True
         return context